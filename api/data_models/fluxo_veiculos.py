@@ -1,7 +1,9 @@
 """
 Fluxo Veiculos Model - Cached access to alocadores.fluxo_veiculos table.
 
-Table: alocadores.fluxo_veiculos
+Table: alocadores.fluxo_veiculos (view: latest month-end of the history table)
+       alocadores.fluxo_veiculos_historico (every month-end, built incrementally
+       by data/calcular_fluxo_veiculos_v2.py)
 
 Columns (actual as of 2026-01-28):
 --------
@@ -99,7 +101,8 @@ def get_fluxo_aggregated_by_peer() -> pd.DataFrame:
     """
     Returns flow data aggregated by (dt_comptc, peer_ativo).
     
-    Sums the flow columns across all funds within each peer.
+    Sums the flow columns across all funds within each peer, for every
+    month-end in alocadores.fluxo_veiculos_historico (e.g. 12M flow evolution).
     
     Returns:
         pd.DataFrame: Aggregated flow data.
@@ -117,7 +120,7 @@ def get_fluxo_aggregated_by_peer() -> pd.DataFrame:
             SUM(fluxo_48m) as fluxo_48m,
             SUM(fluxo_60m) as fluxo_60m,
             COUNT(DISTINCT cnpj_fundo) as num_fundos
-        FROM alocadores.fluxo_veiculos
+        FROM alocadores.fluxo_veiculos_historico
         GROUP BY dt_comptc, peer_ativo
         ORDER BY dt_comptc, peer_ativo
     """
@@ -4,6 +4,9 @@ Fund History Model - Access to quota history and performance metrics raw data.
 
 Tables:
 - cvm.cotas
+- cvm.metrics_perfil
+- cvm.metrics_prefixo
+- middle.indices_cotas
 """
 
 import sys
@@ -61,5 +64,102 @@ def get_fund_metrics_raw(cnpj: str) -> pd.DataFrame:
     """
     db = PostgresConnector()
     
-    sql = f"SELECT dt_comptc, vl_quota FROM cvm.cotas WHERE cnpj_fundo = '{cnpj}' ORDER BY dt_comptc ASC"
+    # Main series only (same rule as common.metrics.main_series): class quota, else lowest subclass
+    sql = f"""
+        SELECT dt_comptc, vl_quota FROM cvm.cotas
+        WHERE cnpj_fundo = '{cnpj}'
+          AND COALESCE(TEXT(id_subclasse), 'MASTER') = (
+              SELECT COALESCE(TEXT(id_subclasse), 'MASTER') FROM cvm.cotas
+              WHERE cnpj_fundo = '{cnpj}'
+              ORDER BY id_subclasse IS NOT NULL, TEXT(id_subclasse) LIMIT 1)
+        ORDER BY dt_comptc ASC
+    """
+    return db.read_sql(sql)
+
+@temp()
+def get_fund_profile_row(cnpj: str) -> pd.DataFrame:
+    """
+    Fetches the precomputed return profile of a fund (single PK lookup).
+    
+    Tables: cvm.metrics_perfil (built by data/project_metrics_perfil.py)
+    Columns: payload (JSONB with the /funds/{cnpj}/metrics response), dt_ref
+    
+    Args:
+        cnpj: CNPJ string
+        
+    Returns:
+        pd.DataFrame: Zero or one row
+    """
+    db = PostgresConnector()
+    
+    sql = f"SELECT payload, dt_ref FROM cvm.metrics_perfil WHERE cnpj_fundo = '{cnpj}'"
+    return db.read_sql(sql)
+
+@temp()
+def get_benchmark_series(codigo: str = 'CDINI') -> pd.DataFrame:
+    """
+    Fetches the index level series of a benchmark (e.g. CDINI for the risk-free rate).
+    
+    Tables: middle.indices_cotas
+    Columns: data, valor
+    
+    Args:
+        codigo: Benchmark code (CDINI, IBOV, IPCADIANI, DOLAR_VENDA)
+        
+    Returns:
+        pd.DataFrame: Time series of index levels
+    """
+    db = PostgresConnector()
+    
+    codigo = codigo.replace("'", "''")
+    sql = f"SELECT data, valor FROM middle.indices_cotas WHERE codigo = '{codigo}' ORDER BY data ASC"
+    return db.read_sql(sql)
+
+@temp()
+def get_fund_prefix_rows(cnpj: str, start_date: date, end_date: Optional[date] = None) -> pd.DataFrame:
+    """
+    Fetches the rolling-statistics index rows that bound a date range.
+    
+    Tables: cvm.metrics_prefixo (built by data/project_metrics_prefixo.py), cvm.fi_cad_fi_hist_classe
+    Columns: posicao ('ini', 'ini_pos' or 'fim'), dt_comptc, n_ret, s_ret, s_ret2, s_cdi, s_ibov, classe
+    
+    The index holds one series per (fund, subclass); the class series ('MASTER')
+    is used when present, otherwise the lowest subclass id, so all three probes
+    read the same series.
+    
+    Args:
+        cnpj: CNPJ string
+        start_date: Range start (row at or before it is the anchor)
+        end_date: Range end (row at or before it); None for the latest row
+        
+    Returns:
+        pd.DataFrame: Up to three rows, each one a PK index probe
+    """
+    db = PostgresConnector()
+    
+    cols = "dt_comptc, n_ret, s_ret, s_ret2, s_cdi, s_ibov"
+    fim_filter = f"AND dt_comptc <= '{end_date}'" if end_date else ""
+    serie = f"""cnpj_fundo = '{cnpj}' AND id_subclasse = COALESCE(
+                (SELECT id_subclasse FROM cvm.metrics_prefixo
+                 WHERE cnpj_fundo = '{cnpj}' AND id_subclasse = 'MASTER' LIMIT 1),
+                (SELECT MIN(id_subclasse) FROM cvm.metrics_prefixo WHERE cnpj_fundo = '{cnpj}'))"""
+    sql = f"""
+        WITH limites AS (
+            (SELECT 'ini' AS posicao, {cols} FROM cvm.metrics_prefixo
+             WHERE {serie} AND dt_comptc <= '{start_date}'
+             ORDER BY dt_comptc DESC LIMIT 1)
+            UNION ALL
+            (SELECT 'ini_pos' AS posicao, {cols} FROM cvm.metrics_prefixo
+             WHERE {serie} AND dt_comptc >= '{start_date}'
+             ORDER BY dt_comptc ASC LIMIT 1)
+            UNION ALL
+            (SELECT 'fim' AS posicao, {cols} FROM cvm.metrics_prefixo
+             WHERE {serie} {fim_filter}
+             ORDER BY dt_comptc DESC LIMIT 1)
+        )
+        SELECT l.*,
+               (SELECT classe FROM cvm.fi_cad_fi_hist_classe
+                WHERE cnpj_fundo = '{cnpj}' LIMIT 1) AS classe
+        FROM limites l
+    """
     return db.read_sql(sql)
@@ -17,7 +17,8 @@ Tables:
 import sys
 import os
 import pandas as pd
-from typing import Dict, Any, List
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Iterable
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 from common.postgresql import PostgresConnector
@@ -60,3 +61,35 @@ def get_portfolio_block_data(cnpj: str, date_str: str, block_num: int) -> pd.Dat
         WHERE cnpj_fundo = '{cnpj}' AND dt_comptc = '{date_str}'
     """
     return db.read_sql(sql)
+
+@temp()
+def get_portfolio_blocks(cnpj: str, date_str: str, block_nums: Iterable[int] = tuple(range(1, 9))) -> Dict[int, pd.DataFrame]:
+    """
+    Fetches several CVM portfolio blocks for one fund/date at once.
+
+    The blocks have different columns, so instead of a unified projection each block is
+    queried concurrently over a single connection pool (one engine, one round trip per
+    block in parallel). Cached as a whole: calling get_portfolio_block_data per block
+    would serialize on its cache lock and open one engine per call.
+
+    Args:
+        cnpj: Fund CNPJ
+        date_str: Date filter (YYYY-MM-DD)
+        block_nums: Block numbers (1-8)
+
+    Returns:
+        Dict[int, pd.DataFrame]: Raw block data by block number (empty DataFrame if none)
+    """
+    db = PostgresConnector()
+    block_nums = list(block_nums)
+
+    def fetch(block_num):
+        sql = f"""
+            SELECT *
+            FROM cvm.cda_fi_blc_{block_num}
+            WHERE cnpj_fundo = '{cnpj}' AND dt_comptc = '{date_str}'
+        """
+        return db.read_sql(sql)
+
+    with ThreadPoolExecutor(max_workers=len(block_nums) or 1) as pool:
+        return dict(zip(block_nums, pool.map(fetch, block_nums)))
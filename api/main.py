@@ -303,6 +303,24 @@ def get_fund_metrics(cnpj: str = Path(...)):
     return result
 
 
+@app.get("/funds/{cnpj:path}/metrics/range")
+def get_fund_metrics_range(
+    cnpj: str = Path(...),
+    start_date: date = Query(..., description="Range start (YYYY-MM-DD)"),
+    end_date: Optional[date] = Query(None, description="Range end (YYYY-MM-DD), defaults to the latest quota")
+):
+    """Get return, volatility, sharpe and info ratio for an arbitrary date range."""
+    result = _execute_with_dedup(
+        "fund_metrics_range",
+        f"cnpj={cnpj}&start_date={start_date}&end_date={end_date}",
+        service.get_fund_metrics_range,
+        cnpj, start_date, end_date
+    )
+    if not result:
+        raise HTTPException(status_code=404, detail="Metrics not found for this range")
+    return result
+
+
 @app.get("/funds/{cnpj:path}/composition")
 def get_fund_composition(cnpj: str = Path(...)):
     """Get portfolio composition summary by asset type."""
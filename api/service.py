@@ -17,6 +17,7 @@ try:
         FundStructure, TopAsset
     )
     from common.cache import cache, temp
+    from common.metrics import fund_profile, range_to_dict
     from .data_models import fund_details, fund_history, portfolio, peer_groups
 except ImportError:
     from models import (
@@ -25,8 +26,30 @@ except ImportError:
         FundStructure, TopAsset
     )
     from common.cache import cache, temp
+    from common.metrics import fund_profile, range_to_dict
     from data_models import fund_details, fund_history, portfolio, peer_groups
 
+def _agrupar(df: pd.DataFrame, chaves: List[str]) -> pd.DataFrame:
+    """Soma vl_merc_pos_final por chaves, maiores posições primeiro."""
+    df_g = df.groupby(chaves)['vl_merc_pos_final'].sum().reset_index()
+    return df_g.sort_values('vl_merc_pos_final', ascending=False)
+
+
+def _texto(s: pd.Series, default: Optional[str] = '') -> pd.Series:
+    """Vetorizado de `valor or default`: vazio/nulo vira default."""
+    s = s.astype(object)
+    return s.where(s.notna() & s.ne(''), default)
+
+
+def _percentual(valor: pd.Series, pl_total: float) -> pd.Series:
+    return ((valor / pl_total) * 100).round(2)
+
+
+def _registros(**colunas) -> List[dict]:
+    """Lista de ativos (dicts) a partir de colunas alinhadas, sem iterrows."""
+    return pd.DataFrame(colunas).to_dict('records')
+
+
 class DataService:
     def __init__(self):
         # DB access is now handled by models, but we might keep db for edge cases if needed.
@@ -195,79 +218,32 @@ class DataService:
 
         clean_cnpj = self._normalize_cnpj(cnpj)
         
-        # Get raw data from model
+        # Precomputed profile (cvm.metrics_perfil): single indexed row
+        df_perfil = fund_history.get_fund_profile_row(clean_cnpj)
+        if not df_perfil.empty and df_perfil.iloc[0]['payload']:
+            return df_perfil.iloc[0]['payload']
+        
+        # Fallback: compute from the raw quota series
         df = fund_history.get_fund_metrics_raw(clean_cnpj)
         
         if df.empty:
             return None
             
-        df['dt_comptc'] = pd.to_datetime(df['dt_comptc'])
-        df = df.set_index('dt_comptc')
-        
-        df['ret'] = df['vl_quota'].pct_change()
-        
-        df_m = df['vl_quota'].resample('ME').last()
-        df_m_ret = df_m.pct_change()
-        
-        rent_mes = {}
-        rent_ano = {}
+        # Same kernel used by the batch metrics job (common/metrics.py)
+        quotas = df.set_index('dt_comptc')['vl_quota']
+        df_cdi = fund_history.get_benchmark_series('CDINI')
+        cdi = df_cdi.set_index('data')['valor'] if not df_cdi.empty else None
         
-        years = df_m_ret.index.year.unique()
-        for y in years:
-            year_data = df_m_ret[df_m_ret.index.year == y]
-            rent_mes[int(y)] = {m: round(v * 100, 2) for m, v in zip(year_data.index.month, year_data.values) if pd.notnull(v)}
-            
-            try:
-                end_q = df_m[df_m.index.year == y].iloc[-1]
-                prev_year_data = df_m[df_m.index.year == y-1]
-                if not prev_year_data.empty:
-                    start_q = prev_year_data.iloc[-1]
-                    rent_ano[int(y)] = round(((end_q / start_q) - 1) * 100, 2)
-                else:
-                    first_q = df['vl_quota'][df.index.year == y].iloc[0]
-                    rent_ano[int(y)] = round(((end_q / first_q) - 1) * 100, 2)
-            except:
-                rent_ano[int(y)] = 0.0
+        return fund_profile(quotas, cdi)
 
-        first_q = df['vl_quota'].iloc[0]
-        rent_accum = {}
+    @temp()
+    def get_fund_metrics_range(self, cnpj: str, start_date: date, end_date: date = None) -> Optional[dict]:
+        clean_cnpj = self._normalize_cnpj(cnpj)
         
-        for y in years:
-            try:
-                end_q_y = df_m[df_m.index.year == y].iloc[-1]
-                rent_accum[int(y)] = round(((end_q_y / first_q) - 1) * 100, 2)
-            except:
-                pass
-
-        vol_12m = 0.0
-        if len(df) > 252:
-            last_252 = df['ret'].tail(252)
-            vol_12m = float(last_252.std() * np.sqrt(252) * 100)
-            
-        sharpe = 0.0
-        if vol_12m > 0 and len(df) > 252:
-            price_now = df['vl_quota'].iloc[-1]
-            price_12m_ago = df['vl_quota'].iloc[-252]
-            ret_12m = (price_now / price_12m_ago) - 1
-            sharpe = (ret_12m * 100 - 10) / vol_12m
-             
-        total_months = len(df_m_ret)
-        pos_months = len(df_m_ret[df_m_ret > 0])
-        neg_months = len(df_m_ret[df_m_ret < 0])
+        # Two rows of the prefix-sum index (cvm.metrics_prefixo) bound the range
+        df = fund_history.get_fund_prefix_rows(clean_cnpj, start_date, end_date)
         
-        return {
-            "rentabilidade_mes": rent_mes,
-            "rentabilidade_ano": rent_ano,
-            "rentabilidade_acumulada": rent_accum,
-            "volatilidade_12m": round(vol_12m, 2),
-            "sharpe_12m": round(sharpe, 2),
-            "consistency": {
-                "pos_months": pos_months,
-                "neg_months": neg_months,
-                "best_month": round(df_m_ret.max() * 100, 2) if not df_m_ret.empty else 0,
-                "worst_month": round(df_m_ret.min() * 100, 2) if not df_m_ret.empty else 0
-            }
-        }
+        return range_to_dict(df)
 
     # ========================================================================
     # FUND COMPOSITION (RESUMO)
@@ -304,8 +280,9 @@ class DataService:
             'Demais Ativos': 8
         }
         
+        dfs = portfolio.get_portfolio_blocks(clean_cnpj, date_str, tuple(blocks.values()))
         for name, num in blocks.items():
-            df = portfolio.get_portfolio_block_data(clean_cnpj, date_str, num)
+            df = dfs[num]
             if not df.empty:
                 val = df['vl_merc_pos_final'].sum()
                 if val > 0:
@@ -349,132 +326,75 @@ class DataService:
         
         blocos = []
         resumo = {}
+
+        # Todos os blocos numa ida só (consultas concorrentes)
+        dfs = portfolio.get_portfolio_blocks(clean_cnpj, date_str, (1, 2, 4, 5, 7))
         
         # --- BLC 1: Títulos Públicos ---
-        df = portfolio.get_portfolio_block_data(clean_cnpj, date_str, 1)
+        df = dfs[1]
         if not df.empty:
             # Aggregation logic specific to block types
-            df_g = df.groupby(['tp_titpub', 'tp_ativo', 'dt_venc'])['vl_merc_pos_final'].sum().reset_index()
-            df_g = df_g.sort_values('vl_merc_pos_final', ascending=False)
-            
-            ativos = []
-            for _, row in df_g.iterrows():
-                ativos.append({
-                    "nome": f"{row['tp_titpub'] or ''} - {row['tp_ativo'] or 'Título'}".strip(' -'),
-                    "valor": float(row['vl_merc_pos_final']),
-                    "percentual": round((row['vl_merc_pos_final'] / pl_total) * 100, 2),
-                    "dt_venc": str(row['dt_venc']) if pd.notnull(row['dt_venc']) else None
-                })
-            
-            total_blc = df_g['vl_merc_pos_final'].sum()
-            blocos.append({
-                "tipo": "titulos_publicos",
-                "nome_display": "Títulos Públicos",
-                "total_valor": float(total_blc),
-                "total_percentual": round((total_blc / pl_total) * 100, 2),
-                "ativos": ativos
-            })
+            df_g = _agrupar(df, ['tp_titpub', 'tp_ativo', 'dt_venc'])
+            ativos = _registros(
+                nome=(_texto(df_g['tp_titpub']) + ' - ' + _texto(df_g['tp_ativo'], 'Título')).str.strip(' -'),
+                valor=df_g['vl_merc_pos_final'],
+                percentual=_percentual(df_g['vl_merc_pos_final'], pl_total),
+                dt_venc=df_g['dt_venc'].map(str).where(df_g['dt_venc'].notna(), None)
+            )
+            total_blc = self._append_bloco(blocos, "titulos_publicos", "Títulos Públicos", df_g, pl_total, ativos)
             resumo["Títulos Públicos"] = round((total_blc / pl_total) * 100, 2)
         
         # --- BLC 2: Cotas de Fundos ---
-        df = portfolio.get_portfolio_block_data(clean_cnpj, date_str, 2)
+        df = dfs[2]
         if not df.empty:
-            df_g = df.groupby(['nm_fundo_cota', 'cnpj_fundo_cota'])['vl_merc_pos_final'].sum().reset_index()
-            df_g = df_g.sort_values('vl_merc_pos_final', ascending=False)
-            
-            ativos = []
-            for _, row in df_g.iterrows():
-                ativos.append({
-                    "nome": row['nm_fundo_cota'] or "Fundo",
-                    "valor": float(row['vl_merc_pos_final']),
-                    "percentual": round((row['vl_merc_pos_final'] / pl_total) * 100, 2),
-                    "cnpj_emissor": row['cnpj_fundo_cota']
-                })
-            
-            total_blc = df_g['vl_merc_pos_final'].sum()
-            blocos.append({
-                "tipo": "cotas_fundos",
-                "nome_display": "Cotas de Fundos",
-                "total_valor": float(total_blc),
-                "total_percentual": round((total_blc / pl_total) * 100, 2),
-                "ativos": ativos
-            })
+            df_g = _agrupar(df, ['nm_fundo_cota', 'cnpj_fundo_cota'])
+            ativos = _registros(
+                nome=_texto(df_g['nm_fundo_cota'], 'Fundo'),
+                valor=df_g['vl_merc_pos_final'],
+                percentual=_percentual(df_g['vl_merc_pos_final'], pl_total),
+                cnpj_emissor=df_g['cnpj_fundo_cota']
+            )
+            total_blc = self._append_bloco(blocos, "cotas_fundos", "Cotas de Fundos", df_g, pl_total, ativos)
             resumo["Cotas de Fundos"] = round((total_blc / pl_total) * 100, 2)
 
         # --- BLC 4: Ações/Derivativos ---
-        df = portfolio.get_portfolio_block_data(clean_cnpj, date_str, 4)
+        df = dfs[4]
         if not df.empty:
-            df_g = df.groupby(['cd_ativo', 'ds_ativo'])['vl_merc_pos_final'].sum().reset_index()
-            df_g = df_g.sort_values('vl_merc_pos_final', ascending=False)
-            
-            ativos = []
-            for _, row in df_g.iterrows():
-                ativos.append({
-                    "nome": f"{row['cd_ativo'] or ''} - {row['ds_ativo'] or 'Ativo'}".strip(' -'),
-                    "valor": float(row['vl_merc_pos_final']),
-                    "percentual": round((row['vl_merc_pos_final'] / pl_total) * 100, 2),
-                    "tipo": "acao"
-                })
-            
-            total_blc = df_g['vl_merc_pos_final'].sum()
-            blocos.append({
-                "tipo": "acoes_derivativos",
-                "nome_display": "Ações e Derivativos",
-                "total_valor": float(total_blc),
-                "total_percentual": round((total_blc / pl_total) * 100, 2),
-                "ativos": ativos
-            })
+            df_g = _agrupar(df, ['cd_ativo', 'ds_ativo'])
+            ativos = _registros(
+                nome=(_texto(df_g['cd_ativo']) + ' - ' + _texto(df_g['ds_ativo'], 'Ativo')).str.strip(' -'),
+                valor=df_g['vl_merc_pos_final'],
+                percentual=_percentual(df_g['vl_merc_pos_final'], pl_total),
+                tipo="acao"
+            )
+            total_blc = self._append_bloco(blocos, "acoes_derivativos", "Ações e Derivativos", df_g, pl_total, ativos)
             resumo["Ações e Derivativos"] = round((total_blc / pl_total) * 100, 2)
 
         # --- BLC 5: Crédito Privado ---
-        df = portfolio.get_portfolio_block_data(clean_cnpj, date_str, 5)
+        df = dfs[5]
         if not df.empty:
-            df_g = df.groupby(['emissor', 'cnpj_emissor', 'dt_venc'])['vl_merc_pos_final'].sum().reset_index()
-            df_g = df_g.sort_values('vl_merc_pos_final', ascending=False)
-            
-            ativos = []
-            for _, row in df_g.iterrows():
-                ativos.append({
-                    "nome": row['emissor'] or "Emissor",
-                    "valor": float(row['vl_merc_pos_final']),
-                    "percentual": round((row['vl_merc_pos_final'] / pl_total) * 100, 2),
-                    "cnpj_emissor": row['cnpj_emissor'],
-                    "dt_venc": str(row['dt_venc']) if pd.notnull(row['dt_venc']) else None
-                })
-            
-            total_blc = df_g['vl_merc_pos_final'].sum()
-            blocos.append({
-                "tipo": "credito_privado",
-                "nome_display": "Crédito Privado",
-                "total_valor": float(total_blc),
-                "total_percentual": round((total_blc / pl_total) * 100, 2),
-                "ativos": ativos
-            })
+            df_g = _agrupar(df, ['emissor', 'cnpj_emissor', 'dt_venc'])
+            ativos = _registros(
+                nome=_texto(df_g['emissor'], 'Emissor'),
+                valor=df_g['vl_merc_pos_final'],
+                percentual=_percentual(df_g['vl_merc_pos_final'], pl_total),
+                cnpj_emissor=df_g['cnpj_emissor'],
+                dt_venc=df_g['dt_venc'].map(str).where(df_g['dt_venc'].notna(), None)
+            )
+            total_blc = self._append_bloco(blocos, "credito_privado", "Crédito Privado", df_g, pl_total, ativos)
             resumo["Crédito Privado"] = round((total_blc / pl_total) * 100, 2)
 
         # --- BLC 7: Exterior ---
-        df = portfolio.get_portfolio_block_data(clean_cnpj, date_str, 7)
+        df = dfs[7]
         if not df.empty:
-            df_g = df.groupby(['ds_ativo_exterior', 'pais'])['vl_merc_pos_final'].sum().reset_index()
-            df_g = df_g.sort_values('vl_merc_pos_final', ascending=False)
-            
-            ativos = []
-            for _, row in df_g.iterrows():
-                ativos.append({
-                    "nome": row['ds_ativo_exterior'] or "Ativo Exterior",
-                    "valor": float(row['vl_merc_pos_final']),
-                    "percentual": round((row['vl_merc_pos_final'] / pl_total) * 100, 2),
-                    "extra": {"pais": row['pais']}
-                })
-            
-            total_blc = df_g['vl_merc_pos_final'].sum()
-            blocos.append({
-                "tipo": "exterior",
-                "nome_display": "Investimentos no Exterior",
-                "total_valor": float(total_blc),
-                "total_percentual": round((total_blc / pl_total) * 100, 2),
-                "ativos": ativos
-            })
+            df_g = _agrupar(df, ['ds_ativo_exterior', 'pais'])
+            ativos = _registros(
+                nome=_texto(df_g['ds_ativo_exterior'], 'Ativo Exterior'),
+                valor=df_g['vl_merc_pos_final'],
+                percentual=_percentual(df_g['vl_merc_pos_final'], pl_total),
+                extra=pd.Series([{"pais": p} for p in df_g['pais']], index=df_g.index, dtype=object)
+            )
+            total_blc = self._append_bloco(blocos, "exterior", "Investimentos no Exterior", df_g, pl_total, ativos)
             resumo["Exterior"] = round((total_blc / pl_total) * 100, 2)
         
         return {
@@ -485,6 +405,20 @@ class DataService:
             "resumo": resumo
         }
 
+    def _append_bloco(self, blocos: list, tipo: str, nome_display: str,
+                      df_g: pd.DataFrame, pl_total: float, ativos: List[dict]) -> float:
+        """Adiciona o bloco (totais + ativos) e retorna o total do bloco."""
+        total_blc = df_g['vl_merc_pos_final'].sum()
+        blocos.append({
+            "tipo": tipo,
+            "nome_display": nome_display,
+            "total_valor": float(total_blc),
+            "total_percentual": round((total_blc / pl_total) * 100, 2),
+            "ativos": ativos
+        })
+        return total_blc
+
+
     # ========================================================================
     # FUND STRUCTURE (RELACIONAMENTOS)
     # ========================================================================
@@ -556,59 +490,56 @@ class DataService:
         date_str = str(df_date.iloc[0]['max_date'])
         pl_total = float(df_date.iloc[0]['pl'] or 1)
         
+        dfs = portfolio.get_portfolio_blocks(clean_cnpj, date_str, (1, 2, 4, 5))
         all_assets = []
         
         # BLC 4 (Ações)
-        df = portfolio.get_portfolio_block_data(clean_cnpj, date_str, 4)
+        df = dfs[4]
         if not df.empty:
             df_g = df.groupby(['cd_ativo', 'ds_ativo'])['vl_merc_pos_final'].sum().reset_index()
-            for _, row in df_g.iterrows():
-                all_assets.append({
-                    "codigo": row['cd_ativo'],
-                    "nome": row['ds_ativo'] or row['cd_ativo'] or "Ativo",
-                    "valor": float(row['vl_merc_pos_final']),
-                    "percentual": round((row['vl_merc_pos_final'] / pl_total) * 100, 2),
-                    "tipo": "acao"
-                })
+            all_assets += _registros(
+                codigo=df_g['cd_ativo'],
+                nome=_texto(df_g['ds_ativo'], None).fillna(_texto(df_g['cd_ativo'], 'Ativo')),
+                valor=df_g['vl_merc_pos_final'],
+                percentual=_percentual(df_g['vl_merc_pos_final'], pl_total),
+                tipo="acao"
+            )
         
         # BLC 2 (Fundos)
-        df = portfolio.get_portfolio_block_data(clean_cnpj, date_str, 2)
+        df = dfs[2]
         if not df.empty:
             df_g = df.groupby(['nm_fundo_cota', 'cnpj_fundo_cota'])['vl_merc_pos_final'].sum().reset_index()
-            for _, row in df_g.iterrows():
-                all_assets.append({
-                    "codigo": row['cnpj_fundo_cota'],
-                    "nome": row['nm_fundo_cota'] or "Fundo",
-                    "valor": float(row['vl_merc_pos_final']),
-                    "percentual": round((row['vl_merc_pos_final'] / pl_total) * 100, 2),
-                    "tipo": "cota_fundo"
-                })
+            all_assets += _registros(
+                codigo=df_g['cnpj_fundo_cota'],
+                nome=_texto(df_g['nm_fundo_cota'], 'Fundo'),
+                valor=df_g['vl_merc_pos_final'],
+                percentual=_percentual(df_g['vl_merc_pos_final'], pl_total),
+                tipo="cota_fundo"
+            )
 
         # BLC 1 (Títulos Públicos)
-        df = portfolio.get_portfolio_block_data(clean_cnpj, date_str, 1)
+        df = dfs[1]
         if not df.empty:
             df_g = df.groupby(['tp_titpub', 'tp_ativo'])['vl_merc_pos_final'].sum().reset_index()
-            for _, row in df_g.iterrows():
-                all_assets.append({
-                    "codigo": row['tp_titpub'],
-                    "nome": f"{row['tp_titpub'] or ''} {row['tp_ativo'] or ''}".strip(),
-                    "valor": float(row['vl_merc_pos_final']),
-                    "percentual": round((row['vl_merc_pos_final'] / pl_total) * 100, 2),
-                    "tipo": "titulo_publico"
-                })
+            all_assets += _registros(
+                codigo=df_g['tp_titpub'],
+                nome=(_texto(df_g['tp_titpub']) + ' ' + _texto(df_g['tp_ativo'])).str.strip(),
+                valor=df_g['vl_merc_pos_final'],
+                percentual=_percentual(df_g['vl_merc_pos_final'], pl_total),
+                tipo="titulo_publico"
+            )
 
         # BLC 5 (Crédito Privado)
-        df = portfolio.get_portfolio_block_data(clean_cnpj, date_str, 5)
+        df = dfs[5]
         if not df.empty:
             df_g = df.groupby(['emissor', 'cnpj_emissor'])['vl_merc_pos_final'].sum().reset_index()
-            for _, row in df_g.iterrows():
-                all_assets.append({
-                    "codigo": row['cnpj_emissor'],
-                    "nome": row['emissor'] or "Emissor",
-                    "valor": float(row['vl_merc_pos_final']),
-                    "percentual": round((row['vl_merc_pos_final'] / pl_total) * 100, 2),
-                    "tipo": "credito_privado"
-                })
+            all_assets += _registros(
+                codigo=df_g['cnpj_emissor'],
+                nome=_texto(df_g['emissor'], 'Emissor'),
+                valor=df_g['vl_merc_pos_final'],
+                percentual=_percentual(df_g['vl_merc_pos_final'], pl_total),
+                tipo="credito_privado"
+            )
         
         # Sort and limit
         all_assets.sort(key=lambda x: -x['valor'])
@@ -73,15 +73,77 @@ class FundRepository(BaseRepository):
 
     @temp()
     def get_quota_series(self, cnpj: str) -> pd.DataFrame:
-        """Série de cotas para cálculo de métricas."""
+        """
+        Série de cotas para cálculo de métricas: só a série principal do fundo (cota da
+        classe ou, sem ela, a menor subclasse), como common.metrics.main_series.
+        """
         sql = f"""
             SELECT dt_comptc, vl_quota
             FROM cvm.cotas
             WHERE cnpj_fundo = '{cnpj}'
+              AND COALESCE(TEXT(id_subclasse), 'MASTER') = (
+                  SELECT COALESCE(TEXT(id_subclasse), 'MASTER') FROM cvm.cotas
+                  WHERE cnpj_fundo = '{cnpj}'
+                  ORDER BY id_subclasse IS NOT NULL, TEXT(id_subclasse) LIMIT 1)
             ORDER BY dt_comptc ASC
         """
         return self.db.read_sql(sql)
 
+    @temp()
+    def get_profile(self, cnpj: str) -> pd.DataFrame:
+        """Perfil de rentabilidade pré-calculado (cvm.metrics_perfil, busca pela PK)."""
+        sql = f"""
+            SELECT payload, dt_ref
+            FROM cvm.metrics_perfil
+            WHERE cnpj_fundo = '{cnpj}'
+        """
+        return self.db.read_sql(sql)
+
+    @temp()
+    def get_prefix_rows(self, cnpj: str, start_date: date, end_date: Optional[date] = None) -> pd.DataFrame:
+        """
+        Linhas de cvm.metrics_prefixo que delimitam o intervalo (3 buscas pela PK).
+        As três vêm da mesma série: a da classe ('MASTER') ou, sem ela, a menor subclasse.
+        """
+        cols = "dt_comptc, n_ret, s_ret, s_ret2, s_cdi, s_ibov"
+        fim_filter = f"AND dt_comptc <= '{end_date}'" if end_date else ""
+        serie = f"""cnpj_fundo = '{cnpj}' AND id_subclasse = COALESCE(
+                    (SELECT id_subclasse FROM cvm.metrics_prefixo
+                     WHERE cnpj_fundo = '{cnpj}' AND id_subclasse = 'MASTER' LIMIT 1),
+                    (SELECT MIN(id_subclasse) FROM cvm.metrics_prefixo WHERE cnpj_fundo = '{cnpj}'))"""
+        sql = f"""
+            WITH limites AS (
+                (SELECT 'ini' AS posicao, {cols} FROM cvm.metrics_prefixo
+                 WHERE {serie} AND dt_comptc <= '{start_date}'
+                 ORDER BY dt_comptc DESC LIMIT 1)
+                UNION ALL
+                (SELECT 'ini_pos' AS posicao, {cols} FROM cvm.metrics_prefixo
+                 WHERE {serie} AND dt_comptc >= '{start_date}'
+                 ORDER BY dt_comptc ASC LIMIT 1)
+                UNION ALL
+                (SELECT 'fim' AS posicao, {cols} FROM cvm.metrics_prefixo
+                 WHERE {serie} {fim_filter}
+                 ORDER BY dt_comptc DESC LIMIT 1)
+            )
+            SELECT l.*,
+                   (SELECT classe FROM cvm.fi_cad_fi_hist_classe
+                    WHERE cnpj_fundo = '{cnpj}' LIMIT 1) AS classe
+            FROM limites l
+        """
+        return self.db.read_sql(sql)
+
+    @temp()
+    def get_benchmark_series(self, codigo: str = "CDINI") -> pd.DataFrame:
+        """Série de índice de um benchmark (CDINI = taxa livre de risco)."""
+        codigo = codigo.replace("'", "''")
+        sql = f"""
+            SELECT data, valor
+            FROM middle.indices_cotas
+            WHERE codigo = '{codigo}'
+            ORDER BY data ASC
+        """
+        return self.db.read_sql(sql)
+
     # ── PORTFOLIO ────────────────────────────────────────────────────────
 
     @temp()
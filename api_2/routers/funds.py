@@ -74,6 +74,21 @@ def get_fund_metrics(cnpj: str = Path(...)):
     return result
 
 
+@router.get("/funds/{cnpj:path}/metrics/range")
+def get_fund_metrics_range(
+    cnpj: str = Path(...),
+    start_date: date = Query(...),
+    end_date: Optional[date] = Query(None),
+):
+    result = _dedup_exec(
+        "fund_metrics_range", f"cnpj={cnpj}&start={start_date}&end={end_date}",
+        _get_service().get_fund_metrics_range, cnpj, start_date, end_date,
+    )
+    if not result:
+        raise HTTPException(404, "Metrics not found for this range")
+    return result
+
+
 @router.get("/funds/{cnpj:path}/composition")
 def get_fund_composition(cnpj: str = Path(...)):
     result = _dedup_exec("fund_composition", f"cnpj={cnpj}", _get_service().get_fund_composition, cnpj)
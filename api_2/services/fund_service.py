@@ -5,10 +5,11 @@ Orquestra: FundRepository → transformação → resposta.
 """
 
 import pandas as pd
-import numpy as np
 from typing import List, Optional
 from datetime import date
 
+from common.metrics import fund_profile, range_to_dict
+
 from ..repositories.fund_repo import FundRepository
 from ..repositories.base import BaseRepository
 from ..schemas.funds import (
@@ -101,67 +102,26 @@ class FundService:
 
     def get_fund_metrics(self, cnpj: str) -> Optional[dict]:
         clean = self._normalize(cnpj)
+
+        # Perfil pré-calculado pelo pipeline (uma linha indexada)
+        df_perfil = self.repo.get_profile(clean)
+        if not df_perfil.empty and df_perfil.iloc[0]["payload"]:
+            return df_perfil.iloc[0]["payload"]
+
+        # Fallback: calcula a partir da série de cotas
         df = self.repo.get_quota_series(clean)
         if df.empty:
             return None
 
-        df["dt_comptc"] = pd.to_datetime(df["dt_comptc"])
-        df = df.set_index("dt_comptc")
-        df["ret"] = df["vl_quota"].pct_change()
-
-        df_m = df["vl_quota"].resample("ME").last()
-        df_m_ret = df_m.pct_change()
-
-        rent_mes, rent_ano = {}, {}
-        for y in df_m_ret.index.year.unique():
-            year_data = df_m_ret[df_m_ret.index.year == y]
-            rent_mes[int(y)] = {
-                m: round(v * 100, 2)
-                for m, v in zip(year_data.index.month, year_data.values)
-                if pd.notnull(v)
-            }
-            try:
-                end_q = df_m[df_m.index.year == y].iloc[-1]
-                prev = df_m[df_m.index.year == y - 1]
-                start_q = prev.iloc[-1] if not prev.empty else df["vl_quota"][df.index.year == y].iloc[0]
-                rent_ano[int(y)] = round(((end_q / start_q) - 1) * 100, 2)
-            except Exception:
-                rent_ano[int(y)] = 0.0
-
-        first_q = df["vl_quota"].iloc[0]
-        rent_accum = {}
-        for y in df_m_ret.index.year.unique():
-            try:
-                end_q_y = df_m[df_m.index.year == y].iloc[-1]
-                rent_accum[int(y)] = round(((end_q_y / first_q) - 1) * 100, 2)
-            except Exception:
-                pass
-
-        vol_12m = 0.0
-        if len(df) > 252:
-            vol_12m = float(df["ret"].tail(252).std() * np.sqrt(252) * 100)
-
-        sharpe = 0.0
-        if vol_12m > 0 and len(df) > 252:
-            ret_12m = (df["vl_quota"].iloc[-1] / df["vl_quota"].iloc[-252]) - 1
-            sharpe = (ret_12m * 100 - 10) / vol_12m
-
-        pos_months = len(df_m_ret[df_m_ret > 0])
-        neg_months = len(df_m_ret[df_m_ret < 0])
+        # Mesmo kernel do job batch (common/metrics.py)
+        df_cdi = self.repo.get_benchmark_series("CDINI")
+        cdi = df_cdi.set_index("data")["valor"] if not df_cdi.empty else None
+        return fund_profile(df.set_index("dt_comptc")["vl_quota"], cdi)
 
-        return {
-            "rentabilidade_mes": rent_mes,
-            "rentabilidade_ano": rent_ano,
-            "rentabilidade_acumulada": rent_accum,
-            "volatilidade_12m": round(vol_12m, 2),
-            "sharpe_12m": round(sharpe, 2),
-            "consistency": {
-                "pos_months": pos_months,
-                "neg_months": neg_months,
-                "best_month": round(df_m_ret.max() * 100, 2) if not df_m_ret.empty else 0,
-                "worst_month": round(df_m_ret.min() * 100, 2) if not df_m_ret.empty else 0,
-            },
-        }
+    def get_fund_metrics_range(self, cnpj: str, start_date: date, end_date: Optional[date] = None) -> Optional[dict]:
+        clean = self._normalize(cnpj)
+        # Duas linhas do índice de somas acumuladas (cvm.metrics_prefixo) delimitam o intervalo
+        return range_to_dict(self.repo.get_prefix_rows(clean, start_date, end_date))
 
     # ── COMPOSITION ──────────────────────────────────────────────────────
 
@@ -0,0 +1,87 @@
+"""
+Conector offline para rodar os jobs de métricas sem Postgres.
+
+Tem a mesma interface usada pelos jobs (read_sql / execute_sql / engine) mas:
+- read_sql responde às consultas dos jobs a partir dos DataFrames sintéticos
+  (benchmarks/synthetic.py), filtrando pelo nome da tabela no FROM;
+- engine é um SQLite em memória com os schemas cvm/middle anexados, para que os
+  to_sql dos jobs gravem de verdade (o custo de serialização entra na medição).
+  DDL específico do Postgres (CREATE SCHEMA / CREATE INDEX) vira no-op.
+"""
+
+import re
+from typing import Dict
+
+import pandas as pd
+from sqlalchemy import create_engine, event
+
+
+SCHEMAS = ('cvm', 'middle')
+
+_RE_TABLE = re.compile(r"\bFROM\s+([a-z_]+\.[a-z_0-9]+)", re.IGNORECASE)
+_RE_DT_MIN = re.compile(r"dt_comptc\s*>=\s*'(\d{4}-\d{2}-\d{2})'")
+_RE_CODIGO = re.compile(r"codigo\s*=\s*'(\w+)'")
+_RE_NOOP_DDL = re.compile(r"^\s*CREATE\s+(SCHEMA|INDEX|UNIQUE\s+INDEX)\b", re.IGNORECASE)
+
+
+def _sink_engine():
+    engine = create_engine("sqlite://")
+
+    @event.listens_for(engine, "connect")
+    def _attach(dbapi_conn, _):
+        for schema in SCHEMAS:
+            dbapi_conn.execute(f"ATTACH DATABASE ':memory:' AS {schema}")
+
+    @event.listens_for(engine, "before_cursor_execute", retval=True)
+    def _skip_pg_ddl(conn, cursor, statement, parameters, context, executemany):
+        if _RE_NOOP_DDL.match(statement):
+            return "SELECT 1", ()
+        return statement, parameters
+
+    return engine
+
+
+class OfflineConnector:
+    """Substituto do PostgresConnector alimentado por DataFrames em memória."""
+
+    def __init__(self, tables: Dict[str, pd.DataFrame]):
+        self.tables = tables
+        self.engine = _sink_engine()
+        self.queries = []
+
+    def __repr__(self):
+        return f"OfflineConnector(tables={sorted(self.tables)})"
+
+    def read_sql(self, query: str) -> pd.DataFrame:
+        self.queries.append(query)
+        m = _RE_TABLE.search(query)
+        table = m.group(1).lower() if m else None
+        if table not in self.tables:
+            # Mesmo comportamento do PostgresConnector: erro vira DataFrame vazio
+            return pd.DataFrame()
+
+        df = self.tables[table]
+
+        if table == 'cvm.cotas':
+            dt_min = _RE_DT_MIN.search(query)
+            if dt_min:
+                df = df[pd.to_datetime(df['dt_comptc']) >= dt_min.group(1)]
+            if re.search(r"SELECT\s+DISTINCT\s+dt_comptc\b", query, re.IGNORECASE):
+                return df[['dt_comptc']].drop_duplicates().reset_index(drop=True)
+            out = df[['cnpj_fundo', 'dt_comptc', 'vl_quota']].copy()
+            if 'id_subclasse_clean' in query:
+                out.insert(1, 'id_subclasse_clean', df['id_subclasse'].fillna('MASTER').astype(str))
+            return out.reset_index(drop=True)
+
+        if table == 'middle.indices_cotas':
+            codigo = _RE_CODIGO.search(query)
+            if codigo:
+                df = df[df['codigo'] == codigo.group(1)]
+            if re.search(r"\bdata\s+as\s+dt_comptc\b", query, re.IGNORECASE):
+                df = df.rename(columns={'data': 'dt_comptc'})
+            return df.reset_index(drop=True)
+
+        return df.copy()
+
+    def execute_sql(self, query: str):
+        self.queries.append(query)
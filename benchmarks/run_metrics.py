@@ -0,0 +1,391 @@
+"""
+Benchmark do motor de métricas, 100% offline (sem Postgres).
+
+Gera cvm.cotas / middle.indices_cotas / cvm.fi_cad_fi_hist_classe sintéticos
+(benchmarks/synthetic.py) e mede cada implementação em um processo separado,
+para que o pico de RSS de uma não contamine a outra:
+
+    metrics2_full    data/project_metrics2.py, matriz completa (calculate_metrics_175_final)
+    metrics2_blocks  data/project_metrics2.py, modo em blocos (compute_block por partição)
+    metrics_legacy   data/project_metrics.py (calculate_metrics_175_optimized)
+    api_batch        common.metrics.profile_metrics + profile_to_dict (job project_metrics_perfil)
+    api_fund         common.metrics.fund_profile fundo a fundo (fallback on-demand da API)
+
+Para cada cenário: tempo total, throughput (entidades x datas/s), pico de RSS e
+tempo acumulado por kernel (prepare_cotas, build_matrix, window_metrics, ...).
+
+Uso:
+    python benchmarks/run_metrics.py --funds 500 --days 1500
+    python benchmarks/run_metrics.py --only metrics2_full api_batch --json bench.json
+    python benchmarks/run_metrics.py --compare bench.json --tolerance 0.25   # sai com 1 se regredir
+"""
+
+import sys
+import os
+import json
+import time
+import zlib
+import pickle
+import argparse
+import tempfile
+import platform
+import contextlib
+import multiprocessing as mp
+from collections import defaultdict
+from dataclasses import fields
+
+# Add project root to path
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.abspath(os.path.join(current_dir, '..'))
+if project_root not in sys.path:
+    sys.path.append(project_root)
+# project_metrics.py importa `common` relativo à pasta data/
+data_dir = os.path.join(project_root, 'data')
+if data_dir not in sys.path:
+    sys.path.append(data_dir)
+
+import pandas as pd
+import warnings
+
+from benchmarks.synthetic import SyntheticConfig, generate_all
+
+warnings.filterwarnings('ignore', category=RuntimeWarning)
+warnings.filterwarnings('ignore', category=FutureWarning)
+
+
+# ============================================================================
+# MEDIÇÃO
+# ============================================================================
+
+def peak_rss_mb():
+    """Pico de RSS do processo atual em MB (None se a plataforma não expõe)."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reporta em KB, macOS em bytes
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+class KernelTimer:
+    """Acumula chamadas e tempo por função, trocando o atributo no módulo durante o bloco."""
+
+    def __init__(self):
+        self.stats = defaultdict(lambda: {'calls': 0, 'seconds': 0.0})
+
+    def _wrap(self, name, fn):
+        stats = self.stats[name]
+
+        def wrapper(*args, **kwargs):
+            t0 = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                stats['calls'] += 1
+                stats['seconds'] += time.perf_counter() - t0
+        return wrapper
+
+    @contextlib.contextmanager
+    def instrument(self, module, names):
+        originals = {n: getattr(module, n) for n in names}
+        try:
+            for n, fn in originals.items():
+                setattr(module, n, self._wrap(n, fn))
+            yield self
+        finally:
+            for n, fn in originals.items():
+                setattr(module, n, fn)
+
+    def report(self):
+        return {k: {'calls': v['calls'], 'seconds': round(v['seconds'], 4)} for k, v in self.stats.items()}
+
+
+# ============================================================================
+# CENÁRIOS
+# ============================================================================
+# Cada cenário recebe as tabelas sintéticas e devolve
+# (unidades processadas, nome da unidade, kernels).
+
+KERNELS_METRICS2 = ['load_benchmarks', 'prepare_cotas', 'build_matrix', 'target_dates',
+                    'compute_date_metrics', 'window_metrics', 'finalize_metrics']
+
+
+def _n_entities(cotas):
+    return cotas[['cnpj_fundo', 'id_subclasse']].astype(str).drop_duplicates().shape[0]
+
+
+def bench_metrics2_full(tables, n_blocos):
+    import project_metrics2
+    from common import metrics
+    from benchmarks.offline import OfflineConnector
+
+    timer = KernelTimer()
+    db = OfflineConnector(tables)
+    original = project_metrics2.PostgresConnector
+    project_metrics2.PostgresConnector = lambda: db
+    try:
+        with timer.instrument(project_metrics2, KERNELS_METRICS2), \
+                timer.instrument(metrics, ['recovery_time']), \
+                contextlib.redirect_stdout(open(os.devnull, 'w')):
+            project_metrics2.calculate_metrics_175_final()
+    finally:
+        project_metrics2.PostgresConnector = original
+
+    n_datas = timer.stats['compute_date_metrics']['calls']
+    return _n_entities(tables['cvm.cotas']) * n_datas, 'entidades x datas alvo', timer.report()
+
+
+def bench_metrics2_blocks(tables, n_blocos):
+    import project_metrics2
+    from common import metrics
+    from benchmarks.offline import OfflineConnector
+
+    timer = KernelTimer()
+    db = OfflineConnector(tables)
+    with timer.instrument(project_metrics2, KERNELS_METRICS2), \
+            timer.instrument(metrics, ['recovery_time']):
+        calendario = pd.DatetimeIndex(pd.to_datetime(
+            db.read_sql(f"SELECT DISTINCT dt_comptc FROM cvm.cotas "
+                        f"WHERE dt_comptc >= '{project_metrics2.DATA_INICIO_COTAS}'")['dt_comptc']
+        )).sort_values()
+        bench_ret = project_metrics2.load_benchmarks(db)
+        df_classes = project_metrics2.load_classes(db)
+        df_cotas = db.read_sql(project_metrics2.QUERY_COTAS)
+
+        # Mesma partição estável por CNPJ do modo em blocos (hash em Python no lugar do hashtext)
+        bloco = df_cotas['cnpj_fundo'].map(lambda c: zlib.crc32(c.encode()) % n_blocos)
+        vazio = pd.DataFrame(columns=['dt_comptc', 'cnpj_fundo'])
+        n_datas = len(project_metrics2.target_dates(calendario))
+        for _, df_bloco in df_cotas.groupby(bloco):
+            df_out = project_metrics2.compute_block(df_bloco.copy(), calendario, bench_ret, df_classes, vazio)
+            with db.engine.begin() as conn:
+                df_out.to_sql(project_metrics2.TABELA_DESTINO, conn, schema=project_metrics2.SCHEMA_DESTINO,
+                              if_exists='append', index=False, chunksize=10000)
+
+    return _n_entities(tables['cvm.cotas']) * n_datas, 'entidades x datas alvo', timer.report()
+
+
+def bench_metrics_legacy(tables, n_blocos):
+    import project_metrics
+    from benchmarks.offline import OfflineConnector
+
+    db = OfflineConnector(tables)
+    original = project_metrics.PostgresConnector
+    project_metrics.PostgresConnector = lambda: db
+    try:
+        with contextlib.redirect_stdout(open(os.devnull, 'w')):
+            project_metrics.calculate_metrics_175_optimized()
+    finally:
+        project_metrics.PostgresConnector = original
+
+    datas = pd.to_datetime(tables['cvm.cotas']['dt_comptc'])
+    fechamentos = datas.groupby([datas.dt.year, datas.dt.month]).max()
+    n_datas = int(((fechamentos >= '2015-01-01') & (fechamentos <= '2025-12-31')).sum())
+    # Monolítico: sem kernels separados
+    return _n_entities(tables['cvm.cotas']) * n_datas, 'entidades x datas alvo', {}
+
+
+def _api_inputs(tables):
+    cotas = tables['cvm.cotas'].dropna(subset=['vl_quota']).copy()
+    cotas['dt_comptc'] = pd.to_datetime(cotas['dt_comptc'])
+    # Como em cvm.metrics_perfil e nas consultas por fundo: COALESCE(TEXT(id_subclasse), 'MASTER')
+    cotas['id_subclasse'] = cotas['id_subclasse'].map(lambda v: 'MASTER' if pd.isna(v) else str(v))
+    idx = tables['middle.indices_cotas']
+    cdi = idx[idx['codigo'] == 'CDINI'].set_index('data')['valor']
+    return cotas, cdi
+
+
+def bench_api_batch(tables, n_blocos):
+    from common import metrics
+
+    timer = KernelTimer()
+    cotas, cdi = _api_inputs(tables)
+    with timer.instrument(metrics, ['profile_metrics', 'profile_to_dict']):
+        # Mesmo preparo de project_metrics_perfil.build_rows: só a série principal de cada fundo
+        cotas = metrics.main_series(cotas)
+        cotas = cotas.drop_duplicates(subset=['cnpj_fundo', 'dt_comptc'], keep='last')
+        matrix = cotas.pivot(index='dt_comptc', columns='cnpj_fundo', values='vl_quota')
+        profile = metrics.profile_metrics(matrix, cdi)
+        for cnpj in matrix.columns:
+            metrics.profile_to_dict(profile, cnpj)
+
+    return len(cotas), 'cotas (fundo x dia)', timer.report()
+
+
+def bench_api_fund(tables, n_blocos):
+    from common import metrics
+
+    timer = KernelTimer()
+    cotas, cdi = _api_inputs(tables)
+    # O fallback da API já recebe só a série principal (filtrada no SQL)
+    cotas = metrics.main_series(cotas)
+    with timer.instrument(metrics, ['fund_profile', 'profile_metrics', 'profile_to_dict']):
+        for _, df_fundo in cotas.groupby('cnpj_fundo', sort=False):
+            metrics.fund_profile(df_fundo.set_index('dt_comptc')['vl_quota'], cdi)
+
+    return len(cotas), 'cotas (fundo x dia)', timer.report()
+
+
+SCENARIOS = {
+    'metrics2_full': bench_metrics2_full,
+    'metrics2_blocks': bench_metrics2_blocks,
+    'metrics_legacy': bench_metrics_legacy,
+    'api_batch': bench_api_batch,
+    'api_fund': bench_api_fund,
+}
+
+
+def run_scenario(name, data_path, n_blocos):
+    """Executa um cenário e devolve o dicionário de resultado."""
+    with open(data_path, 'rb') as f:
+        tables = pickle.load(f)
+
+    t0 = time.perf_counter()
+    try:
+        units, unit_label, kernels = SCENARIOS[name](tables, n_blocos)
+        error = None
+    except Exception as e:
+        units, unit_label, kernels, error = 0, '', {}, f"{type(e).__name__}: {e}"
+    elapsed = time.perf_counter() - t0
+
+    return {
+        'scenario': name,
+        'seconds': round(elapsed, 3),
+        'units': int(units),
+        'unit': unit_label,
+        'throughput': round(units / elapsed, 1) if elapsed > 0 and units else 0.0,
+        'peak_rss_mb': round(peak_rss_mb(), 1) if peak_rss_mb() is not None else None,
+        'kernels': kernels,
+        'error': error,
+    }
+
+
+def _child(name, data_path, n_blocos, queue):
+    queue.put(run_scenario(name, data_path, n_blocos))
+
+
+def run_isolated(name, data_path, n_blocos):
+    """Roda o cenário em um processo novo (spawn) para medir o pico de RSS isolado."""
+    ctx = mp.get_context('spawn')
+    queue = ctx.Queue()
+    proc = ctx.Process(target=_child, args=(name, data_path, n_blocos, queue))
+    proc.start()
+    result = queue.get()
+    proc.join()
+    return result
+
+
+# ============================================================================
+# RELATÓRIO / COMPARAÇÃO
+# ============================================================================
+
+def print_report(results):
+    print(f"\n{'cenário':<18}{'tempo (s)':>11}{'throughput':>16}  {'unidade':<24}{'pico RSS (MB)':>14}")
+    print("-" * 85)
+    for r in results:
+        rss = f"{r['peak_rss_mb']:.1f}" if r['peak_rss_mb'] is not None else "n/d"
+        print(f"{r['scenario']:<18}{r['seconds']:>11.2f}{r['throughput']:>16,.0f}  {r['unit']:<24}{rss:>14}")
+        if r['error']:
+            print(f"    ERRO: {r['error']}")
+        for k, v in sorted(r['kernels'].items(), key=lambda kv: -kv[1]['seconds']):
+            print(f"    {k:<24}{v['calls']:>8} chamadas {v['seconds']:>10.3f}s")
+
+
+def compare(results, baseline_path, tolerance, config):
+    """Compara com um JSON anterior; devolve a lista de cenários que regrediram."""
+    with open(baseline_path) as f:
+        data = json.load(f)
+    baseline = {r['scenario']: r for r in data['results']}
+    if data.get('config') != config:
+        print(f"Aviso: {baseline_path} foi gerado com outra configuração de dados sintéticos.")
+
+    regressions = []
+    print(f"\nComparação com {baseline_path} (tolerância {tolerance:.0%}):")
+    for r in results:
+        base = baseline.get(r['scenario'])
+        if not base or not base['seconds']:
+            continue
+        delta = r['seconds'] / base['seconds'] - 1
+        flag = "REGRESSÃO" if delta > tolerance else "ok"
+        print(f"  {r['scenario']:<18}{base['seconds']:>9.2f}s -> {r['seconds']:>9.2f}s  ({delta:+.1%})  {flag}")
+        if delta > tolerance:
+            regressions.append(r['scenario'])
+    return regressions
+
+
+def main():
+    defaults = SyntheticConfig()
+    parser = argparse.ArgumentParser(description="Benchmark offline do motor de métricas")
+    parser.add_argument('--funds', type=int, default=defaults.n_funds, help="Quantidade de fundos")
+    parser.add_argument('--days', type=int, default=defaults.n_days, help="Dias úteis de histórico")
+    parser.add_argument('--start', default=defaults.start, help="Primeira data do histórico")
+    parser.add_argument('--gap-prob', type=float, default=defaults.gap_prob,
+                        help="Probabilidade de um dia sem cota divulgada")
+    parser.add_argument('--subclass-share', type=float, default=defaults.subclass_share,
+                        help="Fração de fundos com subclasses")
+    parser.add_argument('--subclasses', type=int, default=defaults.subclasses_per_fund,
+                        help="Subclasses por fundo com subclasse")
+    parser.add_argument('--bad-quota-prob', type=float, default=defaults.bad_quota_prob,
+                        help="Probabilidade de cota zerada/negativa")
+    parser.add_argument('--seed', type=int, default=defaults.seed)
+    parser.add_argument('--blocos', type=int, default=4, help="Blocos do cenário metrics2_blocks")
+    parser.add_argument('--only', nargs='+', choices=sorted(SCENARIOS), help="Roda só estes cenários")
+    parser.add_argument('--no-isolate', action='store_true',
+                        help="Roda tudo no mesmo processo (pico de RSS deixa de ser por cenário)")
+    parser.add_argument('--json', help="Grava os resultados neste arquivo")
+    parser.add_argument('--compare', help="JSON de uma execução anterior para detectar regressões")
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help="Aumento de tempo aceito antes de acusar regressão (0.25 = 25%%)")
+    args = parser.parse_args()
+
+    cfg = SyntheticConfig(
+        n_funds=args.funds, n_days=args.days, start=args.start, gap_prob=args.gap_prob,
+        subclass_share=args.subclass_share, subclasses_per_fund=args.subclasses,
+        bad_quota_prob=args.bad_quota_prob, seed=args.seed,
+    )
+
+    print("Gerando dados sintéticos...")
+    t0 = time.perf_counter()
+    tables = generate_all(cfg)
+    print(f"  {len(tables['cvm.cotas']):,} cotas, {_n_entities(tables['cvm.cotas']):,} entidades "
+          f"em {time.perf_counter() - t0:.1f}s")
+
+    fd, data_path = tempfile.mkstemp(suffix='.pkl', prefix='bench_metrics_')
+    with os.fdopen(fd, 'wb') as f:
+        pickle.dump(tables, f, protocol=pickle.HIGHEST_PROTOCOL)
+    del tables
+
+    results = []
+    try:
+        for name in (args.only or list(SCENARIOS)):
+            print(f"Rodando {name}...")
+            if args.no_isolate:
+                results.append(run_scenario(name, data_path, args.blocos))
+            else:
+                results.append(run_isolated(name, data_path, args.blocos))
+    finally:
+        os.remove(data_path)
+
+    print_report(results)
+
+    config = {fld.name: getattr(cfg, fld.name) for fld in fields(cfg)}
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({
+                'config': config,
+                'host': platform.node(),
+                'python': platform.python_version(),
+                'results': results,
+            }, f, indent=2)
+        print(f"\nResultados gravados em {args.json}")
+
+    if args.compare:
+        regressions = compare(results, args.compare, args.tolerance, config)
+        if regressions:
+            print(f"Regressões: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
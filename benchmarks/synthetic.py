@@ -0,0 +1,139 @@
+"""
+Gerador de dados sintéticos com o formato das tabelas CVM usadas pelas métricas.
+
+- cvm.cotas: uma linha por (fundo, subclasse, data), com buracos de divulgação,
+  fundos que começam/terminam no meio do período, subclasses CVM 175,
+  cotas zeradas/negativas e linhas duplicadas.
+- middle.indices_cotas: CDINI, IBOV e IPCADIANI em formato long (codigo, valor, data).
+- cvm.fi_cad_fi_hist_classe: classe por fundo (Ações / Multimercado / Renda Fixa).
+
+Tudo é determinístico dado o `seed`, para que duas execuções do benchmark
+meçam exatamente o mesmo trabalho.
+"""
+
+from dataclasses import dataclass
+from typing import Dict
+
+import numpy as np
+import pandas as pd
+
+
+CLASSES = ['Fundo de Ações', 'Fundo Multimercado', 'Fundo de Renda Fixa']
+
+
+@dataclass
+class SyntheticConfig:
+    n_funds: int = 500
+    n_days: int = 1500
+    start: str = '2014-06-02'
+    # Probabilidade de um dia útil não ter cota divulgada
+    gap_prob: float = 0.02
+    # Fração de fundos com subclasses (CVM 175) e quantas subclasses cada um tem
+    subclass_share: float = 0.1
+    subclasses_per_fund: int = 3
+    # Probabilidade de uma cota vir zerada ou negativa (erro de carga na CVM)
+    bad_quota_prob: float = 0.0005
+    # Probabilidade de uma linha vir duplicada
+    dup_prob: float = 0.001
+    # Fração de fundos que começam depois do início / encerram antes do fim
+    late_start_share: float = 0.4
+    early_end_share: float = 0.1
+    seed: int = 42
+
+
+def _cnpj(i: int) -> str:
+    raw = f"{10_000_000 + i:08d}0001{i % 100:02d}"
+    return f"{raw[:2]}.{raw[2:5]}.{raw[5:8]}/{raw[8:12]}-{raw[12:]}"
+
+
+def generate_calendar(cfg: SyntheticConfig) -> pd.DatetimeIndex:
+    return pd.bdate_range(cfg.start, periods=cfg.n_days)
+
+
+def generate_cotas(cfg: SyntheticConfig) -> pd.DataFrame:
+    """DataFrame com as colunas de cvm.cotas."""
+    rng = np.random.default_rng(cfg.seed)
+    dates = generate_calendar(cfg)
+    n_days = len(dates)
+
+    # Entidades: fundo master + subclasses
+    cnpjs, subclasses = [], []
+    for i in range(cfg.n_funds):
+        cnpj = _cnpj(i)
+        if rng.random() < cfg.subclass_share:
+            for k in range(cfg.subclasses_per_fund):
+                cnpjs.append(cnpj)
+                subclasses.append(f"SUB{i:05d}{k}")
+        else:
+            cnpjs.append(cnpj)
+            subclasses.append(None)
+    n_ent = len(cnpjs)
+
+    # Janela de vida de cada entidade
+    start_idx = np.where(rng.random(n_ent) < cfg.late_start_share,
+                         rng.integers(0, max(1, n_days // 2), n_ent), 0)
+    end_idx = np.where(rng.random(n_ent) < cfg.early_end_share,
+                       rng.integers(n_days // 2, n_days, n_ent), n_days)
+
+    # Cotas: passeio aleatório log-normal com drift/vol por entidade
+    drift = rng.normal(0.0003, 0.0002, n_ent)
+    vol = rng.uniform(0.001, 0.02, n_ent)
+    shocks = rng.standard_normal((n_days, n_ent)) * vol + drift
+    quotas = np.exp(np.cumsum(shocks, axis=0)) * rng.uniform(1, 100, n_ent)
+
+    alive = (np.arange(n_days)[:, None] >= start_idx) & (np.arange(n_days)[:, None] < end_idx)
+    published = alive & (rng.random((n_days, n_ent)) >= cfg.gap_prob)
+
+    bad = published & (rng.random((n_days, n_ent)) < cfg.bad_quota_prob)
+    quotas = np.where(bad, rng.choice([0.0, -1.0], size=quotas.shape), quotas)
+
+    d_idx, e_idx = np.nonzero(published)
+    df = pd.DataFrame({
+        'tp_fundo': 'FI',
+        'cnpj_fundo': np.asarray(cnpjs, dtype=object)[e_idx],
+        'dt_comptc': dates[d_idx].date,
+        'vl_total': quotas[d_idx, e_idx] * 1e5,
+        'vl_quota': quotas[d_idx, e_idx],
+        'vl_patrim_liq': quotas[d_idx, e_idx] * 1e5,
+        'captc_dia': 0.0,
+        'resg_dia': 0.0,
+        'nr_cotst': 100,
+        'id_subclasse': np.asarray(subclasses, dtype=object)[e_idx],
+    })
+
+    if cfg.dup_prob > 0:
+        dups = df.sample(frac=cfg.dup_prob, random_state=cfg.seed)
+        df = pd.concat([df, dups], ignore_index=True)
+
+    return df
+
+
+def generate_indices(cfg: SyntheticConfig) -> pd.DataFrame:
+    """DataFrame com as colunas de middle.indices_cotas (codigo, valor, data)."""
+    rng = np.random.default_rng(cfg.seed + 1)
+    dates = generate_calendar(cfg)
+    n = len(dates)
+    series = {
+        'CDINI': np.cumprod(np.full(n, 1.0004)),
+        'IBOV': 100_000 * np.exp(np.cumsum(rng.normal(0.0003, 0.015, n))),
+        'IPCADIANI': np.cumprod(np.full(n, 1.00015)),
+    }
+    frames = [pd.DataFrame({'codigo': k, 'valor': v, 'data': dates.date}) for k, v in series.items()]
+    return pd.concat(frames, ignore_index=True)
+
+
+def generate_classes(cotas: pd.DataFrame, seed: int = 42) -> pd.DataFrame:
+    """DataFrame com as colunas de cvm.fi_cad_fi_hist_classe (cnpj_fundo, classe)."""
+    rng = np.random.default_rng(seed + 2)
+    cnpjs = cotas['cnpj_fundo'].drop_duplicates().to_numpy()
+    return pd.DataFrame({'cnpj_fundo': cnpjs, 'classe': rng.choice(CLASSES, len(cnpjs))})
+
+
+def generate_all(cfg: SyntheticConfig) -> Dict[str, pd.DataFrame]:
+    """Todas as tabelas, indexadas pelo nome no banco."""
+    cotas = generate_cotas(cfg)
+    return {
+        'cvm.cotas': cotas,
+        'middle.indices_cotas': generate_indices(cfg),
+        'cvm.fi_cad_fi_hist_classe': generate_classes(cotas, cfg.seed),
+    }
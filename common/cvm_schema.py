@@ -0,0 +1,150 @@
+"""
+Schema declarado dos datasets da CVM — tipos impostos na ingestão (dev/ingest_tables.py).
+
+Sem declaração, o ingestor infere os tipos pelo pandas e, em qualquer conflito,
+alarga a coluna para TEXT; as views passam a fazer DATE(...)/casts em toda linha.
+Aqui cada tabela grande declara o tipo das colunas conhecidas:
+
+- DATE: datas ISO (AAAA-MM-DD) ou brasileiras (DD/MM/AAAA).
+- NUMERIC: DOUBLE PRECISION; aceita decimal brasileiro ("1.234,56") e ponto ("1234.56").
+- INT: BIGINT (contagens, ex: nr_cotst).
+- CODE: códigos de baixa cardinalidade (tp_fundo, tp_aplic...). Ficam TEXT no banco
+  (string curta já é compacta no Postgres) e category no pandas durante a carga.
+
+Colunas não declaradas seguem a inferência normal. Nas tabelas declaradas, os prefixos
+dt_/vl_/qt_/pr_ cobrem colunas novas que a CVM acrescenta aos layouts.
+"""
+
+from typing import Dict
+
+import numpy as np
+import pandas as pd
+from sqlalchemy.types import BigInteger, Date, Float, Text
+
+
+DATE, NUMERIC, INT, CODE = 'date', 'numeric', 'int', 'code'
+
+SQL_TYPES = {DATE: 'DATE', NUMERIC: 'DOUBLE PRECISION', INT: 'BIGINT', CODE: 'TEXT'}
+SQLALCHEMY_TYPES = {DATE: Date(), NUMERIC: Float(precision=53), INT: BigInteger(), CODE: Text()}
+
+# Tipo do catálogo (information_schema.data_type) que já satisfaz cada declaração
+CATALOG_TYPES = {DATE: ('date',), NUMERIC: ('double precision', 'numeric', 'real'),
+                 INT: ('bigint', 'integer', 'smallint'), CODE: ('text', 'character varying')}
+
+# Prefixos (só valem para tabelas declaradas)
+PREFIX_RULES = (('dt_', DATE), ('vl_', NUMERIC), ('qt_', NUMERIC), ('pr_', NUMERIC))
+
+
+# ============================================================================
+# REGISTRO
+# ============================================================================
+
+_INF_DIARIO = {
+    'tp_fundo': CODE, 'tp_fundo_classe': CODE,
+    'dt_comptc': DATE,
+    'vl_total': NUMERIC, 'vl_quota': NUMERIC, 'vl_patrim_liq': NUMERIC,
+    'captc_dia': NUMERIC, 'resg_dia': NUMERIC,
+    'nr_cotst': INT,
+}
+
+_CDA_COMUM = {
+    'tp_fundo': CODE, 'tp_fundo_classe': CODE,
+    'dt_comptc': DATE, 'dt_confid_aplic': DATE,
+    'tp_aplic': CODE, 'tp_ativo': CODE, 'emissor_ligado': CODE, 'tp_negoc': CODE,
+    'qt_venda_negoc': NUMERIC, 'vl_venda_negoc': NUMERIC,
+    'qt_aquis_negoc': NUMERIC, 'vl_aquis_negoc': NUMERIC,
+    'qt_pos_final': NUMERIC, 'vl_merc_pos_final': NUMERIC, 'vl_custo_pos_final': NUMERIC,
+}
+
+_CDA_CREDITO = {
+    'pf_pj_emissor': CODE, 'titulo_posfx': CODE, 'cd_indexador_posfx': CODE,
+    'ag_risco': CODE, 'grau_risco': CODE, 'titulo_cetip': CODE, 'titulo_garantia': CODE,
+    'dt_venc': DATE, 'dt_risco': DATE,
+    'pr_indexador_posfx': NUMERIC, 'pr_cupom_posfx': NUMERIC, 'pr_taxa_prefx': NUMERIC,
+}
+
+_CDA_BLOCOS = {
+    1: {'tp_titpub': CODE, 'dt_emissao': DATE, 'dt_venc': DATE},
+    4: {'dt_ini_vigencia': DATE, 'dt_fim_vigencia': DATE},
+    5: _CDA_CREDITO,
+    6: _CDA_CREDITO,
+    7: {'cd_pais': CODE, 'cd_bv_merc': CODE, 'risco_emissor': CODE, 'dt_venc': DATE},
+}
+
+CVM_SCHEMAS: Dict[str, Dict[str, str]] = {
+    'cvm.fi_doc_inf_diario_inf_diario_fi': _INF_DIARIO,
+    **{f'cvm.fi_doc_cda_fi_blc_{i}': {**_CDA_COMUM, **_CDA_BLOCOS.get(i, {})} for i in range(1, 9)},
+    'cvm.fi_doc_cda_fi_pl': {'tp_fundo': CODE, 'tp_fundo_classe': CODE, 'dt_comptc': DATE, 'vl_patrim_liq': NUMERIC},
+}
+
+
+def declared_schema(table_name: str, columns) -> Dict[str, str]:
+    """{coluna: tipo} declarado para as colunas presentes ({} se a tabela não tem declaração)."""
+    declared = CVM_SCHEMAS.get(table_name)
+    if declared is None:
+        return {}
+    schema = {}
+    for col in columns:
+        if col in declared:
+            schema[col] = declared[col]
+            continue
+        for prefix, kind in PREFIX_RULES:
+            if col.startswith(prefix):
+                schema[col] = kind
+                break
+    return schema
+
+
+# ============================================================================
+# PARSING VETORIZADO
+# ============================================================================
+
+def parse_decimal(s: pd.Series) -> pd.Series:
+    """Número com decimal brasileiro ("1.234,56") ou ponto ("1234.56"); inválido vira NaN."""
+    if pd.api.types.is_numeric_dtype(s):
+        return s.astype('float64')
+    s = s.astype('string').str.strip()
+    br = s.str.contains(',', regex=False, na=False)
+    if br.any():
+        s = s.mask(br, s.str.replace('.', '', regex=False).str.replace(',', '.', regex=False))
+    return pd.to_numeric(s, errors='coerce').astype('float64')
+
+
+def parse_date(s: pd.Series) -> pd.Series:
+    """Datas ISO; o que falhar é tentado como DD/MM/AAAA. Inválido vira NaT."""
+    if pd.api.types.is_datetime64_any_dtype(s):
+        return s
+    s = s.astype('string').str.strip()
+    out = pd.to_datetime(s, format='%Y-%m-%d', errors='coerce')
+    retry = out.isna() & s.notna()
+    if retry.any():
+        out = out.mask(retry, pd.to_datetime(s[retry], format='%d/%m/%Y', errors='coerce'))
+    return out
+
+
+def parse_int(s: pd.Series) -> pd.Series:
+    """Inteiro anulável (Int64); mantém float se houver casas decimais."""
+    values = parse_decimal(s)
+    frac = values.notna() & (values != np.floor(values))
+    return values if frac.any() else values.astype('Int64')
+
+
+PARSERS = {
+    DATE: parse_date,
+    NUMERIC: parse_decimal,
+    INT: parse_int,
+    CODE: lambda s: s.astype('category'),
+}
+
+
+def apply_schema(df: pd.DataFrame, schema: Dict[str, str]) -> pd.DataFrame:
+    """Converte as colunas declaradas (coluna inteira de uma vez, sem apply por linha)."""
+    for col, kind in schema.items():
+        if col in df.columns:
+            df[col] = PARSERS[kind](df[col])
+    return df
+
+
+def to_sql_dtypes(schema: Dict[str, str]) -> dict:
+    """Mapa `dtype=` do DataFrame.to_sql para criar a tabela com os tipos declarados."""
+    return {col: SQLALCHEMY_TYPES[kind] for col, kind in schema.items()}
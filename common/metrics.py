@@ -0,0 +1,437 @@
+"""
+Métricas de performance de fundos — kernels vetorizados compartilhados.
+
+Um único lugar para as contas de rentabilidade, volatilidade, sharpe etc., usado
+tanto pelo job batch (data/project_metrics2.py) quanto pelas APIs
+(api/service.py e api_2/services/fund_service.py), para que os números sejam
+sempre os mesmos.
+
+Entradas:
+- Batch: matriz datas x entidades de cotas (uma coluna por fundo/subclasse).
+- Fundo único: Series de cotas indexada por data; delega para o batch com uma
+  matriz de uma coluna.
+
+Convenções:
+- Cotas <= 0 são tratadas como ausentes.
+- Retornos diários são logarítmicos, entre observações consecutivas do fundo.
+- Janela de 12M = 252 retornos; ano = 252 dias úteis.
+"""
+
+from typing import Dict, Optional
+
+import numpy as np
+import pandas as pd
+
+
+DIAS_UTEIS_ANO = 252
+JANELAS = {'6M': 126, '12M': 252, '24M': 504, '36M': 756, '48M': 1008, '60M': 1260}
+
+# Usada no sharpe quando não há série de CDI disponível
+TAXA_LIVRE_RISCO_PADRAO = 0.10
+
+
+# ============================================================================
+# PREPARAÇÃO
+# ============================================================================
+
+def clean_quotas(matrix: pd.DataFrame, ffill: bool = True) -> pd.DataFrame:
+    """Substitui cotas <= 0 por NaN e, opcionalmente, propaga a última cota válida."""
+    matrix = matrix.mask(matrix <= 0, np.nan)
+    return matrix.ffill() if ffill else matrix
+
+
+def log_returns(matrix: pd.DataFrame) -> pd.DataFrame:
+    """Retornos logarítmicos linha a linha de uma matriz já limpa (ver clean_quotas)."""
+    return np.log(matrix / matrix.shift(1))
+
+
+def _to_matrix(quotas: pd.Series) -> pd.DataFrame:
+    """Converte a série de um fundo em matriz de uma coluna com DatetimeIndex."""
+    s = pd.Series(quotas.values, index=pd.to_datetime(quotas.index), dtype=float)
+    s = s[~s.index.duplicated(keep='last')].sort_index()
+    return s.to_frame('fundo')
+
+
+# ============================================================================
+# JANELAS MÓVEIS (JOB BATCH)
+# ============================================================================
+
+def recovery_time(prices_series: pd.Series) -> float:
+    """Calcula o tempo de recuperação médio de drawdown em dias úteis."""
+    if prices_series.empty: return np.nan
+    rolling_max = prices_series.cummax()
+    drawdown = (prices_series < rolling_max)
+
+    # Se não houver drawdown, retorna 0
+    if not drawdown.any(): return 0.0
+
+    # Identifica grupos de drawdown
+    groups = (~drawdown).cumsum()
+
+    # Retorna média apenas dos periodos onde houve queda > 0 dias
+    recovery_periods = drawdown.groupby(groups).sum()
+    valid_periods = recovery_periods[recovery_periods > 0]
+    return valid_periods.mean() if not valid_periods.empty else 0.0
+
+
+def window_metrics(window_ret: pd.DataFrame, window_prices: pd.DataFrame, rf_ret: float) -> pd.DataFrame:
+    """
+    Métricas de uma janela para todas as entidades de uma vez.
+
+    Args:
+        window_ret: retornos log da janela (datas x entidades)
+        window_prices: cotas da janela, incluindo a data inicial (len(window_ret) + 1 linhas)
+        rf_ret: retorno acumulado do ativo livre de risco na mesma janela
+
+    Returns:
+        pd.DataFrame indexado por entidade: ret, vol, mdd, recovery_time, sharpe, calmar, hit_ratio
+    """
+    # Retorno Acumulado
+    cum_ret = np.exp(window_ret.sum()) - 1
+
+    # Volatilidade Anualizada
+    vol = window_ret.std() * np.sqrt(DIAS_UTEIS_ANO)
+
+    # Drawdown e MDD
+    cum_prices_rel = np.exp(window_ret.cumsum())
+    running_max = cum_prices_rel.cummax()
+    mdd = ((cum_prices_rel / running_max) - 1).min()
+
+    # Recovery Time só para quem teve drawdown (apply é a parte lenta)
+    cols_with_dd = mdd[mdd < 0].index
+    rec_time = pd.Series(0.0, index=window_ret.columns)
+    if not cols_with_dd.empty:
+        rec_time.loc[cols_with_dd] = window_prices[cols_with_dd].apply(recovery_time)
+
+    return pd.DataFrame({
+        'ret': cum_ret,
+        'vol': vol,
+        'mdd': mdd,
+        'recovery_time': rec_time,
+        'sharpe': (cum_ret - rf_ret) / vol.replace(0, np.nan),
+        'calmar': cum_ret / abs(mdd).replace(0, np.nan),
+        'hit_ratio': (window_ret > 0).sum() / len(window_ret),
+    })
+
+
+# ============================================================================
+# PERFIL DE RENTABILIDADE (MÊS / ANO / ACUMULADO / 12M)
+# ============================================================================
+
+def _bench_return(bench: Optional[pd.Series], start: pd.Series, end: pd.Series) -> pd.Series:
+    """Retorno do benchmark (série de cotas/índice) entre datas por entidade, com pad."""
+    default = pd.Series(TAXA_LIVRE_RISCO_PADRAO, index=end.index)
+    if bench is None or bench.dropna().empty:
+        return default
+    b = pd.Series(bench.values, index=pd.to_datetime(bench.index), dtype=float).dropna().sort_index()
+    b = b[~b.index.duplicated(keep='last')]
+    idx = b.index.values
+
+    def lookup(dates):
+        pos = np.searchsorted(idx, pd.to_datetime(dates).values, side='right') - 1
+        vals = b.values[np.clip(pos, 0, None)]
+        return np.where((pos >= 0) & pd.notna(dates).values, vals, np.nan)
+
+    rf = pd.Series(lookup(end) / lookup(start) - 1, index=end.index)
+    return rf.fillna(default)
+
+
+def profile_metrics(matrix: pd.DataFrame, bench: Optional[pd.Series] = None) -> Dict[str, pd.DataFrame]:
+    """
+    Perfil de rentabilidade de várias entidades em um passe vetorizado.
+
+    Args:
+        matrix: cotas diárias (datas x entidades), SEM forward fill — cada coluna
+            tem apenas as datas em que o fundo divulgou cota.
+        bench: série de índice do ativo livre de risco (ex: CDINI) para o sharpe 12M.
+            Sem ela, usa TAXA_LIVRE_RISCO_PADRAO.
+
+    Returns:
+        dict com:
+        - 'mensal': retorno simples por fim de mês (meses x entidades)
+        - 'anual': retorno por ano-calendário (anos x entidades)
+        - 'acumulado': retorno desde a primeira cota até o fim de cada ano (anos x entidades)
+        - 'resumo': por entidade — vol_12m, ret_12m, sharpe_12m, pos_months,
+          neg_months, best_month, worst_month
+    """
+    matrix = matrix.sort_index()
+    daily = clean_quotas(matrix, ffill=False)
+
+    # --- Mensal ---
+    # Última cota de cada mês; meses sem divulgação dentro da vida do fundo
+    # repetem a cota anterior (retorno zero), fora dela ficam NaN.
+    month_end = daily.resample('ME').last()
+    in_span = month_end.ffill().notna() & month_end.bfill().notna()
+    month_ff = month_end.ffill().where(in_span)
+    mensal = month_ff / month_ff.shift(1) - 1
+
+    # --- Anual ---
+    year_end = month_ff.resample('YE').last()
+    year_first = daily.resample('YE').first()
+    prev_year_end = year_end.shift(1)
+    year_start = prev_year_end.where(prev_year_end.notna(), year_first)
+    anual = year_end / year_start - 1
+
+    # --- Acumulado desde a primeira cota ---
+    first_quota = daily.bfill().iloc[0] if len(daily) else pd.Series(dtype=float)
+    acumulado = year_end / first_quota - 1
+
+    # --- 12M (últimos 252 retornos de cada entidade) ---
+    valid = daily.notna()
+    rank_from_end = valid[::-1].cumsum()[::-1]
+    n_obs = valid.sum()
+
+    rets = np.log(daily / daily.ffill().shift(1)).where(valid)
+    in_window = valid & (rank_from_end <= DIAS_UTEIS_ANO)
+    rets_12m = rets.where(in_window)
+
+    has_12m = n_obs > DIAS_UTEIS_ANO
+    vol_12m = (rets_12m.std() * np.sqrt(DIAS_UTEIS_ANO)).where(has_12m, 0.0)
+    ret_12m = (np.exp(rets_12m.sum()) - 1).where(has_12m, np.nan)
+
+    # Datas de início (cota anterior ao 1º retorno da janela) e fim da janela
+    start_12m = valid & (rank_from_end == DIAS_UTEIS_ANO + 1)
+    dt_ini = start_12m.idxmax().where(start_12m.any())
+    dt_fim = valid[::-1].idxmax().where(valid.any())
+    rf_12m = _bench_return(bench, dt_ini, dt_fim)
+
+    sharpe_12m = ((ret_12m - rf_12m) / vol_12m.replace(0, np.nan)).where(has_12m).fillna(0.0)
+
+    resumo = pd.DataFrame({
+        'vol_12m': vol_12m.fillna(0.0),
+        'ret_12m': ret_12m,
+        'sharpe_12m': sharpe_12m,
+        'pos_months': (mensal > 0).sum(),
+        'neg_months': (mensal < 0).sum(),
+        'best_month': mensal.max(),
+        'worst_month': mensal.min(),
+    })
+
+    return {'mensal': mensal, 'anual': anual, 'acumulado': acumulado, 'resumo': resumo}
+
+
+def _pct(v) -> float:
+    return round(float(v) * 100, 2)
+
+
+def profile_to_dict(profile: Dict[str, pd.DataFrame], entity) -> dict:
+    """Formata o perfil de uma entidade no payload de /funds/{cnpj}/metrics."""
+    mensal = profile['mensal'][entity].dropna()
+    anual = profile['anual'][entity].dropna()
+    acumulado = profile['acumulado'][entity].dropna()
+    resumo = profile['resumo'].loc[entity]
+
+    rent_mes: Dict[int, Dict[int, float]] = {}
+    for dt, v in mensal.items():
+        rent_mes.setdefault(int(dt.year), {})[int(dt.month)] = _pct(v)
+
+    return {
+        "rentabilidade_mes": rent_mes,
+        "rentabilidade_ano": {int(dt.year): _pct(v) for dt, v in anual.items()},
+        "rentabilidade_acumulada": {int(dt.year): _pct(v) for dt, v in acumulado.items()},
+        "volatilidade_12m": _pct(resumo['vol_12m']),
+        "sharpe_12m": round(float(resumo['sharpe_12m']), 2),
+        "consistency": {
+            "pos_months": int(resumo['pos_months']),
+            "neg_months": int(resumo['neg_months']),
+            "best_month": _pct(resumo['best_month']) if pd.notnull(resumo['best_month']) else 0,
+            "worst_month": _pct(resumo['worst_month']) if pd.notnull(resumo['worst_month']) else 0,
+        },
+    }
+
+
+def fund_profile(quotas: pd.Series, bench: Optional[pd.Series] = None) -> Optional[dict]:
+    """
+    Perfil de rentabilidade de um único fundo, no formato da API.
+
+    Args:
+        quotas: vl_quota indexada por dt_comptc
+        bench: série de índice do ativo livre de risco (ex: CDINI), opcional
+    """
+    if quotas is None or quotas.dropna().empty:
+        return None
+    profile = profile_metrics(_to_matrix(quotas), bench)
+    return profile_to_dict(profile, 'fundo')
+
+
+# ============================================================================
+# ÍNDICE DE SOMAS ACUMULADAS (MÉTRICAS EM QUALQUER INTERVALO)
+# ============================================================================
+# Para cada (fundo, data) guardamos somas acumuladas desde a primeira cota:
+# n_ret (qtd. de retornos), s_ret (log retornos), s_ret2 (quadrados) e os log
+# retornos acumulados dos benchmarks nas mesmas datas. Qualquer intervalo
+# [ini, fim] sai da diferença entre duas linhas, sem reler a série de cotas.
+
+COLS_PREFIXO = ['cnpj_fundo', 'id_subclasse', 'dt_comptc', 'vl_quota',
+                'n_ret', 's_ret', 's_ret2', 's_cdi', 's_ibov']
+
+# Uma série por (fundo, subclasse), como em data/project_metrics2.py; a cota da
+# classe (sem subclasse) fica sob 'MASTER'.
+CHAVE_PREFIXO = ['cnpj_fundo', 'id_subclasse']
+SUBCLASSE_MASTER = 'MASTER'
+
+
+def main_series(df_cotas: pd.DataFrame) -> pd.DataFrame:
+    """
+    Só a série principal de cada fundo em `df_cotas` (cnpj_fundo, id_subclasse, ...):
+    a da classe ('MASTER') ou, sem ela, a da menor subclasse. Mesmo critério das
+    consultas por fundo da API (api/data_models/fund_history.py).
+    """
+    series = df_cotas[CHAVE_PREFIXO].drop_duplicates()
+    series = series.assign(_sub=series['id_subclasse'] != SUBCLASSE_MASTER)
+    series = series.sort_values(['cnpj_fundo', '_sub', 'id_subclasse']).drop_duplicates('cnpj_fundo')
+    return df_cotas.merge(series[CHAVE_PREFIXO], on=CHAVE_PREFIXO, how='inner')
+
+
+def _log_level_at(bench: Optional[pd.Series], dates: pd.Series) -> np.ndarray:
+    """log do nível do índice na data (ou na anterior mais próxima); NaN se não houver."""
+    if bench is None or bench.dropna().empty:
+        return np.full(len(dates), np.nan)
+    b = pd.Series(bench.values, index=pd.to_datetime(bench.index), dtype=float).dropna().sort_index()
+    b = b[~b.index.duplicated(keep='last')]
+    b = b[b > 0]
+    pos = np.searchsorted(b.index.values, pd.to_datetime(dates).values, side='right') - 1
+    vals = np.log(b.values[np.clip(pos, 0, None)])
+    return np.where(pos >= 0, vals, np.nan)
+
+
+def prefix_sums(df_cotas: pd.DataFrame, seeds: Optional[pd.DataFrame] = None,
+                cdi: Optional[pd.Series] = None, ibov: Optional[pd.Series] = None) -> pd.DataFrame:
+    """
+    Linhas do índice de somas acumuladas para as cotas novas de vários fundos.
+
+    Args:
+        df_cotas: cnpj_fundo, id_subclasse, dt_comptc, vl_quota (apenas datas ainda
+            não indexadas). Sem a coluna id_subclasse, tudo vai para a série 'MASTER'.
+        seeds: última linha já gravada de cada série (colunas COLS_PREFIXO); as
+            somas continuam a partir dela. Séries sem seed começam do zero.
+        cdi, ibov: séries de nível dos índices (ex: CDINI e IBOV de middle.indices_cotas)
+
+    Returns:
+        pd.DataFrame com COLS_PREFIXO, uma linha por (fundo, subclasse, data) nova
+    """
+    df = df_cotas.copy()
+    if 'id_subclasse' not in df.columns:
+        df['id_subclasse'] = SUBCLASSE_MASTER
+    df = df[CHAVE_PREFIXO + ['dt_comptc', 'vl_quota']]
+    df['id_subclasse'] = df['id_subclasse'].fillna(SUBCLASSE_MASTER).astype(str)
+    df['dt_comptc'] = pd.to_datetime(df['dt_comptc'])
+    df = df[df['vl_quota'] > 0]
+    df = df.drop_duplicates(subset=CHAVE_PREFIXO + ['dt_comptc'], keep='last')
+
+    if seeds is not None and not seeds.empty:
+        seeds = seeds[COLS_PREFIXO].copy()
+        seeds['dt_comptc'] = pd.to_datetime(seeds['dt_comptc'])
+        last = seeds[CHAVE_PREFIXO + ['dt_comptc']].rename(columns={'dt_comptc': '_dt_seed'})
+        df = df.merge(last, on=CHAVE_PREFIXO, how='left')
+        df = df[~(df['dt_comptc'] <= df['_dt_seed'])].drop(columns='_dt_seed')
+        seeds['_seed'] = True
+        df['_seed'] = False
+        df = pd.concat([seeds, df], ignore_index=True)
+    else:
+        df['_seed'] = False
+        for col in ['n_ret', 's_ret', 's_ret2', 's_cdi', 's_ibov']:
+            df[col] = np.nan
+
+    if df.empty or not (~df['_seed']).any():
+        return pd.DataFrame(columns=COLS_PREFIXO)
+
+    df = df.sort_values(CHAVE_PREFIXO + ['dt_comptc'], kind='mergesort').reset_index(drop=True)
+    serie = df.groupby(CHAVE_PREFIXO, sort=False).ngroup()
+    g = df.groupby(serie, sort=False)
+
+    # Retornos entre observações consecutivas da série (a seed é a observação anterior)
+    r = np.log(df['vl_quota'] / g['vl_quota'].shift(1))
+    l_cdi = pd.Series(_log_level_at(cdi, df['dt_comptc']), index=df.index)
+    l_ibov = pd.Series(_log_level_at(ibov, df['dt_comptc']), index=df.index)
+    r_cdi = l_cdi - l_cdi.groupby(serie, sort=False).shift(1)
+    r_ibov = l_ibov - l_ibov.groupby(serie, sort=False).shift(1)
+
+    # Na linha de seed o "incremento" é o próprio acumulado já gravado
+    seed = df['_seed'].astype(bool)
+    inc = pd.DataFrame({
+        'n_ret': np.where(seed, df['n_ret'], r.notna().astype(int)),
+        's_ret': np.where(seed, df['s_ret'], r.fillna(0.0)),
+        's_ret2': np.where(seed, df['s_ret2'], (r ** 2).fillna(0.0)),
+        's_cdi': np.where(seed, df['s_cdi'], r_cdi.fillna(0.0)),
+        's_ibov': np.where(seed, df['s_ibov'], r_ibov.fillna(0.0)),
+    }, index=df.index)
+    acumulado = inc.groupby(serie, sort=False).cumsum()
+
+    out = pd.concat([df[CHAVE_PREFIXO + ['dt_comptc', 'vl_quota']], acumulado], axis=1)[~seed]
+    out['n_ret'] = out['n_ret'].astype(int)
+    return out[COLS_PREFIXO].reset_index(drop=True)
+
+
+def range_metrics(ini: dict, fim: dict, acoes: bool = False) -> Optional[dict]:
+    """
+    Métricas entre duas linhas do índice de somas acumuladas (mesmo fundo).
+
+    Mesmas definições de window_metrics: retorno composto, vol anualizada
+    (desvio padrão amostral), sharpe contra o CDI e info ratio contra IBOV
+    (fundos de ações) ou CDI (demais), dividido pela vol do fundo.
+    """
+    n = int(fim['n_ret']) - int(ini['n_ret'])
+    if n <= 0:
+        return None
+    s = fim['s_ret'] - ini['s_ret']
+    s2 = fim['s_ret2'] - ini['s_ret2']
+
+    ret = np.exp(s) - 1
+    vol = np.sqrt(max(s2 - s * s / n, 0.0) / (n - 1) * DIAS_UTEIS_ANO) if n > 1 else np.nan
+    ret_cdi = np.exp(fim['s_cdi'] - ini['s_cdi']) - 1
+    ret_ibov = np.exp(fim['s_ibov'] - ini['s_ibov']) - 1
+    ret_bench = ret_ibov if acoes else ret_cdi
+
+    def ratio(excesso):
+        return float(excesso / vol) if vol and np.isfinite(vol) and vol > 0 else None
+
+    return {
+        'n_retornos': n,
+        'ret': float(ret),
+        'vol': float(vol) if np.isfinite(vol) else None,
+        'ret_cdi': float(ret_cdi),
+        'ret_benchmark': float(ret_bench),
+        'benchmark': 'IBOV' if acoes else 'CDI',
+        'sharpe': ratio(ret - ret_cdi),
+        'info_ratio': ratio(ret - ret_bench),
+    }
+
+
+def range_to_dict(limites: pd.DataFrame) -> Optional[dict]:
+    """
+    Formata o payload de /funds/{cnpj}/metrics/range a partir das linhas-limite.
+
+    `limites` tem a coluna posicao: 'ini' (última linha até a data inicial),
+    'ini_pos' (primeira linha depois dela, usada quando o fundo começou dentro
+    do intervalo) e 'fim' (última linha até a data final), mais a classe do fundo.
+    """
+    if limites is None or limites.empty:
+        return None
+    rows = {r['posicao']: r for r in limites.to_dict('records')}
+    ini = rows.get('ini') or rows.get('ini_pos')
+    fim = rows.get('fim')
+    if ini is None or fim is None or pd.Timestamp(fim['dt_comptc']) <= pd.Timestamp(ini['dt_comptc']):
+        return None
+
+    classe = fim.get('classe')
+    acoes = isinstance(classe, str) and 'Ações' in classe
+    m = range_metrics(ini, fim, acoes)
+    if m is None:
+        return None
+
+    def opt(v, fn):
+        return fn(v) if v is not None else None
+
+    return {
+        "dt_ini": pd.Timestamp(ini['dt_comptc']).date().isoformat(),
+        "dt_fim": pd.Timestamp(fim['dt_comptc']).date().isoformat(),
+        "n_retornos": m['n_retornos'],
+        "retorno": _pct(m['ret']),
+        "volatilidade": opt(m['vol'], _pct),
+        "retorno_cdi": _pct(m['ret_cdi']),
+        "benchmark": m['benchmark'],
+        "retorno_benchmark": _pct(m['ret_benchmark']),
+        "sharpe": opt(m['sharpe'], lambda v: round(v, 2)),
+        "info_ratio": opt(m['info_ratio'], lambda v: round(v, 2)),
+    }
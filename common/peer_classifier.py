@@ -0,0 +1,215 @@
+"""
+Classificação de peers por nome do fundo — motor vetorizado (antes: CASE com ~80 regex em cvm.peer).
+
+As regras ficam numa lista em ordem de prioridade (a primeira que casa vence), compiladas
+uma vez na importação. Usado por data/project_peer.py, que persiste cvm.peer incrementalmente.
+
+Mesma semântica do ~* do CASE antigo: só a caixa é ignorada, os acentos contam
+('Pré' não casa com "EMPRESAS" nem com "SUPREMO"). Nome e regras vão para maiúsculas
+(str.upper, que preserva acentos), e as regex dispensam IGNORECASE (~4x mais rápidas no `re`).
+
+Execução:
+- Linhas com o mesmo (nome, classe, exclusivo) são classificadas uma vez só.
+- Regras: cada uma roda só sobre as linhas ainda pendentes; o resultado sai em máscaras numpy.
+  (Uma regex única combinando todas as regras, com lookaheads, foi testada: no `re` do Python
+  ela sai bem mais lenta que as regras separadas sobre as pendentes.)
+"""
+
+import hashlib
+import re
+from typing import NamedTuple, Optional
+
+import numpy as np
+import pandas as pd
+
+
+class Regra(NamedTuple):
+    nome: str                      # regex sobre denom_social
+    peer: str                      # "Grupo - Detalhado"
+    classe: Optional[str] = None   # classe CVM deve conter (ILIKE '%...%')
+    tambem: Optional[str] = None   # segunda regex que também precisa casar
+    exceto: Optional[str] = None   # regex que não pode casar
+    ou_exclusivo: bool = False     # casa também se fundo_exclusivo = 'S'
+
+
+RF, MM, ACOES, FII = 'Renda Fixa', 'Multimercado', 'Ações', 'Imobiliário'
+
+REGRAS = [
+    # === PREVIDÊNCIA (Prioridade Alta pois nome costuma ser explícito) ===
+    Regra(r'Prev.*Crédito|Prev.*CP', 'Previdência - Prev Crédito'),
+    Regra(r'Prev.*(Super.*Arrojado|Arrojado|Ações|70|100)', 'Previdência - Prev Super Arrojado (70/100)'),
+    Regra(r'Ciclo.*Vida|2030|2040|2050|Futuro', 'Previdência - Prev Data Alvo'),
+    Regra(r'Prev.*(Moderado|Macro|Composto)', 'Previdência - Prev MM'),
+    Regra(r'Balanceado|Perfil.*(30|15|49)', 'Previdência - Prev Balanceado (Target Risk)', tambem=r'Prev'),
+    Regra(r'Previdência|Prev|Conservador|Fix', 'Previdência - Prev RF', classe=RF),
+    Regra(r'Previdência|Prev', 'Previdência - Prev MM', classe=MM),
+
+    # === ALOCADORES (Explicit Terms) ===
+    Regra(r'Espelho|Feeder|Access|Advisory', 'Multimercado - Feeder / Espelho (Mono)'),
+    Regra(r'Selection.*Ações|Top.*Ações|FoF.*Ações', 'Ações - FoF Ações (Multigestor)'),
+    Regra(r'Selection.*RF|Allocation.*RF|FoF.*Crédito', 'Renda Fixa - FoF Renda Fixa / Crédito'),
+    Regra(r'FIC FIM|Alocação|Selection|Melhores Fundos|Carteira|Allocation', 'Multimercado - FoF Multimercado (Multigestor)', classe=MM),
+
+    # === MULTIMERCADOS COMPLEXOS ===
+    Regra(r'Macro.*Global|Global.*Macro', 'Multimercado - MM Macro Global'),
+    Regra(r'Macro|Trading|Hedge|Active|Gems|Alpha', 'Multimercado - MM Macro', classe=MM, exceto=r'Long Only'),
+    Regra(r'Juros.*Moedas|Rates|Fixed|Income|Juros', 'Multimercado - MM Macro', classe=MM),
+    Regra(r'Long Biased|LB|Bias|Equities|Total Return', 'Multimercado - MM Long Biased (Tributação Ações)', classe=MM),
+    Regra(r'Equity Hedge|Long Short|L&S|Absoluto', 'Multimercado - MM Equity Hedge (Tributação Ações)', classe=MM),
+    Regra(r'Quant|Systematic|Algorithmic|Sigma|Zarathustra|Quantitative', 'Multimercado - MM Quantitativo / Sistemático'),
+    Regra(r'Vol Target|Vol Control|Risk Parity', 'Multimercado - MM Vol Target'),
+    Regra(r'Capital Protegido|Garantido|Protected', 'Multimercado - MM Capital Protegido'),
+
+    # === CRÉDITO & EXTERIOR MM ===
+    Regra(r'Crédito Privado|CP|High Yield|Crédito Estruturado|Corporate', 'Multimercado - MM Crédito High Yield', classe=MM),
+    Regra(r'Crédito Bancário|Bank|Financials|Premium', 'Multimercado - MM Crédito Bancário', classe=MM),
+    Regra(r'Investimento no Exterior|IE|Global|International|Offshore', 'Multimercado - MM Investimento no Exterior', classe=MM),
+
+    # === AÇÕES ===
+    Regra(r'Small Caps|Microcap|Smalls|Mid Caps', 'Ações - FIA Small Caps'),
+    Regra(r'Dividendos|Dividends|Income|Renda', 'Ações - FIA Dividendos', classe=ACOES),
+    Regra(r'Infra|Util|Energia|Elétrica', 'Ações - FIA Infraestrutura / Utilities'),
+    Regra(r'FMP|FGTS|Mono|Petrobras|Vale|Eletrobras', 'Ações - FIA Mono Ação (FMP)'),
+    Regra(r'BDR|Nível I|Ações Internacionais|Global Equities', 'Ações - FIA BDR (Nível I/II/III)', classe=ACOES),
+    Regra(r'Ibovespa|Ibov|Indexado|Passivo|IBrX', 'Ações - FIA Ibovespa / IBrX (Passivo)'),
+    Regra(r'Alavancado|Bull|2x|Turbo', 'Ações - FIA Alavancado (Index)', classe=ACOES),
+    Regra(r'ESG|Sustentável|Verde|Impacto|ASG', 'Ações - FIA ESG / Sustentável'),
+    Regra(r'Momentum|Quality|Low Vol|Smart Beta', 'Ações - FIA Fator (Momentum/Quality)'),
+    Regra(r'Ações|FIA|Valor|Fundamental|Long Only|Institucional', 'Ações - FIA Long Only (Valor/Fundamentalista)'),
+
+    # === RENDA FIXA ===
+    Regra(r'LIG|Imobiliário RF', 'Renda Fixa - RF LIG / Letras Imobiliárias'),
+    Regra(r'Incentivado|Infraestrutura|Isento|Debêntures Incentivadas', 'Renda Fixa - RF Debêntures Incentivadas (Infra)'),
+    Regra(r'High Yield|HY|Structured|Plus|Max', 'Renda Fixa - RF Crédito High Yield', classe=RF),
+    Regra(r'High Grade|Crédito Privado|CP|Liquidez|Corporate', 'Renda Fixa - RF Crédito High Grade', classe=RF),
+    Regra(r'Bancário|Crédito Bancário|Instituições Financeiras', 'Renda Fixa - RF Crédito Bancário', classe=RF),
+    Regra(r'IMA-B|Inflação|IPCA|Real|Ativo', 'Renda Fixa - RF Ativo (Índice de Preços/IMA-B)'),
+    Regra(r'Pré|Prefixado|IRF-M', 'Renda Fixa - RF Ativo (Prefixado)'),
+    Regra(r'Simples|Referenciado DI|DI|Soberano|Caixa|Tesouro', 'Renda Fixa - RF Soberano'),
+    Regra(r'Tesouro Selic|Simples|Zero', 'Renda Fixa - RF Tesouro Selic Simples'),
+    Regra(r'Liquidez|D\+0|D\+1|Cash', 'Renda Fixa - RF Liquidez D+0/D+1'),
+
+    # === CAMBIAL ===
+    Regra(r'Ouro|Gold', 'Cambial - Cambial Ouro'),
+    Regra(r'Euro|EUR|Moedas', 'Cambial - Cambial Euro/Outras'),
+    Regra(r'Cambial|Dólar|USD|Moeda', 'Cambial - Cambial Dólar'),
+
+    # === ETF ===
+    Regra(r'ETF RF|Tesouro ETF', 'ETF - ETF RF'),
+    Regra(r'ETF.*Crypto|Bitcoin|Ethereum', 'ETF - ETF Crypto'),
+    Regra(r'S&P 500|Nasdaq|US Tech', 'Invest. Exterior - ETF Exterior', tambem=r'ETF'),
+    Regra(r'ETF|Index|Fundo de Índice', 'ETF - ETF Ações'),
+
+    # === FII (Name based) ===
+    Regra(r'Lajes|Escritórios|Corporate', 'FII - FII Tijolo', classe=FII),
+    Regra(r'Logística|Log', 'FII - FII Tijolo', classe=FII),
+    Regra(r'Shopping|Varejo', 'FII - FII Tijolo', classe=FII),
+    Regra(r'Renda Urbana|Híbrido', 'FII - FII Tijolo', classe=FII),
+    Regra(r'Recebíveis|Papel|CRI', 'FII - FII Papel', classe=FII),
+    Regra(r'Fundo de Fundos|FoF', 'FII - FII Papel', classe=FII),
+
+    # === OUTROS ===
+    Regra(r'Fiagro|Agro', 'FII - Fiagro (Misto)'),
+    Regra(r'BDR|Ações EUA|Tech', 'Invest. Exterior - BDR Nível I Não Patrocinado'),
+    Regra(r'Crypto|Cripto|Digital Assets|Blockchain|Access', 'Multimercado - MM Criptoativos (Varejo)', classe=MM),
+    Regra(r'Exclusivo|Reservado|Família', 'Exclusivo - Fundo Exclusivo / Restrito', ou_exclusivo=True),
+]
+
+# Fallback pela classe CVM (igualdade exata), depois 'Outros - Outros'
+FALLBACK_CLASSE = {
+    'Fundo Multimercado': 'Multimercado - MM Macro',
+    'Fundo de Ações': 'Ações - Ações Livre',
+    'Fundo de Renda Fixa': 'Renda Fixa - RF Liquidez D+0/D+1',
+}
+PEER_OUTROS = 'Outros - Outros'
+
+# Como nome e regras são comparados (entra no hash: mudar a normalização também reclassifica)
+NORMALIZACAO = 'upper'
+
+# Muda sempre que as regras mudam: cvm.peer reclassifica tudo quando o hash gravado é outro
+REGRAS_HASH = hashlib.md5(repr((REGRAS, FALLBACK_CLASSE, PEER_OUTROS, NORMALIZACAO)).encode()).hexdigest()
+
+
+# ============================================================================
+# NORMALIZAÇÃO E COMPILAÇÃO
+# ============================================================================
+
+def normalize(s: pd.Series) -> pd.Series:
+    """Em maiúsculas, acentos preservados; nulo vira '' (nulo nunca casa, como no ~* do Postgres)."""
+    return s.fillna('').astype(str).str.upper()
+
+
+def _compile(pattern):
+    """Regex normalizada como os nomes; grupos viram não-capturantes (só interessa se casa)."""
+    if not pattern:
+        return None
+    return re.compile(re.sub(r'\((?!\?)', '(?:', pattern.upper()))
+
+
+_COMPILADAS = [(_compile(r.nome), r.peer, r.classe.upper() if r.classe else None,
+                _compile(r.tambem), _compile(r.exceto), r.ou_exclusivo) for r in REGRAS]
+
+
+# ============================================================================
+# CLASSIFICAÇÃO
+# ============================================================================
+
+def _casa(padrao, nomes: np.ndarray) -> np.ndarray:
+    """Máscara de `padrao.search` sobre um array de str (sem o overhead do .str do pandas)."""
+    search = padrao.search
+    return np.fromiter((search(x) is not None for x in nomes), dtype=bool, count=len(nomes))
+
+
+def classify(df: pd.DataFrame) -> pd.Series:
+    """
+    Peer ("Grupo - Detalhado") de cada linha de `df` (colunas denom_social, classe, fundo_exclusivo).
+    Primeira regra que casa vence; sem regra, fallback pela classe CVM.
+    """
+    chaves = pd.DataFrame({
+        'nome': normalize(df['denom_social']),
+        'classe': df['classe'].astype(object).where(df['classe'].notna(), None),
+        'exclusivo': (df['fundo_exclusivo'] == 'S').to_numpy(),
+    })
+    codigos, unicos = pd.factorize(pd.MultiIndex.from_frame(chaves))
+    unicos = unicos.set_names(list(chaves.columns)).to_frame(index=False)
+
+    n = len(unicos)
+    nomes = unicos['nome'].to_numpy()
+    classes = normalize(unicos['classe'])
+    exclusivo = unicos['exclusivo'].to_numpy(dtype=bool)
+
+    peer = np.full(n, None, dtype=object)
+    pendente = np.ones(n, dtype=bool)
+    tem_classe = {}
+
+    for padrao, destino, classe, tambem, exceto, ou_exclusivo in _COMPILADAS:
+        alvo = pendente.copy()
+        if classe:
+            if classe not in tem_classe:
+                tem_classe[classe] = classes.str.contains(classe, regex=False).to_numpy()
+            alvo &= tem_classe[classe]
+        casou = np.zeros(n, dtype=bool)
+        if alvo.any():
+            sub = nomes[alvo]
+            m = _casa(padrao, sub)
+            if tambem is not None:
+                m &= _casa(tambem, sub)
+            if exceto is not None:
+                m &= ~_casa(exceto, sub)
+            casou[alvo] = m
+        if ou_exclusivo:
+            casou |= pendente & exclusivo
+        peer[casou] = destino
+        pendente &= ~casou
+        if not pendente.any():
+            break
+
+    if pendente.any():
+        peer[pendente] = unicos['classe'].map(FALLBACK_CLASSE).fillna(PEER_OUTROS).to_numpy()[pendente]
+    return pd.Series(peer[codigos], index=df.index, name='peer_classificacao_full')
+
+
+def split_peer(peer: pd.Series) -> pd.DataFrame:
+    """peer_grupo / peer_detalhado a partir de "Grupo - Detalhado"."""
+    parts = peer.str.split(' - ', n=1, expand=True)
+    return pd.DataFrame({'peer_grupo': parts[0], 'peer_detalhado': parts[1].fillna(parts[0])}, index=peer.index)
@@ -1,7 +1,7 @@
+import io
+import re
 import pandas as pd
-from sqlalchemy import create_engine, text
-import pandas as pd
-from sqlalchemy import create_engine, text
+from sqlalchemy import create_engine, exc, text
 
 class PostgresConnector:
     def __init__(self, connection_string='postgresql://postgres:a@localhost:5432/postgres'):
@@ -84,6 +84,232 @@ class PostgresConnector:
             
             conn.execute(text(f'DROP TABLE {s_quoted}."{temp_name}"'))
 
+    def copy_dataframe(self, df: pd.DataFrame, table_name: str, conn=None):
+        """
+        Carga em massa via COPY FROM STDIN (CSV em memória), muito mais rápida que to_sql.
+        A tabela já precisa existir; `conn` permite participar de uma transação aberta.
+        """
+        s_quoted, t_quoted, _, _ = self._split_table(table_name)
+        cols = ", ".join([f'"{c}"' for c in df.columns])
+        buffer = io.StringIO()
+        # Campo vazio sem aspas = NULL no COPY CSV
+        df.to_csv(buffer, index=False, header=False, na_rep='')
+        buffer.seek(0)
+
+        def _copy(c):
+            cursor = c.connection.cursor()
+            cursor.copy_expert(f"COPY {s_quoted}.{t_quoted} ({cols}) FROM STDIN WITH (FORMAT csv)", buffer)
+            cursor.close()
+
+        if conn is not None:
+            _copy(conn)
+        else:
+            with self.engine.begin() as c:
+                _copy(c)
+
+    def dependent_views(self, table_name: str, conn) -> list:
+        """
+        Views e materialized views que dependem (direta ou indiretamente) da tabela,
+        em ordem de criação: [(schema, nome, relkind 'v'/'m', definição, [indexdefs], comment)].
+        """
+        rows = conn.execute(text("""
+            WITH RECURSIVE deps(oid, depth) AS (
+                SELECT r.ev_class, 1
+                FROM pg_depend d JOIN pg_rewrite r ON r.oid = d.objid
+                WHERE d.refobjid = CAST(:rel AS regclass) AND r.ev_class <> d.refobjid
+              UNION
+                SELECT r.ev_class, deps.depth + 1
+                FROM deps
+                JOIN pg_depend d ON d.refobjid = deps.oid
+                JOIN pg_rewrite r ON r.oid = d.objid
+                WHERE r.ev_class <> d.refobjid
+            )
+            SELECT n.nspname, c.relname, c.relkind, pg_get_viewdef(c.oid),
+                   obj_description(c.oid, 'pg_class'), MAX(deps.depth) AS depth
+            FROM deps
+            JOIN pg_class c ON c.oid = deps.oid
+            JOIN pg_namespace n ON n.oid = c.relnamespace
+            WHERE c.relkind IN ('v', 'm')
+            GROUP BY n.nspname, c.relname, c.relkind, c.oid
+            ORDER BY depth
+        """), {"rel": table_name}).fetchall()
+
+        views = []
+        for schema, name, kind, definition, comment, _ in rows:
+            indexes = [r[0] for r in conn.execute(
+                text("SELECT indexdef FROM pg_indexes WHERE schemaname = :s AND tablename = :t"),
+                {"s": schema, "t": name})] if kind == 'm' else []
+            views.append((schema, name, kind, definition, indexes, comment))
+        return views
+
+    def _rename_tree(self, conn, s_quoted, s_raw, rel_raw, kind, rename):
+        """
+        Renomeia a relação (tabela, particionada ou materialized view) e, conforme `rename`,
+        suas partições, constraints (ex: pkey, que renomeia também o índice de suporte),
+        índices e sequences. Retorna o novo nome.
+        """
+        kind_sql = {'m': "MATERIALIZED VIEW"}.get(kind, 'TABLE')
+        if rename(rel_raw) != rel_raw:
+            conn.execute(text(f'ALTER {kind_sql} {s_quoted}."{rel_raw}" RENAME TO "{rename(rel_raw)}";'))
+            rel_raw = rename(rel_raw)
+
+        rels = [rel_raw] + [r[0] for r in conn.execute(text("""
+            SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = CAST(:rel AS regclass)
+        """), {"rel": f'{s_quoted}."{rel_raw}"'}).fetchall()]
+        for rel in rels:
+            if rel != rel_raw and rename(rel) != rel:
+                conn.execute(text(f'ALTER TABLE {s_quoted}."{rel}" RENAME TO "{rename(rel)}";'))
+                rel = rename(rel)
+            rel_quoted = f'{s_quoted}."{rel}"'
+            for (name,) in conn.execute(text("""
+                SELECT conname FROM pg_constraint WHERE conrelid = CAST(:rel AS regclass)
+            """), {"rel": rel_quoted}).fetchall():
+                if rename(name) != name:
+                    conn.execute(text(f'ALTER TABLE {rel_quoted} RENAME CONSTRAINT "{name}" TO "{rename(name)}";'))
+            for (name,) in conn.execute(text("""
+                SELECT indexname FROM pg_indexes WHERE schemaname = :s AND tablename = :t
+            """), {"s": s_raw, "t": rel}).fetchall():
+                if rename(name) != name:
+                    conn.execute(text(f'ALTER INDEX {s_quoted}."{name}" RENAME TO "{rename(name)}";'))
+            for (name,) in conn.execute(text("""
+                SELECT s.relname
+                FROM pg_depend d JOIN pg_class s ON s.oid = d.objid AND s.relkind = 'S'
+                WHERE d.refobjid = CAST(:rel AS regclass) AND d.deptype IN ('a', 'i')
+            """), {"rel": rel_quoted}).fetchall():
+                if rename(name) != name:
+                    conn.execute(text(f'ALTER SEQUENCE {s_quoted}."{name}" RENAME TO "{rename(name)}";'))
+        return rel_raw
+
+    def _create_views(self, conn, views):
+        """Recria views (e materialized views, com dados) com definição, índices e COMMENT capturados."""
+        for schema, name, kind, definition, indexes, comment in views:
+            kind_sql = "MATERIALIZED VIEW" if kind == 'm' else "VIEW"
+            conn.execute(text(f'CREATE {kind_sql} "{schema}"."{name}" AS {definition.rstrip().rstrip(";")}'))
+            for indexdef in indexes:
+                conn.execute(text(indexdef))
+            if comment is not None:
+                comment = comment.replace("'", "''")
+                conn.execute(text(f"""COMMENT ON {kind_sql} "{schema}"."{name}" IS '{comment}';"""))
+
+    def _rebuild_matview(self, schema, name, definition, indexes, comment, suffix="__swap"):
+        """
+        Reconstrói a materialized view ao lado ("<nome>__swap", com dados e índices) e troca
+        por rename numa transação curta. A antiga segue populada e legível até o COMMIT;
+        as views que dependem dela são recriadas na mesma transação. Retorna as (schema, nome)
+        recriadas assim.
+        """
+        tmp = f"{name}{suffix}"[:63]
+        renames = []
+        with self.engine.begin() as conn:
+            conn.execute(text(f'DROP MATERIALIZED VIEW IF EXISTS "{schema}"."{tmp}" CASCADE;'))
+            conn.execute(text(f'CREATE MATERIALIZED VIEW "{schema}"."{tmp}" AS {definition.rstrip().rstrip(";")}'))
+            for indexdef in indexes:
+                m = re.match(r'^(CREATE (?:UNIQUE )?INDEX) (\S+) ON (?:ONLY )?\S+ (USING .*)$', indexdef)
+                idx = m.group(2).strip('"')
+                renames.append((f"{idx}{suffix}"[:63], idx))
+                conn.execute(text(f'{m.group(1)} "{renames[-1][0]}" ON "{schema}"."{tmp}" {m.group(3)}'))
+            if comment is not None:
+                comment = comment.replace("'", "''")
+                conn.execute(text(f"""COMMENT ON MATERIALIZED VIEW "{schema}"."{tmp}" IS '{comment}';"""))
+
+        with self.engine.begin() as conn:
+            views = self.dependent_views(f'"{schema}"."{name}"', conn)
+            conn.execute(text(f'DROP MATERIALIZED VIEW "{schema}"."{name}" CASCADE;'))
+            conn.execute(text(f'ALTER MATERIALIZED VIEW "{schema}"."{tmp}" RENAME TO "{name}";'))
+            for tmp_idx, idx in renames:
+                conn.execute(text(f'ALTER INDEX "{schema}"."{tmp_idx}" RENAME TO "{idx}";'))
+            self._create_views(conn, views)
+        return {(v[0], v[1]) for v in views}
+
+    def swap_table(self, staging_name: str, table_name: str, suffix: str = "__stg"):
+        """
+        Troca atômica: a tabela (ou materialized view) de staging, já carregada e indexada,
+        assume o nome da final.
+        Numa transação curta: a antiga vira "<tabela>__old" (com partições/índices/constraints/
+        sequences), a staging recebe os nomes finais e as views simples dependentes passam a ler
+        a nova (CREATE OR REPLACE VIEW). Nada é dropado ali, então as materialized views
+        dependentes seguem populadas, com os dados antigos; depois do COMMIT cada uma é
+        reconstruída ao lado e trocada por rename (_rebuild_matview), e só então a antiga é
+        descartada. Leitores nunca encontram view vazia ou inexistente.
+        """
+        s_quoted, t_quoted, s_raw, t_raw = self._split_table(table_name)
+        _, stg_quoted, _, stg_raw = self._split_table(staging_name)
+        old_suffix = "__old"
+        old_raw = f"{t_raw}{old_suffix}"[:63]
+        old_quoted = f'{s_quoted}."{old_raw}"'
+
+        def unstage(name):
+            name = name.replace(f"{t_raw}{suffix}", t_raw)
+            return name[:-len(suffix)] if name.endswith(suffix) else name
+
+        def retire(name):
+            name = name.replace(t_raw, f"{t_raw}{old_suffix}") if t_raw in name else f"{name}{old_suffix}"
+            return name[:63]
+
+        def relkind(conn, rel):
+            return conn.execute(text("SELECT relkind FROM pg_class WHERE oid = to_regclass(:rel)"),
+                                {"rel": rel}).scalar()
+
+        kind_sql = {'m': "MATERIALIZED VIEW"}
+        with self.engine.begin() as conn:
+            # Serve para tabela (relkind r/p) e materialized view (m)
+            old_kind = relkind(conn, f"{s_quoted}.{t_quoted}")
+            stg_kind = relkind(conn, f"{s_quoted}.{stg_quoted}")
+            leftover = relkind(conn, old_quoted)
+            if leftover:
+                # Sobra de uma troca interrompida
+                print(f"  [SWAP] Removendo {s_raw}.{old_raw} de uma troca anterior.")
+                conn.execute(text(f"DROP {kind_sql.get(leftover, 'TABLE')} {old_quoted} CASCADE;"))
+
+            views = []
+            if old_kind:
+                if old_kind != 'm':
+                    conn.execute(text(f"LOCK TABLE {s_quoted}.{t_quoted} IN ACCESS EXCLUSIVE MODE;"))
+                views = self.dependent_views(f"{s_quoted}.{t_quoted}", conn)
+                self._rename_tree(conn, s_quoted, s_raw, t_raw, old_kind, retire)
+            self._rename_tree(conn, s_quoted, s_raw, stg_raw, stg_kind, unstage)
+
+            # As definições capturadas citam o nome final, que agora é a nova versão.
+            # Views simples são reapontadas sem drop; se o tipo de alguma coluna mudou,
+            # a view é recriada e o que cair no CASCADE volta na ordem capturada.
+            fresh = set()
+            for view in views:
+                schema, name, kind, definition = view[:4]
+                if not relkind(conn, f'"{schema}"."{name}"'):
+                    self._create_views(conn, [view])
+                    fresh.add((schema, name))
+                elif kind == 'v':
+                    try:
+                        with conn.begin_nested():
+                            conn.execute(text(f'CREATE OR REPLACE VIEW "{schema}"."{name}" AS {definition.rstrip().rstrip(";")}'))
+                    except exc.DBAPIError:
+                        conn.execute(text(f'DROP VIEW "{schema}"."{name}" CASCADE;'))
+                        self._create_views(conn, [view])
+
+        if not old_kind:
+            return
+
+        # Materialized views dependentes (diretas ou via views reapontadas) ainda têm os dados
+        # antigos: reconstrói em ordem de dependência, pulando as que já nasceram da nova versão
+        rebuilt = 0
+        for schema, name, kind, definition, indexes, comment in views:
+            if kind != 'm' or (schema, name) in fresh:
+                continue
+            try:
+                fresh |= self._rebuild_matview(schema, name, definition, indexes, comment)
+            except Exception as e:
+                print(f"  [SWAP] Falha ao reconstruir {schema}.{name}: {e}. "
+                      f"{s_raw}.{old_raw} mantida até a próxima troca.")
+                return
+            rebuilt += 1
+
+        with self.engine.begin() as conn:
+            conn.execute(text(f"DROP {kind_sql.get(old_kind, 'TABLE')} {old_quoted} CASCADE;"))
+        if views:
+            print(f"  [SWAP] {len(views)} views dependentes apontadas para {table_name}"
+                  + (f" ({rebuilt} materialized reconstruídas)" if rebuilt else ""))
+
     def overwrite_table(self, df: pd.DataFrame, table_name: str):
         """
         Força a substituição da tabela:
@@ -4,9 +4,16 @@ import os
 import pandas as pd
 import numpy as np
 
-# Adicionar path para importar common
+# Adicionar path para importar common e o v2 (mesma pasta), independente do diretório de execução
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 from common.postgresql import PostgresConnector
+from calcular_fluxo_veiculos_v2 import prefetch, stream_positions
+
+# Tabela própria do v1 (série completa por alocador, com cliente_segmentado e fluxo_1m).
+# alocadores.fluxo_veiculos é do v2 (view do último mês sobre alocadores.fluxo_veiculos_historico,
+# lida pela API) e não pode ser sobrescrita aqui.
+TABELA_FLUXO_V1 = 'alocadores.fluxo_veiculos_v1'
 
 def calcular_fluxo():
     db = PostgresConnector()
@@ -26,32 +33,17 @@ def calcular_fluxo():
     print(f"Total de alocadores identificados: {len(alocadores)}")
 
     janelas = [1, 3, 6, 12, 24, 36, 48, 60]
-    
-    # Otimização: Batch processing para reduzir queries
-    batch_size = 10000
     all_results = []
     
     # Mapa de segmento para acesso rápido
     seg_map = {row['cnpj_fundo']: row['cliente_segmentado'] for row in alocadores}
     
-    print(f"Processando em lotes de {batch_size}...")
+    # Loader único (calcular_fluxo_veiculos_v2): cursor server-side ordenado por
+    # alocador, lotes com alocadores completos, busca do próximo lote em paralelo
+    print("Lendo posições em streaming...")
+    processed_count = 0
     
-    for i in range(0, len(alocadores), batch_size):
-        chunk = alocadores[i:i+batch_size]
-        # Formatar CNPJs para clausula IN
-        cnpjs_list = [f"'{x['cnpj_fundo']}'" for x in chunk]
-        where_in = ",".join(cnpjs_list)
-        
-        # Query Batch
-        query = f"""
-            SELECT cnpj_fundo, dt_comptc, peer, SUM(vl_merc_pos_final) as total_pos
-            FROM cvm.carteira
-            WHERE cnpj_fundo IN ({where_in})
-            GROUP BY cnpj_fundo, dt_comptc, peer
-            ORDER BY cnpj_fundo, dt_comptc
-        """
-        df_batch = db.read_sql(query)
-        
+    for df_batch in prefetch(stream_positions(db)):
         if df_batch.empty:
             continue
             
@@ -95,9 +87,8 @@ def calcular_fluxo():
             all_results.append(df_long)
         
         # Logging de progresso
-        if (i + batch_size) % 500 == 0 or (i + batch_size) >= len(alocadores):
-            processed_count = min(i + batch_size, len(alocadores))
-            print(f"Processados {processed_count}/{len(alocadores)} fundos...")
+        processed_count += df_batch['cnpj_fundo'].nunique()
+        print(f"Processados {processed_count}/{len(alocadores)} fundos...")
 
     if not all_results:
         print("Nenhum resultado gerado.")
@@ -110,8 +101,8 @@ def calcular_fluxo():
     # Renomear peer -> peer_ativo para compatibilidade com API
     final_df.rename(columns={'peer': 'peer_ativo'}, inplace=True)
     
-    print(f"Salvando {len(final_df)} registros em alocadores.fluxo_veiculos...")
-    db.overwrite_table(final_df, 'alocadores.fluxo_veiculos')
+    print(f"Salvando {len(final_df)} registros em {TABELA_FLUXO_V1}...")
+    db.overwrite_table(final_df, TABELA_FLUXO_V1)
     print("Concluído!")
 
 if __name__ == "__main__":
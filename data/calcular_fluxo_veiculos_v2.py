@@ -1,17 +1,305 @@
-
 import sys
 import os
+import queue
+import argparse
+import threading
 import pandas as pd
 import numpy as np
-from datetime import date
+from sqlalchemy import text
 
 # Adicionar path para importar common
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 from common.postgresql import PostgresConnector
 
-def calcular_fluxo_refatorado():
+# Lista de janelas solicitadas (meses)
+JANELAS = [6, 12, 24, 36, 48, 60]
+
+TABELA_FLUXO = 'alocadores.fluxo_veiculos'
+
+
+# ============================================================================
+# MOTOR DE FLUXO (VETORIZADO)
+# ============================================================================
+# Cada par (alocador, peer do ativo) vira uma linha de um painel pares x meses
+# alinhado em fim de mês. O forward fill (posição propagada até a data de
+# referência, cobrindo atraso de divulgação) e as diferenças deslocadas de todas
+# as janelas saem de operações numpy sobre o painel inteiro, sem loop por par.
+
+def _month_number(dates):
+    """Meses desde o ano 0 (permite indexar o painel por inteiro)."""
+    return dates.dt.year.to_numpy() * 12 + dates.dt.month.to_numpy() - 1
+
+
+def build_panel(df, ref_date, completo_ate=None):
+    """
+    Monta o painel de posições pares x meses, com ffill por par.
+
+    Args:
+        df: cnpj_fundo, peer, dt_comptc, total_pos (formato long)
+        ref_date: data de referência; o painel vai até o fim deste mês
+        completo_ate: número do mês (ver _month_number) até o qual `df` é denso,
+            isto é, traz a posição já propagada de todo par com posição != 0
+            (caso do histórico gravado). Nesses meses, ausência = posição zero.
+
+    Returns:
+        (pares, primeiro_mes, painel): MultiIndex (cnpj_fundo, peer), número do
+        primeiro mês e array float pares x meses. Antes da 1ª posição do par = 0.
+    """
+    df = df.dropna(subset=['cnpj_fundo', 'peer', 'dt_comptc'])
+    dt = pd.to_datetime(df['dt_comptc'])
+    mes = _month_number(dt)
+    ref_mes = int(_month_number(pd.Series([pd.Timestamp(ref_date)]))[0])
+
+    keep = mes <= ref_mes
+    df, dt, mes = df[keep], dt[keep], mes[keep]
+    if df.empty:
+        return pd.MultiIndex.from_arrays([[], []], names=['cnpj_fundo', 'peer']), ref_mes, np.zeros((0, 1))
+
+    # Última posição divulgada de cada par em cada mês
+    ordem = np.argsort(dt.to_numpy(), kind='stable')
+    # Código do par = combinação dos códigos de cada coluna (factorize de MultiIndex é lento)
+    c_fundo, fundos = pd.factorize(df['cnpj_fundo'].to_numpy()[ordem])
+    c_peer, peers = pd.factorize(df['peer'].to_numpy()[ordem])
+    codes, uniq = pd.factorize(c_fundo.astype(np.int64) * len(peers) + c_peer)
+    pares = pd.MultiIndex.from_arrays(
+        [fundos[uniq // len(peers)], peers[uniq % len(peers)]], names=['cnpj_fundo', 'peer'])
+    mes = mes[ordem]
+
+    primeiro_mes = int(mes.min())
+    n_meses = ref_mes - primeiro_mes + 1
+    painel = np.full((len(pares), n_meses), np.nan)
+    # Atribuição em ordem cronológica: a última ocorrência do mês prevalece
+    painel[codes, mes - primeiro_mes] = df['total_pos'].to_numpy(dtype=float)[ordem]
+
+    if completo_ate is not None and completo_ate >= primeiro_mes:
+        denso = painel[:, :completo_ate - primeiro_mes + 1]
+        denso[np.isnan(denso)] = 0.0
+
+    # Forward fill por linha: índice da última coluna válida até cada mês
+    col = np.where(~np.isnan(painel), np.arange(n_meses), 0)
+    np.maximum.accumulate(col, axis=1, out=col)
+    painel = painel[np.arange(len(pares))[:, None], col]
+
+    return pares, primeiro_mes, np.nan_to_num(painel, nan=0.0)
+
+
+def flows_at(pares, primeiro_mes, painel, meses_alvo, janelas=JANELAS):
+    """
+    Posição e fluxos (posição no mês - posição m meses antes) em formato long.
+
+    Janelas que começam antes do painel usam posição passada 0 (fluxo desde o início).
+    Linhas com posição e todos os fluxos zerados são descartadas.
+    """
+    alvo = np.asarray(meses_alvo, dtype=int) - primeiro_mes
+    alvo = alvo[(alvo >= 0) & (alvo < painel.shape[1])]
+    if len(pares) == 0 or len(alvo) == 0:
+        return pd.DataFrame(columns=['cnpj_fundo', 'peer_ativo', 'dt_comptc', 'total_pos']
+                            + [f'fluxo_{m}m' for m in janelas])
+
+    pos = painel[:, alvo]
+    n_pares, n_alvo = pos.shape
+    anos, meses = np.divmod(alvo + primeiro_mes, 12)
+    datas = pd.to_datetime(pd.DataFrame({'year': anos, 'month': meses + 1, 'day': 1})) + pd.offsets.MonthEnd(0)
+
+    data = {
+        'cnpj_fundo': np.repeat(pares.get_level_values(0).to_numpy(), n_alvo),
+        'peer_ativo': np.repeat(pares.get_level_values(1).to_numpy(), n_alvo),
+        'dt_comptc': np.tile(datas.to_numpy(), n_pares),
+        'total_pos': pos.ravel(),
+    }
+    mask = pos != 0
+    for m in janelas:
+        passado_idx = alvo - m
+        passado = np.where(passado_idx >= 0, painel[:, np.clip(passado_idx, 0, None)], 0.0)
+        fluxo = pos - passado
+        data[f'fluxo_{m}m'] = fluxo.ravel()
+        mask |= fluxo != 0
+
+    return pd.DataFrame(data)[mask.ravel()].reset_index(drop=True)
+
+
+def compute_flows(df, ref_date, janelas=JANELAS):
+    """Fluxos de todos os pares (alocador, peer) na data de referência."""
+    pares, primeiro_mes, painel = build_panel(df, ref_date)
+    ref_mes = int(_month_number(pd.Series([pd.Timestamp(ref_date)]))[0])
+    return flows_at(pares, primeiro_mes, painel, [ref_mes], janelas)
+
+
+# ============================================================================
+# HISTÓRICO INCREMENTAL
+# ============================================================================
+# alocadores.fluxo_veiculos_historico guarda posição e fluxos de todo fim de mês.
+# Como a posição gravada já é a propagada (ffill), os últimos 60 meses do
+# histórico bastam como ponto de partida: cada execução lê só as posições novas
+# da cvm.carteira e calcula apenas os meses novos. alocadores.fluxo_veiculos
+# vira uma view do último mês, mantendo as consultas existentes.
+
+TABELA_HISTORICO = 'alocadores.fluxo_veiculos_historico'
+
+# Meses recalculados a cada execução para absorver carteiras divulgadas com atraso
+MESES_REPROCESSAR = 3
+
+# Meses-alvo por lote no cálculo (limita o tamanho do array pares x meses)
+MESES_POR_LOTE = 24
+
+DDL_HISTORICO = f"""
+CREATE SCHEMA IF NOT EXISTS alocadores;
+CREATE TABLE IF NOT EXISTS {TABELA_HISTORICO} (
+    cnpj_fundo VARCHAR NOT NULL,
+    peer_ativo VARCHAR NOT NULL,
+    dt_comptc DATE NOT NULL,
+    total_pos DOUBLE PRECISION,
+    {', '.join(f'fluxo_{m}m DOUBLE PRECISION' for m in JANELAS)},
+    PRIMARY KEY (dt_comptc, cnpj_fundo, peer_ativo)
+);
+CREATE INDEX IF NOT EXISTS idx_fluxo_hist_cnpj ON {TABELA_HISTORICO} (cnpj_fundo, dt_comptc);
+"""
+
+
+def ensure_history(db):
+    """Cria a tabela de histórico e troca alocadores.fluxo_veiculos por uma view do último mês."""
+    with db.engine.begin() as conn:
+        conn.execute(text(DDL_HISTORICO))
+        tipo = conn.execute(text("""
+            SELECT table_type FROM information_schema.tables
+            WHERE table_schema = 'alocadores' AND table_name = 'fluxo_veiculos'
+        """)).scalar()
+        if tipo == 'BASE TABLE':
+            # Snapshot antigo (só global_max_date); o histórico passa a ser a fonte
+            conn.execute(text(f"DROP TABLE {TABELA_FLUXO} CASCADE"))
+        conn.execute(text(f"""
+            CREATE OR REPLACE VIEW {TABELA_FLUXO} AS
+            SELECT * FROM {TABELA_HISTORICO}
+            WHERE dt_comptc = (SELECT MAX(dt_comptc) FROM {TABELA_HISTORICO})
+        """))
+
+
+def last_stored_month(db):
+    """Último fim de mês gravado no histórico (None se vazio)."""
+    df = db.read_sql(f"SELECT MAX(dt_comptc) AS max_date FROM {TABELA_HISTORICO}")
+    if df.empty or pd.isnull(df.iloc[0]['max_date']):
+        return None
+    return pd.Timestamp(df.iloc[0]['max_date'])
+
+
+# ============================================================================
+# LOADER (STREAMING)
+# ============================================================================
+# Uma única consulta ordenada por alocador, lida por cursor server-side em
+# chunks. Cada lote entregue contém alocadores completos (o último alocador de
+# um chunk é guardado e juntado ao próximo), então o motor pode processar lote
+# a lote: pares de alocadores diferentes são independentes. Um thread produtor
+# busca o próximo lote enquanto o consumidor calcula/grava o atual.
+
+CHUNK_POSICOES = 500_000
+
+SQL_POSICOES = """
+    SELECT cnpj_fundo, peer, dt_comptc, SUM(vl_merc_pos_final) AS total_pos
+    FROM cvm.carteira
+    WHERE (CAST(:apos AS DATE) IS NULL OR dt_comptc > :apos)
+      AND (CAST(:cnpjs AS TEXT[]) IS NULL OR cnpj_fundo = ANY(:cnpjs))
+    GROUP BY cnpj_fundo, dt_comptc, peer
+"""
+
+SQL_SEED = f"""
+    SELECT cnpj_fundo, peer_ativo AS peer, dt_comptc, total_pos
+    FROM {TABELA_HISTORICO}
+    WHERE dt_comptc BETWEEN :seed_ini AND :seed_fim AND total_pos <> 0
+      AND (CAST(:cnpjs AS TEXT[]) IS NULL OR cnpj_fundo = ANY(:cnpjs))
+"""
+
+
+def stream_positions(db, apos=None, seed=None, cnpjs=None, chunksize=CHUNK_POSICOES):
+    """
+    Gera lotes de posições (cnpj_fundo, peer, dt_comptc, total_pos) por alocador.
+
+    Args:
+        apos: só posições da cvm.carteira com dt_comptc > apos
+        seed: (seed_ini, seed_fim) para incluir as posições propagadas do histórico
+        cnpjs: lista opcional de alocadores (bind como array, sem montar IN no SQL)
+    """
+    sql = SQL_POSICOES
+    params = {
+        "apos": apos.date() if apos is not None else None,
+        "cnpjs": list(cnpjs) if cnpjs else None,
+    }
+    if seed is not None:
+        sql = f"{SQL_SEED} UNION ALL {SQL_POSICOES}"
+        params.update({"seed_ini": seed[0].date(), "seed_fim": seed[1].date()})
+    sql = f"SELECT * FROM ({sql}) p ORDER BY cnpj_fundo"
+
+    resto = None
+    with db.engine.connect().execution_options(stream_results=True) as conn:
+        for chunk in pd.read_sql(text(sql), conn, params=params, chunksize=chunksize):
+            if resto is not None:
+                chunk = pd.concat([resto, chunk], ignore_index=True)
+            ultimo = chunk['cnpj_fundo'].iloc[-1]
+            cauda = (chunk['cnpj_fundo'] == ultimo).to_numpy()
+            resto = chunk[cauda]
+            if not cauda.all():
+                yield chunk[~cauda]
+    if resto is not None and not resto.empty:
+        yield resto
+
+
+def prefetch(iterable, depth=2):
+    """
+    Consome `iterable` em um thread produtor, mantendo até `depth` itens prontos.
+
+    Se o consumidor parar antes do fim (exceção no corpo do loop, break), o produtor
+    é avisado e encerra em vez de ficar preso na fila cheia; `iterable` é fechado.
+    """
+    fila = queue.Queue(maxsize=depth)
+    fim = object()
+    erro = []
+    parar = threading.Event()
+
+    def entregar(item):
+        """put que desiste quando o consumidor já parou."""
+        while not parar.is_set():
+            try:
+                fila.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produtor():
+        try:
+            for item in iterable:
+                if not entregar(item):
+                    break
+        except BaseException as e:
+            erro.append(e)
+        finally:
+            fechar = getattr(iterable, 'close', None)
+            if fechar is not None:
+                fechar()
+            entregar(fim)
+
+    t = threading.Thread(target=produtor, daemon=True)
+    t.start()
+    try:
+        while True:
+            item = fila.get()
+            if item is fim:
+                break
+            yield item
+    finally:
+        parar.set()
+        t.join()
+    if erro:
+        raise erro[0]
+
+
+# ============================================================================
+# JOB
+# ============================================================================
+
+def calcular_fluxo_refatorado(reprocessar=MESES_REPROCESSAR, rebuild=False):
     db = PostgresConnector()
-    print("Iniciando cálculo de fluxo de veículos (Refatorado - FFill até Data Ref)...")
+    print("Iniciando cálculo de fluxo de veículos (histórico mensal incremental)...")
+    ensure_history(db)
 
     # 1. Obter Data de Referência Global (Máxima em cvm.cda_fi_blc_2)
     print("Obtendo data de referência global...")
@@ -20,211 +308,61 @@ def calcular_fluxo_refatorado():
     if df_date.empty or pd.isnull(df_date.iloc[0]['max_date']):
         print("Erro: Não foi possível obter data de referência de cvm.cda_fi_blc_2")
         return
-    
+
     global_max_date = pd.to_datetime(df_date.iloc[0]['max_date'])
+    ref_mes = int(_month_number(pd.Series([global_max_date]))[0])
     print(f"Data de Referência Global: {global_max_date.date()}")
 
-    # 2. Carregar dados brutos de carteira
-    # Precisamos de todo o histórico para fazer o ffill corretamente e calcular diffs longos (60m)
-    print("Carregando histórico de posições da cvm.carteira...")
-    query = """
-        SELECT cnpj_fundo, dt_comptc, peer, SUM(vl_merc_pos_final) as total_pos
-        FROM cvm.carteira
-        GROUP BY cnpj_fundo, dt_comptc, peer
-        ORDER BY cnpj_fundo, dt_comptc
-    """
-    df = db.read_sql(query)
-    
-    if df.empty:
-        print("Erro: cvm.carteira vazia.")
-        return
+    # 2. Ponto de partida: último mês gravado menos os meses a reprocessar
+    ultimo = None if rebuild else last_stored_month(db)
+    if ultimo is None:
+        print("Histórico vazio (ou --rebuild): calculando todos os meses.")
+        lotes = stream_positions(db)
+        completo_ate = None
+        dt_ini = None
+    else:
+        dt_ini = (ultimo - pd.DateOffset(months=reprocessar - 1)) + pd.offsets.MonthEnd(0)
+        seed_fim = dt_ini - pd.offsets.MonthEnd(1)
+        seed_ini = seed_fim - pd.DateOffset(months=max(JANELAS) - 1) + pd.offsets.MonthEnd(0)
+        print(f"Último mês gravado: {ultimo.date()}. Recalculando a partir de {dt_ini.date()} "
+              f"(seed {seed_ini.date()} a {seed_fim.date()}).")
+        lotes = stream_positions(db, apos=seed_fim, seed=(seed_ini, seed_fim))
+        completo_ate = int(_month_number(pd.Series([seed_fim]))[0])
 
-    df['dt_comptc'] = pd.to_datetime(df['dt_comptc'])
-    
-    # Lista de janelas solicitadas
-    janelas = [6, 12, 24, 36, 48, 60]
-    results = []
-    
-    # Processar por Fundo
-    print(f"Processando {df['cnpj_fundo'].nunique()} fundos...")
-    
-    # Otimização: Agrupar e aplicar
-    # Para cada grupo (fundo), vamos fazer reindex até a data global
-    
-    def process_group(group):
-        if group.empty:
-            return None
-            
-        cnpj = group['cnpj_fundo'].iloc[0]
-        # O peer pode mudar ao longo do tempo? Assumimos que queremos agrupar fluxo por peer.
-        # Se um fundo muda de peer, isso complica. Vamos assumir o peer mais recente para a "linha" final,
-        # mas calcular o fluxo baseando-se no histórico. O usuário pediu "por cnpj_fundo e peer".
-        # Se um fundo tem Peer A em Jan e Peer B em Dez, o fluxo de Dez deve ser atribuído ao Peer B?
-        # Sim, faz sentido.
-        
-        # Vamos pivotar por peer para tratar caso de múltiplos peers no histórico (raro mas possível)
-        # Se o fundo investe em múltiplos peers ao msm tempo? Sim, "peer" aqui é do ATIVO (fundo investido).
-        # A cvm.carteira tem `peer` da cota investida.
-        # Então um Allocador investe em vários ativos com peers diferentes.
-        # O cálculo deve ser por (Allocador, Peer_Ativo).
-        
-        # Nesse caso, o group deve ser ['cnpj_fundo', 'peer']
-        
-        # Reindexar mensalmente até a global_max_date
-        # Start date: primeira data do fundo nesse peer
-        start_date = group['dt_comptc'].min()
-        
-        # Criar range mensal completo
-        full_idx = pd.date_range(start=start_date, end=global_max_date, freq='ME')
-        
-        # Set index e reindex
-        g_indexed = group.set_index('dt_comptc')
-        # Remove duplicatas de index se houver (mesmo fundo/peer/data)
-        g_indexed = g_indexed[~g_indexed.index.duplicated(keep='last')]
-        
-        # Reindex com forward fill (propaga a última posição conhecida até hoje)
-        g_filled = g_indexed.reindex(full_idx, method='ffill')
-        
-        # Fill zeros para datas antes do inicio (não deve acontecer dado start_date) 
-        # ou buracos no meio que ffill pegou
-        g_filled['total_pos'] = g_filled['total_pos'].fillna(0)
-        g_filled['cnpj_fundo'] = cnpj
-        g_filled['peer'] = group['peer'].iloc[0] # Peer é constante neste grupo do apply
-        
-        # Calcular Fluxos para a ÚLTIMA data (que é global_max_date)
-        # Queremos o valor nesta data
-        last_row = g_filled.iloc[-1]
-        
-        # Se a última data real do fundo for muito antiga (ex: fundo fechou em 2020), 
-        # o ffill vai trazer saldo de 2020 até 2025. Isso é correto?
-        # Para "calcular fluxo", se o fundo morreu, saldo é zero.
-        # Mas 'cvm.carteira' normalmente filtra fundos ativos ou 'dt_fim is null'.
-        # Assumiremos que ffill é o desejado para "atraso de divulgação".
-        
-        res = {
-            'cnpj_fundo': cnpj,
-            'peer_ativo': group['peer'].iloc[0],
-            'dt_comptc': global_max_date,  # Forçamos a data ser a de referência
-            'total_pos': last_row['total_pos']
-        }
-        
-        # Calcular diffs
-        # Posição atual (na data ref) menos Posição na data (ref - janela)
-        # Como g_filled tem todas as datas mensais, podemos usar shift ou loc
-        
-        current_val = last_row['total_pos']
-        
-        for m in janelas:
-            # Data alvo no passado
-            target_date = global_max_date - pd.DateOffset(months=m)
-            # Encontrar o valor mais próximo ou exato no índice
-            # Como é freq='ME', target_date deve bater se for fim de mês.
-            # Ajustar target_date para fim de mês se necessário
-            target_date = target_date + pd.offsets.MonthEnd(0)
-            
-            if target_date in g_filled.index:
-                past_val = g_filled.loc[target_date, 'total_pos']
-                # Se past_val for NaN (antes do inicio do fundo), fluxo é desde o inicio
-                if pd.isna(past_val):
-                    past_val = 0
-                fluxo = current_val - past_val
-            else:
-                # Se a data alvo é antes do início do histórico do fundo + ffill,
-                # assumimos que a posição era 0?
-                # "todo fundo que teve fluxo 6M precisa ter fluxo 12M em diante"
-                # Se o fundo começou há 1 mês, Pos(Hoje) - Pos(-6M = 0) = Pos(Hoje).
-                past_val = 0
-                fluxo = current_val - 0
-            
-            res[f'fluxo_{m}m'] = fluxo
-            
-        return res
-
-    # Agrupar por Allocador e PeerInvestido
-    # Isso gera muitas linhas, processar pandas apply pode ser lento.
-    # Vamos tentar vetorizar se possível, ou iterar grupos.
-    
-    # Lista de resultados
-    final_rows = []
-    
-    grouped = df.groupby(['cnpj_fundo', 'peer'])
-    
-    # Processamento
-    # Para performance, vamos trabalhar com pivot table global
-    print("Pivotando dados para cálculo vetorizado...")
-    pivot = df.pivot_table(index='dt_comptc', columns=['cnpj_fundo', 'peer'], values='total_pos', aggfunc='sum')
-    
-    # Reindex pivot até data global
-    full_idx = pd.date_range(start=pivot.index.min(), end=global_max_date, freq='ME')
-    pivot = pivot.reindex(full_idx)
-    
-    # FFill para propagar dados recentes
-    pivot = pivot.ffill()
-    pivot = pivot.fillna(0) # Zeros antes do inicio
-    
-    # Pegar valores na data final
-    if global_max_date not in pivot.index:
-         # Isso não deve acontecer se o reindex funcionou e global_max é MonthEnd
-         # Se global_max não for month end, precisamos ajustar
-         pass
-
-    # Garantir que pegamos a última linha que corresponde à global_max_date
-    final_pos = pivot.loc[pivot.index == global_max_date].iloc[0] # Series com MultiIndex (CNPJ, Peer)
-    
-    # Dicionário para montar DataFrame final
-    data_dict = {
-        'cnpj_fundo': final_pos.index.get_level_values(0),
-        'peer_ativo': final_pos.index.get_level_values(1),
-        'dt_comptc': [global_max_date] * len(final_pos),
-        'total_pos': final_pos.values
-    }
-    
-    # Calcular fluxos vetorizados
-    for m in janelas:
-        print(f"Calculando janela {m}M...")
-        # Data no passado
-        # Como o índice é DatetimeIndex, podemos usar shift se os intervalos fossem regulares.
-        # Mas 'm' é meses. 'ME' garante regularidade mensal.
-        # shift(m) pega m linhas atrás.
-        
-        diff = pivot.diff(m) # pivot - pivot.shift(m)
-        
-        # Valor do fluxo na data final
-        fluxos_na_data = diff.loc[diff.index == global_max_date].iloc[0]
-        
-        # Se shift resultou em NaN (período antes do início), diff é NaN.
-        # Devemos tratar como (Valor Atual - 0) ?
-        # shift(m) retorna NaN para os primeiros m meses.
-        # diff = col - col.shift(). Se col.shift é NaN, diff é NaN.
-        # Queremos: se NaN, considerar 0. 
-        # Então fazemos: pivot - pivot.shift(m).fillna(0)
-        
-        shifted = pivot.shift(m).fillna(0)
-        diff_calculated = pivot - shifted
-        
-        vals = diff_calculated.loc[diff_calculated.index == global_max_date].iloc[0]
-        data_dict[f'fluxo_{m}m'] = vals.values
-
-    df_final = pd.DataFrame(data_dict)
-    
-    # Filtrar onde total_pos e fluxos são todos zero?
-    # O usuário não especificou, mas dados zerados poluem o banco.
-    # Mas se um fundo zerou posição recentemente, o "fluxo" é negativo, não zero.
-    # Vamos manter se houver qualquer valor não nulo relevante ou se total_pos > 0.
-    
-    cols_fluxo = [f'fluxo_{m}m' for m in janelas]
-    mask = (df_final['total_pos'] != 0)
-    for c in cols_fluxo:
-        mask |= (df_final[c] != 0)
-        
-    df_final = df_final[mask]
-    
-    print(f"Gerados {len(df_final)} registros para a data {global_max_date.date()}.")
-    
-    # Salvar
-    print("Salvando em alocadores.fluxo_veiculos...")
-    db.overwrite_table(df_final, 'alocadores.fluxo_veiculos')
-    print("Concluído sucesso.")
+    # 3. Painel e fluxos lote a lote (alocadores completos), gravando via COPY
+    # na mesma transação que remove os meses recalculados
+    n_fundos, n_registros = 0, 0
+    with db.engine.begin() as conn:
+        if dt_ini is None:
+            conn.execute(text(f"TRUNCATE {TABELA_HISTORICO}"))
+        else:
+            conn.execute(text(f"DELETE FROM {TABELA_HISTORICO} WHERE dt_comptc >= :dt"), {"dt": dt_ini.date()})
+
+        for df in prefetch(lotes):
+            pares, primeiro_mes, painel = build_panel(df, global_max_date, completo_ate=completo_ate)
+            mes_ini = primeiro_mes if dt_ini is None else int(_month_number(pd.Series([dt_ini]))[0])
+            meses = np.arange(mes_ini, ref_mes + 1)
+
+            for i in range(0, len(meses), MESES_POR_LOTE):
+                df_fluxo = flows_at(pares, primeiro_mes, painel, meses[i:i + MESES_POR_LOTE])
+                if df_fluxo.empty:
+                    continue
+                df_fluxo['dt_comptc'] = pd.to_datetime(df_fluxo['dt_comptc']).dt.date
+                db.copy_dataframe(df_fluxo, TABELA_HISTORICO, conn=conn)
+                n_registros += len(df_fluxo)
+
+            n_fundos += df['cnpj_fundo'].nunique()
+            print(f"  {n_fundos} alocadores processados, {n_registros} registros gravados...")
+
+    if n_fundos == 0:
+        print("Nenhuma posição nova em cvm.carteira.")
+    print(f"Concluído sucesso: {n_registros} registros em {TABELA_HISTORICO}.")
 
 if __name__ == "__main__":
-    calcular_fluxo_refatorado()
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--reprocessar', type=int, default=MESES_REPROCESSAR,
+                        help="Meses finais do histórico recalculados a cada execução (divulgações atrasadas)")
+    parser.add_argument('--rebuild', action='store_true',
+                        help="Recalcula o histórico inteiro a partir da cvm.carteira")
+    args = parser.parse_args()
+    calcular_fluxo_refatorado(max(1, args.reprocessar), rebuild=args.rebuild)
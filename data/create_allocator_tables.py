@@ -1,5 +1,7 @@
 import sys
 import os
+import hashlib
+import argparse
 import pandas as pd
 from sqlalchemy import text
 
@@ -11,21 +13,68 @@ if project_root not in sys.path:
 
 from common.postgresql import PostgresConnector
 
-def run():
-    db = PostgresConnector()
-    print("--- Creating Allocator Tables (Phase 2) ---")
-    
-    # Ensure schema
-    db.execute_sql("CREATE SCHEMA IF NOT EXISTS alocadores;")
-    
-    # 1. r_amostral_2 (Peer Dominante)
-    print("1. Creating r_amostral_2...")
-    sql_1 = """
-    DROP TABLE IF EXISTS alocadores.r_amostral_2 CASCADE;
-    CREATE TABLE alocadores.r_amostral_2 AS
+# ==========================================
+# MANUTENÇÃO INCREMENTAL
+# ==========================================
+# Antes: DROP + CREATE TABLE AS de todas as tabelas a cada execução. Agora cada tabela guarda
+# o estado das fontes de que foi derivada, por data de competência (ou por chave):
+# - assinatura de cada data da fonte = (linhas, soma de hashtext da linha), em alocadores.r_estado;
+# - datas novas, alteradas ou removidas na fonte -> DELETE + INSERT só dessas datas (e das que
+#   dependem delas: deltas de 6M..60M, LAG do movimento);
+# - definição nova (hash no COMMENT da tabela), tabela inexistente ou --rebuild -> build completo
+#   em "<tabela>__stg", indexado e trocado com a atual (swap_table).
+# Escrita incremental e registro do estado vão na mesma transação.
+# Cópias 1:1 de uma relação (r_carteira) viram VIEW sobre ela: nada é copiado nem mantido.
+ESTADO = "alocadores.r_estado"
+STAGING_SUFFIX = "__stg"
+JANELAS_MESES = (6, 12, 24, 36, 48, 60)
+
+# Fontes grandes por data: a assinatura só varre as datas a partir da última registrada menos a
+# janela de revisão em dias (a CVM republica os períodos recentes). --full-check varre tudo.
+# cvm.cotas: informe diário; cvm.carteira: CDA mensal (DADOS traz os arquivos do último ano).
+REVISAO_DIAS = {'cvm.cotas': 45, 'cvm.carteira': 400}
+
+DDL_ESTADO = f"""
+CREATE SCHEMA IF NOT EXISTS alocadores;
+CREATE SCHEMA IF NOT EXISTS kinea;
+CREATE TABLE IF NOT EXISTS {ESTADO} (
+    tabela VARCHAR,
+    fonte VARCHAR,
+    chave VARCHAR,
+    linhas BIGINT,
+    assinatura BIGINT,
+    atualizado_em TIMESTAMP DEFAULT NOW(),
+    PRIMARY KEY (tabela, fonte, chave)
+);
+"""
+
+FILTRO_DATAS = "CAST(:datas AS DATE[])"
+
+
+def definition_hash(spec):
+    definicao = " ".join(spec['sql'].split()) + repr(spec['indices'])
+    return hashlib.md5(definicao.encode()).hexdigest()
+
+
+def deltas_sql(chaves):
+    """Colunas delta_XM / pct_XM de m1 contra a mesma chave X meses antes (um LEFT JOIN por janela)."""
+    cols, joins = [], []
+    for k in JANELAS_MESES:
+        cols.append(f"m1.vl_ref - m{k}.vl_ref as delta_{k}M, (m1.vl_ref - m{k}.vl_ref) / NULLIF(m{k}.vl_ref, 0) as pct_{k}M")
+        cond = " AND ".join(f"m1.{c} = m{k}.{c}" for c in chaves)
+        joins.append(f"LEFT JOIN {{base}} m{k} ON {cond} AND m{k}.dt_ref = (m1.dt_ref - INTERVAL '{k} month')::date")
+    return ",\n        ".join(cols), "\n    ".join(joins)
+
+
+# ==========================================
+# DEFINIÇÕES
+# ==========================================
+# {filtro*}: vazio no build completo; restrição às datas/chaves afetadas no incremental.
+
+SQL_AMOSTRAL = """
     WITH allocation_per_peer AS (
-        SELECT 
-            cliente, 
+        SELECT
+            cliente,
             cnpj_fundo,
             denom_social,
             peer,
@@ -39,52 +88,41 @@ def run():
             ROW_NUMBER() OVER (PARTITION BY cnpj_fundo ORDER BY total_peer DESC) as rn
         FROM allocation_per_peer
     )
-    SELECT 
+    SELECT
         cliente,
         peer,
         total_peer as vl_merc_pos_final,
         cnpj_fundo,
         denom_social
     FROM ranked
-    WHERE rn = 1;
-    """
-    db.execute_sql(sql_1)
-    
-    # 2. r_apelidos (Sanitization)
-    print("2. Creating r_apelidos...")
-    sql_2 = """
-    DROP TABLE IF EXISTS alocadores.r_apelidos CASCADE;
-    CREATE TABLE alocadores.r_apelidos AS
-    SELECT 
+    WHERE rn = 1
+"""
+
+SQL_APELIDOS = """
+    SELECT
         cnpj_fundo,
         TRIM(REGEXP_REPLACE(denom_social, '(FUNDO DE INVESTIMENTO|FI|FIM|FIC|MULTIMERCADO|RENDA FIXA|AÇÕES|CAMBIAL|EM COTAS DE FUNDOS DE INVESTIMENTO|CRÉDITO PRIVADO|CP|LP|LONG PRAZO|PARTICIPAÇÕES|FIP|IE|ISENTO|DEBÊNTURES)', '', 'gi')) as apelido
-    FROM cvm.cadastro;
-    """
-    db.execute_sql(sql_2)
-
-    # 3. r_carteira (Copy)
-    print("3. Creating r_carteira...")
-    db.execute_sql("DROP TABLE IF EXISTS alocadores.r_carteira CASCADE;")
-    db.execute_sql("CREATE TABLE alocadores.r_carteira AS SELECT * FROM cvm.carteira;")
-    
-    # 4. fundos_kinea
-    print("4. Creating fundos_kinea...")
-    sql_4 = """
-    DROP TABLE IF EXISTS kinea.fundos CASCADE;
-    CREATE TABLE kinea.fundos AS
+    FROM cvm.cadastro
+"""
+
+# View sobre cvm.carteira (antes: cópia física da maior relação analítica a cada execução).
+# Projeção explícita: SELECT * congelaria as colunas da carteira na criação da view. Os índices
+# são os da própria cvm.carteira; swap_table reaponta a view quando a carteira é reconstruída.
+SQL_CARTEIRA = """
+    SELECT dt_comptc, cnpj_fundo, denom_social, cliente, cliente_segmentado,
+           cnpj_fundo_cota, nm_fundo_cota, gestor_cota, vl_merc_pos_final, peer
+    FROM cvm.carteira
+"""
+
+SQL_FUNDOS_KINEA = """
     SELECT cnpj_fundo, denom_social as nome_fundo
     FROM cvm.cadastro
-    WHERE gestor ILIKE '%KINEA%' and dt_fim is null and sit <> 'CANCELADA';
-    """
-    db.execute_sql(sql_4)
-    
-    # 5. r_fundos_kinea_metas (Mock)
-    print("5. Creating r_fundos_kinea_metas...")
-    # Mocking generic targets
-    sql_5_mock = """
-    DROP TABLE IF EXISTS alocadores.r_fundos_kinea_metas CASCADE;
-    CREATE TABLE alocadores.r_fundos_kinea_metas AS
-    SELECT 
+    WHERE gestor ILIKE '%KINEA%' and dt_fim is null and sit <> 'CANCELADA'
+"""
+
+# Metas genéricas (mock) sobre os fundos Kinea montados acima (kinea.fundos)
+SQL_KINEA_METAS = """
+    SELECT
         cnpj_fundo,
         15.0 as "6",
         25.0 as "12",
@@ -93,179 +131,509 @@ def run():
         70.0 as "48",
         85.0 as "60",
         'IPCA+Yield' as tipo
-    FROM alocadores.fundos_kinea;
-    """
-    db.execute_sql(sql_5_mock)
-
-    # 6. r_metrics (With Meses Observados)
-    print("6. Creating r_metrics...")
-    # Assuming cvm.metrics exists or calculating from cotas if not? User said "adicione as outras métricas da cvm.metrics".
-    # We will assume cvm.metrics exists. If not, this might fail, but let's try.
-    # Note: user mentioned "desde a data de início da cota do fundo".
-    try:
-        sql_6 = """
-        DROP TABLE IF EXISTS alocadores.r_metrics CASCADE;
-        CREATE TABLE alocadores.r_metrics AS
-        SELECT 
-            m.*,
-            -- Calculate months from start date relative to now
-            id_subclasse,
-            DATE_PART('year', AGE(CURRENT_DATE, c.dt_ini)) * 12 + DATE_PART('month', AGE(CURRENT_DATE, c.dt_ini)) as meses_observados
-        FROM cvm.metrics m
-        LEFT JOIN cvm.cadastro c ON m.cnpj_fundo = c.cnpj_fundo;
-        """
-        # If cvm.metrics doesn't exist, this will error. We should ideally create it or handle it.
-        # For now, let's assume it exists as per context.
-        # But wait, cvm.metrics usually comes from python calc.
-        # If it doesn't exist, we create a dummy.
-        check_metrics = "CREATE TABLE IF NOT EXISTS cvm.metrics (cnpj_fundo VARCHAR, janela INT, ret FLOAT, vol FLOAT, mdd FLOAT, recovery_time FLOAT, sharpe FLOAT, calmar FLOAT, hit_ratio FLOAT, info_ratio FLOAT);"
-        db.execute_sql(check_metrics)
-        db.execute_sql(sql_6)
-    except Exception as e:
-        print(f"Error creating r_metrics: {e}")
-
-    # 7. r_mov_carteira_gestor_peer (Delta Value)
-    print("7. Creating r_mov_carteira_gestor_peer...")
-    sql_7 = """
-    DROP TABLE IF EXISTS alocadores.r_mov_carteira_gestor_peer CASCADE;
-    CREATE TABLE alocadores.r_mov_carteira_gestor_peer AS
-    WITH agg AS (
-        SELECT 
+    FROM kinea.fundos
+"""
+
+# Meses desde o início da cota do fundo até hoje. dt_ini_cadastro fica gravada para o
+# meses_observados ser atualizado sem reler cvm.cadastro (atualiza_meses_observados).
+SQL_MESES_OBSERVADOS = ("DATE_PART('year', AGE(CURRENT_DATE, {dt_ini})) * 12 "
+                        "+ DATE_PART('month', AGE(CURRENT_DATE, {dt_ini}))")
+
+SQL_METRICS = f"""
+    SELECT
+        m.*,
+        id_subclasse,
+        c.dt_ini as dt_ini_cadastro,
+        {SQL_MESES_OBSERVADOS.format(dt_ini='c.dt_ini')} as meses_observados
+    FROM cvm.metrics m
+    LEFT JOIN cvm.cadastro c ON m.cnpj_fundo = c.cnpj_fundo
+    {{filtro}}
+"""
+
+# Se cvm.metrics ainda não existe (vem do cálculo em Python), cria uma vazia
+DDL_METRICS_VAZIA = "CREATE TABLE IF NOT EXISTS cvm.metrics (cnpj_fundo VARCHAR, dt_comptc DATE, janela INT, ret FLOAT, vol FLOAT, mdd FLOAT, recovery_time FLOAT, sharpe FLOAT, calmar FLOAT, hit_ratio FLOAT, info_ratio FLOAT);"
+
+SQL_MOV_AGG = """
+        SELECT
             dt_comptc,
             cliente,
             peer,
             gestor_cota as gestor,
             SUM(vl_merc_pos_final) as valor
         FROM cvm.carteira
+        {filtro}
         GROUP BY dt_comptc, cliente, peer, gestor_cota
-    ),
+"""
+
+SQL_MOV = f"""
+    WITH agg AS ({SQL_MOV_AGG.format(filtro='')}),
     lagged AS (
-        SELECT 
+        SELECT
             *,
             LAG(valor) OVER (PARTITION BY cliente, peer, gestor ORDER BY dt_comptc) as prev_valor
         FROM agg
     )
-    SELECT 
+    SELECT
         dt_comptc,
         cliente,
         peer,
         gestor,
         valor,
         (valor - COALESCE(prev_valor, 0)) as delta_valor
-    FROM lagged;
-    """
-    db.execute_sql(sql_7)
+    FROM lagged
+"""
 
-    # 8. r_fluxo_peer (Variations for Client Allocation per Peer)
-    print("8. Creating r_fluxo_peer...")
-    sql_8 = """
-    DROP TABLE IF EXISTS alocadores.r_fluxo_peer CASCADE;
-    CREATE TABLE alocadores.r_fluxo_peer AS
+_cols, _joins = deltas_sql(['cliente', 'peer'])
+SQL_FLUXO_PEER = f"""
     WITH monthly AS (
-        SELECT 
+        SELECT
             cliente,
             peer,
             dt_comptc as dt_ref,
             SUM(vl_merc_pos_final) as vl_ref
         FROM cvm.carteira
+        {{filtro_base}}
         GROUP BY cliente, peer, dt_comptc
     )
-    SELECT 
+    SELECT
         m1.cliente, m1.peer, m1.dt_ref, m1.vl_ref,
-        m1.vl_ref - m6.vl_ref as delta_6M, (m1.vl_ref - m6.vl_ref) / NULLIF(m6.vl_ref, 0) as pct_6M,
-        m1.vl_ref - m12.vl_ref as delta_12M, (m1.vl_ref - m12.vl_ref) / NULLIF(m12.vl_ref, 0) as pct_12M,
-        m1.vl_ref - m24.vl_ref as delta_24M, (m1.vl_ref - m24.vl_ref) / NULLIF(m24.vl_ref, 0) as pct_24M,
-        m1.vl_ref - m36.vl_ref as delta_36M, (m1.vl_ref - m36.vl_ref) / NULLIF(m36.vl_ref, 0) as pct_36M,
-        m1.vl_ref - m48.vl_ref as delta_48M, (m1.vl_ref - m48.vl_ref) / NULLIF(m48.vl_ref, 0) as pct_48M,
-        m1.vl_ref - m60.vl_ref as delta_60M, (m1.vl_ref - m60.vl_ref) / NULLIF(m60.vl_ref, 0) as pct_60M
+        {_cols}
     FROM monthly m1
-    LEFT JOIN monthly m6 ON m1.cliente = m6.cliente AND m1.peer = m6.peer AND m6.dt_ref = (m1.dt_ref - INTERVAL '6 month')::date
-    LEFT JOIN monthly m12 ON m1.cliente = m12.cliente AND m1.peer = m12.peer AND m12.dt_ref = (m1.dt_ref - INTERVAL '12 month')::date
-    LEFT JOIN monthly m24 ON m1.cliente = m24.cliente AND m1.peer = m24.peer AND m24.dt_ref = (m1.dt_ref - INTERVAL '24 month')::date
-    LEFT JOIN monthly m36 ON m1.cliente = m36.cliente AND m1.peer = m36.peer AND m36.dt_ref = (m1.dt_ref - INTERVAL '36 month')::date
-    LEFT JOIN monthly m48 ON m1.cliente = m48.cliente AND m1.peer = m48.peer AND m48.dt_ref = (m1.dt_ref - INTERVAL '48 month')::date
-    LEFT JOIN monthly m60 ON m1.cliente = m60.cliente AND m1.peer = m60.peer AND m60.dt_ref = (m1.dt_ref - INTERVAL '60 month')::date;
-    """
-    db.execute_sql(sql_8)
-    
-    # 9. r_var_gestor_cota (Variation of PL of the Groups invested in)
-    print("9. Creating r_var_gestor_cota...")
-    # Logic: 
-    # 1. Identify Target Groups (Gestor Cota) from cvm.carteira.
-    # 2. Sum vl_patrim_liq from cvm.cotas for all funds belonging to those groups.
-    # 3. Calculate deltas.
-    
-    sql_9 = """
-    DROP TABLE IF EXISTS alocadores.r_var_gestor_cota CASCADE;
-    CREATE TABLE alocadores.r_var_gestor_cota AS
+    {_joins.format(base='monthly')}
+    {{filtro}}
+"""
+
+# Variação do PL dos grupos investidos: fundos-alvo (cotas presentes em cvm.carteira) por grupo
+_cols, _joins = deltas_sql(['grupo_cota'])
+SQL_VAR_GESTOR = f"""
     WITH target_funds AS (
         SELECT DISTINCT cda.cnpj_fundo_cota as cnpj_fundo, cda.gestor_cota as grupo
         FROM cvm.carteira cda
+        {{filtro_alvos}}
     ),
     daily_pl_group AS (
-        SELECT 
+        SELECT
             tf.grupo as grupo_cota,
             c.dt_comptc as dt_ref,
             SUM(c.vl_patrim_liq) as vl_ref
         FROM cvm.cotas c
         INNER JOIN target_funds tf ON c.cnpj_fundo = tf.cnpj_fundo
+        {{filtro_base}}
         GROUP BY tf.grupo, c.dt_comptc
     )
-    SELECT 
+    SELECT
         m1.grupo_cota, m1.dt_ref, m1.vl_ref,
-        m1.vl_ref - m6.vl_ref as delta_6M, (m1.vl_ref - m6.vl_ref) / NULLIF(m6.vl_ref, 0) as pct_6M,
-        m1.vl_ref - m12.vl_ref as delta_12M, (m1.vl_ref - m12.vl_ref) / NULLIF(m12.vl_ref, 0) as pct_12M,
-        m1.vl_ref - m24.vl_ref as delta_24M, (m1.vl_ref - m24.vl_ref) / NULLIF(m24.vl_ref, 0) as pct_24M,
-        m1.vl_ref - m36.vl_ref as delta_36M, (m1.vl_ref - m36.vl_ref) / NULLIF(m36.vl_ref, 0) as pct_36M,
-        m1.vl_ref - m48.vl_ref as delta_48M, (m1.vl_ref - m48.vl_ref) / NULLIF(m48.vl_ref, 0) as pct_48M,
-        m1.vl_ref - m60.vl_ref as delta_60M, (m1.vl_ref - m60.vl_ref) / NULLIF(m60.vl_ref, 0) as pct_60M
+        {_cols}
     FROM daily_pl_group m1
-    LEFT JOIN daily_pl_group m6 ON m1.grupo_cota = m6.grupo_cota AND m6.dt_ref = (m1.dt_ref - INTERVAL '6 month')::date
-    LEFT JOIN daily_pl_group m12 ON m1.grupo_cota = m12.grupo_cota AND m12.dt_ref = (m1.dt_ref - INTERVAL '12 month')::date
-    LEFT JOIN daily_pl_group m24 ON m1.grupo_cota = m24.grupo_cota AND m24.dt_ref = (m1.dt_ref - INTERVAL '24 month')::date
-    LEFT JOIN daily_pl_group m36 ON m1.grupo_cota = m36.grupo_cota AND m36.dt_ref = (m1.dt_ref - INTERVAL '36 month')::date
-    LEFT JOIN daily_pl_group m48 ON m1.grupo_cota = m48.grupo_cota AND m48.dt_ref = (m1.dt_ref - INTERVAL '48 month')::date
-    LEFT JOIN daily_pl_group m60 ON m1.grupo_cota = m60.grupo_cota AND m60.dt_ref = (m1.dt_ref - INTERVAL '60 month')::date;
-    """
-    db.execute_sql(sql_9)
+    {_joins.format(base='daily_pl_group')}
+    {{filtro}}
+"""
 
-    # 10. r_var_nm_fundo_cota (Variation of PL by Fund Name/CNPJ)
-    print("10. Creating r_var_nm_fundo_cota...")
-    sql_10 = """
-    DROP TABLE IF EXISTS alocadores.r_var_nm_fundo_cota CASCADE;
-    CREATE TABLE alocadores.r_var_nm_fundo_cota AS
+_cols, _joins = deltas_sql(['cnpj_fundo_cota'])
+SQL_VAR_FUNDO = f"""
     WITH target_funds AS (
         SELECT DISTINCT cnpj_fundo_cota as cnpj_fundo, nm_fundo_cota
         FROM cvm.carteira
+        {{filtro_alvos}}
     ),
     daily_pl_fund AS (
-        SELECT 
+        SELECT
             tf.nm_fundo_cota,
             tf.cnpj_fundo as cnpj_fundo_cota,
             c.dt_comptc as dt_ref,
             c.vl_patrim_liq as vl_ref
         FROM cvm.cotas c
         INNER JOIN target_funds tf ON c.cnpj_fundo = tf.cnpj_fundo
+        {{filtro_base}}
     )
-    SELECT 
+    SELECT
         m1.nm_fundo_cota, m1.cnpj_fundo_cota, m1.dt_ref, m1.vl_ref,
-        m1.vl_ref - m6.vl_ref as delta_6M, (m1.vl_ref - m6.vl_ref) / NULLIF(m6.vl_ref, 0) as pct_6M,
-        m1.vl_ref - m12.vl_ref as delta_12M, (m1.vl_ref - m12.vl_ref) / NULLIF(m12.vl_ref, 0) as pct_12M,
-        m1.vl_ref - m24.vl_ref as delta_24M, (m1.vl_ref - m24.vl_ref) / NULLIF(m24.vl_ref, 0) as pct_24M,
-        m1.vl_ref - m36.vl_ref as delta_36M, (m1.vl_ref - m36.vl_ref) / NULLIF(m36.vl_ref, 0) as pct_36M,
-        m1.vl_ref - m48.vl_ref as delta_48M, (m1.vl_ref - m48.vl_ref) / NULLIF(m48.vl_ref, 0) as pct_48M,
-        m1.vl_ref - m60.vl_ref as delta_60M, (m1.vl_ref - m60.vl_ref) / NULLIF(m60.vl_ref, 0) as pct_60M
+        {_cols}
     FROM daily_pl_fund m1
-    LEFT JOIN daily_pl_fund m6 ON m1.cnpj_fundo_cota = m6.cnpj_fundo_cota AND m6.dt_ref = (m1.dt_ref - INTERVAL '6 month')::date
-    LEFT JOIN daily_pl_fund m12 ON m1.cnpj_fundo_cota = m12.cnpj_fundo_cota AND m12.dt_ref = (m1.dt_ref - INTERVAL '12 month')::date
-    LEFT JOIN daily_pl_fund m24 ON m1.cnpj_fundo_cota = m24.cnpj_fundo_cota AND m24.dt_ref = (m1.dt_ref - INTERVAL '24 month')::date
-    LEFT JOIN daily_pl_fund m36 ON m1.cnpj_fundo_cota = m36.cnpj_fundo_cota AND m36.dt_ref = (m1.dt_ref - INTERVAL '36 month')::date
-    LEFT JOIN daily_pl_fund m48 ON m1.cnpj_fundo_cota = m48.cnpj_fundo_cota AND m48.dt_ref = (m1.dt_ref - INTERVAL '48 month')::date
-    LEFT JOIN daily_pl_fund m60 ON m1.cnpj_fundo_cota = m60.cnpj_fundo_cota AND m60.dt_ref = (m1.dt_ref - INTERVAL '60 month')::date;
+    {_joins.format(base='daily_pl_fund')}
+    {{filtro}}
+"""
+
+# Fundos-alvo por chave (grupo / CNPJ da cota): mudança no conjunto recalcula a chave inteira
+FONTES_DERIVADAS = {
+    'alvos_gestor': "(SELECT DISTINCT cnpj_fundo_cota, gestor_cota FROM cvm.carteira)",
+    'alvos_fundo': "(SELECT DISTINCT cnpj_fundo_cota, nm_fundo_cota FROM cvm.carteira)",
+}
+
+
+# ==========================================
+# ESTADO DAS FONTES
+# ==========================================
+
+def fingerprint(conn, fonte, chave=None, desde=None):
+    """
+    {chave: (linhas, assinatura)} da fonte. A assinatura soma hashtext da linha inteira, então
+    independe da ordem e muda com qualquer coluna. chave=None: a fonte inteira vira uma entrada '*'.
+    Fontes derivadas (fundos-alvo) têm chave texto, com '' no lugar de NULL.
     """
-    db.execute_sql(sql_10)
+    derivada = fonte in FONTES_DERIVADAS
+    fonte = FONTES_DERIVADAS.get(fonte, fonte)
+    if chave is None:
+        sql = f"SELECT '*', COUNT(*), COALESCE(SUM(hashtext(f::text)), 0) FROM {fonte} f"
+    else:
+        where = "" if derivada else (f"WHERE f.{chave} IS NOT NULL"
+                                     + (f" AND f.{chave} >= CAST(:desde AS DATE)" if desde else ""))
+        sql = f"""
+            SELECT COALESCE(f.{chave}::text, ''), COUNT(*), COALESCE(SUM(hashtext(f::text)), 0)
+            FROM {fonte} f {where} GROUP BY 1
+        """
+    rows = conn.execute(text(sql), {"desde": desde} if desde else {}).fetchall()
+    return {k: (int(n), int(h)) for k, n, h in rows}
+
+
+def stored_state(conn, tabela, fonte, desde=None):
+    rows = conn.execute(text(f"""
+        SELECT chave, linhas, assinatura FROM {ESTADO}
+        WHERE tabela = :tabela AND fonte = :fonte AND (CAST(:desde AS VARCHAR) IS NULL OR chave >= :desde)
+    """), {"tabela": tabela, "fonte": fonte, "desde": desde}).fetchall()
+    return {k: (int(n), int(h)) for k, n, h in rows}
+
+
+def diff_state(atual, gravado):
+    """(chaves novas ou alteradas, chaves que sumiram da fonte)."""
+    mudadas = {k for k, v in atual.items() if gravado.get(k) != v}
+    return mudadas, set(gravado) - set(atual)
+
+
+def save_state(conn, tabela, fonte, atual, mudadas, removidas):
+    if mudadas:
+        conn.execute(text(f"""
+            INSERT INTO {ESTADO} (tabela, fonte, chave, linhas, assinatura, atualizado_em)
+            VALUES (:tabela, :fonte, :chave, :linhas, :assinatura, NOW())
+            ON CONFLICT (tabela, fonte, chave) DO UPDATE
+            SET linhas = EXCLUDED.linhas, assinatura = EXCLUDED.assinatura, atualizado_em = EXCLUDED.atualizado_em
+        """), [{"tabela": tabela, "fonte": fonte, "chave": k, "linhas": atual[k][0], "assinatura": atual[k][1]}
+               for k in mudadas])
+    if removidas:
+        conn.execute(text(f"DELETE FROM {ESTADO} WHERE tabela = :tabela AND fonte = :fonte AND chave = ANY(:chaves)"),
+                     {"tabela": tabela, "fonte": fonte, "chaves": list(removidas)})
+
+
+def revisao_desde(conn, tabela, fonte):
+    """Início da janela de revisão de `fonte` (REVISAO_DIAS) para `tabela` (None = varre tudo)."""
+    ultima = conn.execute(text(f"SELECT MAX(chave) FROM {ESTADO} WHERE tabela = :tabela AND fonte = :fonte"),
+                          {"tabela": tabela, "fonte": fonte}).scalar()
+    if not ultima:
+        return None
+    return (pd.Timestamp(ultima) - pd.Timedelta(days=REVISAO_DIAS[fonte])).date().isoformat()
+
+
+def affected_dates(datas, mudadas):
+    """Datas cuja linha depende de uma data mudada: ela mesma ou d - X meses (JANELAS_MESES)."""
+    alvo = set()
+    for d in datas:
+        ts = pd.Timestamp(d)
+        if d in mudadas or any((ts - pd.DateOffset(months=k)).date().isoformat() in mudadas for k in JANELAS_MESES):
+            alvo.add(d)
+    return alvo
+
+
+def base_dates(alvo):
+    """Datas necessárias para calcular as linhas de `alvo`: elas e as referências X meses antes."""
+    base = set(alvo)
+    for d in alvo:
+        base |= {(pd.Timestamp(d) - pd.DateOffset(months=k)).date().isoformat() for k in JANELAS_MESES}
+    return base
+
+
+# ==========================================
+# ATUALIZAÇÕES INCREMENTAIS
+# ==========================================
+# Cada função recebe {fonte: (atual, mudadas, removidas)} e grava só o que mudou.
+
+def replace_all(conn, spec, mudancas):
+    """Tabelas pequenas sem data (cadastro / fundos Kinea): troca o conteúdo numa transação."""
+    conn.execute(text(f"DELETE FROM {spec['nome']}"))
+    return conn.execute(text(f"INSERT INTO {spec['nome']} {full_sql(spec)}")).rowcount
+
+
+def replace_if_last_date(conn, spec, mudancas):
+    """r_amostral_2 só olha a última data da carteira."""
+    atual, mudadas, removidas = mudancas['cvm.carteira']
+    ultima = max(atual) if atual else None
+    if ultima in mudadas or any(r > (ultima or '') for r in removidas):
+        return replace_all(conn, spec, mudancas)
+    return 0
+
+
+def replace_dates(conn, spec, mudancas):
+    """
+    Cópia por data de competência: DELETE + INSERT das datas mudadas (ou removidas) na fonte.
+    Mudança numa fonte auxiliar (ex: cvm.cadastro no JOIN de r_metrics) vale para todas as datas.
+    """
+    fonte = spec['fontes'][0][0]
+    if any(m[1] or m[2] for f, m in mudancas.items() if f != fonte):
+        return replace_all(conn, spec, mudancas)
+    atual, mudadas, removidas = mudancas[fonte]
+    datas = sorted(mudadas | removidas)
+    if not datas:
+        return 0
+    conn.execute(text(f"DELETE FROM {spec['nome']} WHERE dt_comptc = ANY({FILTRO_DATAS})"), {"datas": datas})
+    filtro = f"WHERE {spec['coluna_fonte']} = ANY({FILTRO_DATAS})"
+    return conn.execute(text(f"INSERT INTO {spec['nome']} {spec['sql'].format(filtro=filtro)}"),
+                        {"datas": sorted(mudadas)}).rowcount
+
+
+def atualiza_meses_observados(conn, spec):
+    """meses_observados é relativo a CURRENT_DATE: reescreve só as linhas cujo valor mudou."""
+    meses = SQL_MESES_OBSERVADOS.format(dt_ini='dt_ini_cadastro')
+    return conn.execute(text(f"""
+        UPDATE {spec['nome']} SET meses_observados = {meses}
+        WHERE meses_observados IS DISTINCT FROM {meses}
+    """)).rowcount
+
+
+def update_mov(conn, spec, mudancas):
+    """
+    Datas mudadas via DELETE + INSERT. O delta (LAG por cliente/peer/gestor) só é refeito nas séries
+    que tinham ou passaram a ter linha numa data mudada e, nelas, só nas linhas dessas datas e na
+    primeira linha depois de cada uma (a única cujo anterior pode ter mudado).
+    """
+    atual, mudadas, removidas = mudancas['cvm.carteira']
+    datas = sorted(mudadas | removidas)
+    if not datas:
+        return 0
+    tabela = spec['nome']
+    # cliente/peer/gestor podem ser NULL: a série é identificada pelo texto da ROW (NULL-safe, com hash)
+    serie = "ROW(cliente, peer, gestor)::text"
+    conn.execute(text(f"""
+        CREATE TEMP TABLE mov_series ON COMMIT DROP AS
+        SELECT DISTINCT {serie} AS serie FROM {tabela} WHERE dt_comptc = ANY({FILTRO_DATAS})
+    """), {"datas": datas})
+    conn.execute(text(f"DELETE FROM {tabela} WHERE dt_comptc = ANY({FILTRO_DATAS})"), {"datas": datas})
+    linhas = conn.execute(text(f"""
+        INSERT INTO {tabela} (dt_comptc, cliente, peer, gestor, valor, delta_valor)
+        SELECT *, NULL FROM ({SQL_MOV_AGG.format(filtro=f'WHERE dt_comptc = ANY({FILTRO_DATAS})')}) agg
+    """), {"datas": sorted(mudadas)}).rowcount
+    conn.execute(text(f"""
+        INSERT INTO mov_series SELECT DISTINCT {serie} FROM {tabela} WHERE dt_comptc = ANY({FILTRO_DATAS})
+    """), {"datas": sorted(mudadas)})
+    conn.execute(text(f"""
+        UPDATE {tabela} m SET delta_valor = n.delta_valor
+        FROM (
+            SELECT ctid AS rid, dt_comptc,
+                   valor - COALESCE(LAG(valor) OVER w, 0) AS delta_valor,
+                   LAG(dt_comptc) OVER w AS dt_anterior
+            FROM {tabela}
+            WHERE {serie} IN (SELECT serie FROM mov_series)
+            WINDOW w AS (PARTITION BY cliente, peer, gestor ORDER BY dt_comptc)
+        ) n
+        WHERE m.ctid = n.rid
+          AND EXISTS (SELECT FROM unnest({FILTRO_DATAS}) d
+                      WHERE d <= n.dt_comptc AND (n.dt_anterior IS NULL OR d >= n.dt_anterior))
+          AND m.delta_valor IS DISTINCT FROM n.delta_valor
+    """), {"datas": datas})
+    return linhas
+
+
+def update_windows(conn, spec, mudancas):
+    """
+    Tabelas com deltas de 6M..60M: recalcula as datas mudadas e as que as referenciam
+    (d + X meses) para todas as chaves; chaves cujo conjunto de fundos-alvo mudou
+    (spec['alvos'] = (coluna na tabela, coluna em cvm.carteira)) são recalculadas em todas as datas.
+    """
+    tabela, sql = spec['nome'], spec['sql']
+    fonte_datas = spec['fontes'][0][0]
+    linhas = 0
+    if 'alvos' in spec:
+        coluna, coluna_alvo = spec['alvos']
+        _, mudadas, removidas = mudancas[spec['fontes'][1][0]]
+        chaves = sorted(mudadas | removidas)
+        if chaves:
+            conn.execute(text(f"DELETE FROM {tabela} WHERE COALESCE({coluna}::text, '') = ANY(:chaves)"), {"chaves": chaves})
+            filtro_alvos = f"WHERE COALESCE({coluna_alvo}::text, '') = ANY(:chaves)"
+            linhas += conn.execute(text(f"INSERT INTO {tabela} {sql.format(filtro_alvos=filtro_alvos, filtro_base='', filtro='')}"),
+                                   {"chaves": chaves}).rowcount
+
+    atual, mudadas, removidas = mudancas[fonte_datas]
+    alvo = sorted(affected_dates(atual, mudadas | removidas) | removidas)
+    if alvo:
+        conn.execute(text(f"DELETE FROM {tabela} WHERE dt_ref = ANY({FILTRO_DATAS})"), {"datas": alvo})
+        sql_alvo = sql.format(filtro_alvos='',
+                              filtro_base=f"WHERE {spec['coluna_fonte']} = ANY(CAST(:base AS DATE[]))",
+                              filtro=f"WHERE m1.dt_ref = ANY({FILTRO_DATAS})")
+        linhas += conn.execute(text(f"INSERT INTO {tabela} {sql_alvo}"),
+                               {"datas": alvo, "base": sorted(base_dates(alvo))}).rowcount
+    return linhas
+
+
+# ==========================================
+# TABELAS
+# ==========================================
+# fontes: [(fonte, chave)] comparadas com o estado gravado; chave None = fonte inteira.
+# coluna_fonte: coluna de data na origem usada para filtrar o incremental.
+# sempre: roda a cada execução, mesmo sem mudança nas fontes.
+# view: a "tabela" é uma VIEW sobre a fonte (sem cópia, sem estado).
+
+TABELAS = [
+    {'nome': 'alocadores.r_amostral_2', 'descricao': "Peer Dominante", 'sql': SQL_AMOSTRAL,
+     'fontes': [('cvm.carteira', 'dt_comptc')], 'incremental': replace_if_last_date,
+     'indices': [['cnpj_fundo'], ['cliente']]},
+    {'nome': 'alocadores.r_apelidos', 'descricao': "Sanitization", 'sql': SQL_APELIDOS,
+     'fontes': [('cvm.cadastro', None)], 'incremental': replace_all,
+     'indices': [['cnpj_fundo']]},
+    {'nome': 'alocadores.r_carteira', 'descricao': "View", 'sql': SQL_CARTEIRA, 'view': True,
+     'fontes': [], 'indices': []},
+    {'nome': 'kinea.fundos', 'descricao': "fundos_kinea", 'sql': SQL_FUNDOS_KINEA,
+     'fontes': [('cvm.cadastro', None)], 'incremental': replace_all,
+     'indices': [['cnpj_fundo']]},
+    {'nome': 'alocadores.r_fundos_kinea_metas', 'descricao': "Mock", 'sql': SQL_KINEA_METAS,
+     'fontes': [('kinea.fundos', None)], 'incremental': replace_all,
+     'indices': [['cnpj_fundo']]},
+    {'nome': 'alocadores.r_metrics', 'descricao': "With Meses Observados", 'sql': SQL_METRICS,
+     'fontes': [('cvm.metrics', 'dt_comptc'), ('cvm.cadastro', None)], 'incremental': replace_dates,
+     'coluna_fonte': 'm.dt_comptc',
+     'sempre': atualiza_meses_observados,
+     'indices': [['dt_comptc'], ['cnpj_fundo', 'janela']]},
+    {'nome': 'alocadores.r_mov_carteira_gestor_peer', 'descricao': "Delta Value", 'sql': SQL_MOV,
+     'fontes': [('cvm.carteira', 'dt_comptc')], 'incremental': update_mov,
+     'indices': [['dt_comptc'], ['cliente', 'peer', 'gestor', 'dt_comptc']]},
+    {'nome': 'alocadores.r_fluxo_peer', 'descricao': "Variations for Client Allocation per Peer", 'sql': SQL_FLUXO_PEER,
+     'fontes': [('cvm.carteira', 'dt_comptc')], 'incremental': update_windows, 'coluna_fonte': 'dt_comptc',
+     'indices': [['dt_ref'], ['cliente', 'peer', 'dt_ref']]},
+    {'nome': 'alocadores.r_var_gestor_cota', 'descricao': "Variation of PL of the Groups invested in", 'sql': SQL_VAR_GESTOR,
+     'fontes': [('cvm.cotas', 'dt_comptc'), ('alvos_gestor', 'gestor_cota')], 'incremental': update_windows,
+     'coluna_fonte': 'c.dt_comptc', 'alvos': ('grupo_cota', 'cda.gestor_cota'),
+     'indices': [['dt_ref'], ['grupo_cota', 'dt_ref']]},
+    {'nome': 'alocadores.r_var_nm_fundo_cota', 'descricao': "Variation of PL by Fund Name/CNPJ", 'sql': SQL_VAR_FUNDO,
+     'fontes': [('cvm.cotas', 'dt_comptc'), ('alvos_fundo', 'cnpj_fundo_cota')], 'incremental': update_windows,
+     'coluna_fonte': 'c.dt_comptc', 'alvos': ('cnpj_fundo_cota', 'cnpj_fundo_cota'),
+     'indices': [['dt_ref'], ['cnpj_fundo_cota', 'dt_ref']]},
+]
+
+
+def full_sql(spec):
+    return spec['sql'].format(filtro='', filtro_base='', filtro_alvos='')
+
+
+def relation_hash(conn, tabela):
+    """(relkind, hash gravado no COMMENT)."""
+    row = conn.execute(text("SELECT relkind, obj_description(oid, 'pg_class') FROM pg_class WHERE oid = to_regclass(:t)"),
+                       {"t": tabela}).fetchone()
+    return (row[0], row[1]) if row else (None, None)
+
+
+def ensure_view(db, spec):
+    """Cria (ou recria, se a definição mudou) a view; a cópia física anterior é removida."""
+    tabela = spec['nome']
+    with db.engine.connect() as conn:
+        kind, stored_hash = relation_hash(conn, tabela)
+    if kind == 'v' and stored_hash == definition_hash(spec):
+        print(f"  [OK] {tabela}: view atualizada")
+        return
+    with db.engine.begin() as conn:
+        if kind is not None:
+            # Tabela antiga (cópia) ou view com outra projeção: CREATE OR REPLACE não remove colunas
+            conn.execute(text(f"DROP {'VIEW' if kind == 'v' else 'TABLE'} {tabela} CASCADE;"))
+        conn.execute(text(f"CREATE VIEW {tabela} AS {full_sql(spec)}"))
+        conn.execute(text(f"COMMENT ON VIEW {tabela} IS '{definition_hash(spec)}';"))
+        conn.execute(text(f"DELETE FROM {ESTADO} WHERE tabela = :tabela"), {"tabela": tabela})
+    motivo = "nova" if kind is None else ("cópia -> view" if kind != 'v' else "definição alterada")
+    print(f"  [VIEW] {tabela} ({motivo})")
+
+
+def full_build(db, spec, atual_por_fonte):
+    """CREATE TABLE AS em <tabela>__stg + índices + troca atômica; o estado passa a ser o atual."""
+    tabela = spec['nome']
+    s_raw, t_raw = tabela.split('.')
+    stg = f'{s_raw}."{t_raw}{STAGING_SUFFIX}"'
+    with db.engine.begin() as conn:
+        conn.execute(text(f"DROP TABLE IF EXISTS {stg} CASCADE;"))
+        linhas = conn.execute(text(f"CREATE TABLE {stg} AS {full_sql(spec)}")).rowcount
+        for cols in spec['indices']:
+            idx_name = f"idx_{t_raw}_{'_'.join(cols)}"[:63 - len(STAGING_SUFFIX)] + STAGING_SUFFIX
+            conn.execute(text(f'CREATE INDEX "{idx_name}" ON {stg} ({", ".join(cols)});'))
+        conn.execute(text(f"COMMENT ON TABLE {stg} IS '{definition_hash(spec)}';"))
+        conn.execute(text(f"ANALYZE {stg};"))
+    db.swap_table(f"{tabela}{STAGING_SUFFIX}", tabela, STAGING_SUFFIX)
+    with db.engine.begin() as conn:
+        conn.execute(text(f"DELETE FROM {ESTADO} WHERE tabela = :tabela"), {"tabela": tabela})
+        for fonte, atual in atual_por_fonte.items():
+            save_state(conn, tabela, fonte, atual, set(atual), set())
+    return linhas
+
+
+def update_table(db, spec, rebuild=False, full_check=False, cache=None):
+    if spec.get('view'):
+        ensure_view(db, spec)
+        return
+    tabela = spec['nome']
+    cache = {} if cache is None else cache
+    with db.engine.connect() as conn:
+        kind, stored_hash = relation_hash(conn, tabela)
+        is_table = kind == 'r'
+        completo = rebuild or not is_table or stored_hash != definition_hash(spec)
+        mudancas = {}
+        for fonte, chave in spec['fontes']:
+            desde = None
+            if fonte in REVISAO_DIAS and chave == 'dt_comptc' and not (completo or full_check):
+                desde = revisao_desde(conn, tabela, fonte)
+            if (fonte, chave, desde) not in cache:
+                cache[(fonte, chave, desde)] = fingerprint(conn, fonte, chave, desde)
+            atual = cache[(fonte, chave, desde)]
+            if not completo:
+                mudadas, removidas = diff_state(atual, stored_state(conn, tabela, fonte, desde))
+            else:
+                mudadas, removidas = set(atual), set()
+            mudancas[fonte] = (atual, mudadas, removidas)
+
+    if completo:
+        motivo = "rebuild" if rebuild else ("nova" if not is_table else "definição alterada")
+        linhas = full_build(db, spec, {f: m[0] for f, m in mudancas.items()})
+        print(f"  [BUILD] {tabela} ({motivo}): {linhas} linhas")
+        return
+
+    if not any(m[1] or m[2] for m in mudancas.values()):
+        if 'sempre' in spec:
+            with db.engine.begin() as conn:
+                spec['sempre'](conn, spec)
+        print(f"  [OK] {tabela}: fontes sem mudança")
+        return
+
+    with db.engine.begin() as conn:
+        linhas = spec['incremental'](conn, spec, mudancas)
+        if 'sempre' in spec:
+            spec['sempre'](conn, spec)
+        for fonte, (atual, mudadas, removidas) in mudancas.items():
+            save_state(conn, tabela, fonte, atual, mudadas, removidas)
+    resumo = ", ".join(f"{f}: {len(m[1])} mudadas / {len(m[2])} removidas" for f, m in mudancas.items() if m[1] or m[2])
+    print(f"  [INCREMENTAL] {tabela}: {linhas} linhas ({resumo})")
+
+
+def run(rebuild=False, tables=None, full_check=False):
+    db = PostgresConnector()
+    print("--- Creating Allocator Tables (Phase 2) ---")
+
+    # Ensure schema
+    db.execute_sql(DDL_ESTADO)
+    db.execute_sql(DDL_METRICS_VAZIA)
+
+    # Assinaturas das fontes são compartilhadas entre as tabelas (uma varredura por fonte)
+    cache = {}
+    for i, spec in enumerate(TABELAS, start=1):
+        if tables and spec['nome'] not in tables and spec['nome'].split('.')[1] not in tables:
+            continue
+        print(f"{i}. Updating {spec['nome'].split('.')[1]} ({spec['descricao']})...")
+        try:
+            update_table(db, spec, rebuild=rebuild, full_check=full_check, cache=cache)
+        except Exception as e:
+            print(f"Error updating {spec['nome']}: {str(e).splitlines()[0]}")
 
-    print("--- Allocator Tables Created Successfully ---")
+    print("--- Allocator Tables Updated Successfully ---")
 
 if __name__ == "__main__":
-    run()
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rebuild', action='store_true',
+                        help="Reconstrói todas as tabelas (build completo + troca atômica)")
+    parser.add_argument('--tables', type=str, default=None,
+                        help="Tabelas a atualizar (separadas por vírgula), ex: r_carteira,r_fluxo_peer")
+    parser.add_argument('--full-check', action='store_true',
+                        help="Compara todas as datas de cvm.cotas/cvm.carteira (padrão: janela de revisão, "
+                             + ", ".join(f"{f}: {d} dias" for f, d in REVISAO_DIAS.items()) + ")")
+    args = parser.parse_args()
+    run(rebuild=args.rebuild, tables=args.tables.split(',') if args.tables else None, full_check=args.full_check)
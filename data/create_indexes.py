@@ -1,7 +1,11 @@
 
 import sys
 import os
+import re
+import json
 import time
+import argparse
+from sqlalchemy import text
 
 # Path setup
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
@@ -16,6 +20,10 @@ def create_indexes():
     # As colunas variam um pouco (cnpj_fundo vs cnpj_fundo_classe), vamos checar
     # Mas geralmente as tabelas base brutas importadas têm 'cnpj_fundo' ou similar.
     
+    # inf_diario e blc_1..8 são particionadas por mês de dt_comptc pelo ingestor (dev/ingest_tables.py,
+    # --partition): o mesmo CREATE INDEX no pai vira índice particionado (um por partição, inclusive futuras)
+    # e o ingestor já cria esses índices com os mesmos nomes, então aqui vira no-op.
+
     # Lista de tabelas base (conforme montar_views.ipynb)
     tables = [
         "fi_doc_cda_fi_blc_1",
@@ -96,5 +104,326 @@ def create_indexes():
 
     print("Concluído!")
 
+
+# ==========================================
+# ADVISOR (ÍNDICES A PARTIR DO WORKLOAD)
+# ==========================================
+# Os índices acima cobrem só as tabelas brutas. O advisor parte das queries que a API e o
+# pipeline rodam de fato (WORKLOAD abaixo + as mais caras do pg_stat_statements, se instalado):
+# 1. EXPLAIN (FORMAT JSON, VERBOSE) de cada query;
+# 2. cada Seq Scan com filtro vira candidato: colunas de igualdade primeiro, depois a de faixa /
+#    MIN/MAX; IS NULL / IS NOT NULL vira índice parcial; poucas colunas de saída viram INCLUDE;
+# 3. candidato já coberto por índice existente (mesmas colunas iniciais) é descartado;
+# 4. verificação: com hypopg o índice é hipotético; com --apply ele é criado, o EXPLAIN é refeito
+#    e o índice é removido se o custo não cair pelo menos MIN_GAIN;
+# 5. relatório: custo antes/depois por query, tamanho do índice e ganho por MB.
+
+MIN_GAIN = 0.2          # queda mínima de custo (20%) para manter o índice
+MAX_INCLUDE = 4         # colunas de saída até as quais o índice vira covering (INCLUDE)
+STATS_QUERIES = 20      # queries mais caras do pg_stat_statements
+
+# Valores de exemplo para os parâmetros, tirados da própria base
+SQL_SAMPLE = """
+SELECT cliente, cliente_segmentado, peer, cnpj_fundo, cnpj_fundo_cota, dt_comptc
+FROM cvm.carteira
+WHERE cliente IS NOT NULL AND cliente_segmentado IS NOT NULL AND peer IS NOT NULL
+ORDER BY dt_comptc DESC
+LIMIT 1
+"""
+
+# Filtros fixos de AllocatorsService._get_base_filters (api/services/allocators.py)
+_BASE_FILTER = """dt_comptc > CURRENT_DATE - INTERVAL '5 years'
+    AND peer IN ('Ações', 'Multimercado', 'Renda Fixa')
+    AND cnpj_fundo NOT IN (SELECT DISTINCT cnpj_fundo FROM cvm.espelhos)
+    AND cliente <> gestor_cota
+    AND cliente = :cliente"""
+
+WORKLOAD = {
+    'carteira_evolucao': f"""
+        SELECT dt_comptc, SUM(vl_merc_pos_final) FROM cvm.carteira
+        WHERE {_BASE_FILTER} AND cliente_segmentado = :cliente_segmentado
+        GROUP BY dt_comptc ORDER BY dt_comptc""",
+    'carteira_peer': f"""
+        SELECT dt_comptc, SUM(vl_merc_pos_final) FROM cvm.carteira
+        WHERE {_BASE_FILTER} AND peer = :peer
+        GROUP BY dt_comptc""",
+    'carteira_max_dt': f"SELECT MAX(dt_comptc) FROM cvm.carteira WHERE {_BASE_FILTER}",
+    'carteira_fundos': f"""
+        SELECT DISTINCT cnpj_fundo_cota, nm_fundo_cota FROM cvm.carteira
+        WHERE {_BASE_FILTER} AND dt_comptc = :dt_comptc""",
+    'carteira_posicao_atual': """
+        SELECT cliente, cliente_segmentado, cnpj_fundo_cota, peer, SUM(vl_merc_pos_final)
+        FROM cvm.carteira WHERE dt_comptc = :dt_comptc
+        GROUP BY cliente, cliente_segmentado, cnpj_fundo_cota, peer""",
+    'metrics_ultima': """
+        SELECT cnpj_fundo, janela, ret, vol, mdd FROM cvm.metrics
+        WHERE cnpj_fundo = :cnpj_fundo_cota AND janela IN ('6M', '12M', '24M', '36M')
+          AND dt_comptc = (SELECT MAX(dt_comptc) FROM cvm.metrics)""",
+    'metrics_max_dt': "SELECT MAX(dt_comptc) FROM cvm.metrics",
+    'fluxo_fundo': """
+        SELECT SUM(fluxo_12m) FROM alocadores.fluxo_veiculos WHERE cnpj_fundo = :cnpj_fundo""",
+    'espelhos_fundo': "SELECT 1 FROM cvm.espelhos WHERE cnpj_fundo = :cnpj_fundo",
+    'cadastro_ativo': "SELECT * FROM cvm.cadastro WHERE cnpj_fundo = :cnpj_fundo AND dt_fim IS NULL",
+}
+
+# Um conjunto por termo do Filter do EXPLAIN (casts removidos): "col = valor", "col > valor", ...
+_RE_CAST = re.compile(r"::(?:character varying|double precision|timestamp (?:with|without) time zone|\w+)(?:\[\])?")
+_RE_TERM = re.compile(r"^(?:\w+\.)?(\w+) (=|<>|<|<=|>|>=|IS NULL|IS NOT NULL)(?: (.*))?$")
+_RE_MINMAX = re.compile(r"^(?:min|max)\((?:\w+\.)?(\w+)\)$")
+
+
+def _conjuncts(filt):
+    """
+    Termos ligados por AND no filtro, sem parênteses e casts. O EXPLAIN embrulha o filtro
+    inteiro (e cada termo) em parênteses: "((a = '1'::text) AND (b = '2024-01-31'::date))".
+    """
+    filt = re.sub(r"\(((?:\w+\.)?\w+)\)", r"\1", _RE_CAST.sub("", filt))
+    return _split_and(filt)
+
+
+def _split_and(expr):
+    """Tira os parênteses externos balanceados, quebra no AND de nível 0 e desce em cada termo."""
+    expr = expr.strip()
+    while expr.startswith('(') and expr.endswith(')') and _balanced(expr[1:-1]):
+        expr = expr[1:-1].strip()
+    terms, depth, start = [], 0, 0
+    for i, ch in enumerate(expr):
+        depth += (ch == '(') - (ch == ')')
+        if depth == 0 and expr.startswith(' AND ', i):
+            terms.append(expr[start:i])
+            start = i + 5
+    if not terms:
+        return [expr]
+    terms.append(expr[start:])
+    return [t for term in terms for t in _split_and(term)]
+
+
+def _balanced(expr):
+    depth = 0
+    for ch in expr:
+        depth += (ch == '(') - (ch == ')')
+        if depth < 0:
+            return False
+    return depth == 0
+
+
+def _is_value(expr):
+    """Lado direito constante na execução: literal, parâmetro, InitPlan/SubPlan ou CURRENT_DATE."""
+    expr = (expr or '').strip('() ')
+    return bool(re.match(r"^(?:'|\$\d|-?\d|ANY|InitPlan|SubPlan|CURRENT_DATE|now\()", expr))
+
+
+def load_workload(db, use_stats=True):
+    """[(nome, sql, params, peso)] do WORKLOAD (+ pg_stat_statements, quando disponível)."""
+    with db.engine.connect() as conn:
+        sample = conn.execute(text(SQL_SAMPLE)).mappings().fetchone() if _exists(conn, 'cvm.carteira') else None
+        params = dict(sample) if sample else {}
+        queries = [(name, sql, params, 1.0) for name, sql in WORKLOAD.items()
+                   if sample or ':' not in re.sub(r"::\w+", "", sql)]
+
+        if not use_stats:
+            return queries
+        has_pgss = conn.execute(text("SELECT EXISTS (SELECT FROM pg_extension WHERE extname = 'pg_stat_statements')")).scalar()
+        if not has_pgss:
+            print("  pg_stat_statements não instalado: só o WORKLOAD fixo.")
+            return queries
+        generic = conn.execute(text("SHOW server_version_num")).scalar()
+        rows = conn.execute(text(f"""
+            SELECT queryid, query, calls, total_exec_time FROM pg_stat_statements
+            WHERE query ~* '^\\s*(SELECT|WITH)' AND query ~* '(cvm|alocadores)\\.' AND query !~* 'EXPLAIN|pg_stat'
+            ORDER BY total_exec_time DESC LIMIT {STATS_QUERIES}
+        """)).fetchall()
+    for queryid, query, calls, total in rows:
+        has_params = re.search(r"\$\d+", query) is not None
+        if has_params and int(generic) < 160000:
+            continue  # EXPLAIN (GENERIC_PLAN) só existe a partir do PG16
+        # Peso relativo ao tempo total gasto pela query no servidor
+        queries.append((f"pgss_{queryid}", query, None if has_params else {}, max(total / 1000.0, 1.0)))
+    return queries
+
+
+def _exists(conn, rel):
+    return conn.execute(text("SELECT to_regclass(:r) IS NOT NULL"), {"r": rel}).scalar()
+
+
+def explain(conn, sql, params):
+    """Plano em JSON (params=None: query do pg_stat_statements com $n, via GENERIC_PLAN)."""
+    if params is None:
+        return conn.exec_driver_sql(f"EXPLAIN (FORMAT JSON, VERBOSE, GENERIC_PLAN) {sql}").scalar()[0]['Plan']
+    plan = conn.execute(text(f"EXPLAIN (FORMAT JSON, VERBOSE) {sql}"), params).scalar()
+    return (json.loads(plan) if isinstance(plan, str) else plan)[0]['Plan']
+
+
+def _walk(node, parent=None):
+    yield node, parent
+    for child in node.get('Plans', []):
+        yield from _walk(child, node)
+
+
+def candidates_from_plan(plan):
+    """Índices sugeridos pelos Seq Scans do plano: [(schema, tabela, chaves, include, where)]."""
+    found = []
+    for node, parent in _walk(plan):
+        if node.get('Node Type') != 'Seq Scan':
+            continue
+        filt = node.get('Filter', '')
+        minmax = None
+        if parent and parent.get('Node Type') == 'Aggregate':
+            for out in parent.get('Output', []):
+                m = _RE_MINMAX.match(out)
+                if m:
+                    minmax = m.group(1)
+        if not filt and not minmax:
+            continue
+        # Filtro com OR não é atendido por um btree simples
+        if ' OR ' in filt:
+            continue
+        eq, rng, nulls, any_cols = [], [], [], set()
+        for term in _conjuncts(filt) if filt else []:
+            m = _RE_TERM.match(term)
+            if not m:
+                continue
+            col, op, value = m.groups()
+            if op.startswith('IS'):
+                nulls.append(f"{col} {op}")
+            elif op == '=' and _is_value(value) and col not in eq:
+                eq.append(col)
+                if value.startswith('ANY'):
+                    any_cols.add(col)
+            elif op in ('<', '<=', '>', '>=') and _is_value(value) and col not in rng:
+                rng.append(col)
+        # Igualdade a um valor antes de "= ANY (...)", que é menos seletivo
+        eq.sort(key=lambda c: c in any_cols)
+        rng = [c for c in rng if c not in eq]
+        keys = eq + rng[:1]
+        if minmax and minmax not in keys:
+            keys.append(minmax)
+        if not keys:
+            continue
+        outputs = [re.sub(r"^\w+\.", "", o) for o in node.get('Output', [])]
+        include = [o for o in outputs if re.fullmatch(r"\w+", o) and o not in keys]
+        include = include if 0 < len(include) <= MAX_INCLUDE else []
+        nulls = [n for n in nulls if n.split()[0] not in keys]
+        found.append((node['Schema'], node['Relation Name'], tuple(keys), tuple(include), " AND ".join(nulls)))
+    return found
+
+
+def existing_leading_columns(conn, schema, table):
+    """Lista de colunas (em ordem) de cada índice válido da tabela."""
+    rows = conn.execute(text("""
+        SELECT ARRAY(SELECT a.attname FROM unnest(i.indkey) WITH ORDINALITY k(attnum, n)
+                     JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = k.attnum
+                     ORDER BY k.n)
+        FROM pg_index i WHERE i.indrelid = to_regclass(:rel)
+    """), {"rel": f'"{schema}"."{table}"'}).fetchall()
+    return [list(r[0]) for r in rows]
+
+
+def index_ddl(schema, table, keys, include, where):
+    name = f"adv_{table}_{'_'.join(keys)}{'_partial' if where else ''}"[:63]
+    ddl = f'CREATE INDEX IF NOT EXISTS "{name}" ON "{schema}"."{table}" ({", ".join(keys)})'
+    if include:
+        ddl += f" INCLUDE ({', '.join(include)})"
+    if where:
+        ddl += f" WHERE {where}"
+    return name, ddl + ";"
+
+
+def index_size(conn, schema, name):
+    """Tamanho em bytes (soma das partições, se o índice for particionado)."""
+    return conn.execute(text("""
+        SELECT COALESCE(SUM(pg_relation_size(relid)), 0) FROM pg_partition_tree(to_regclass(:idx))
+    """), {"idx": f'"{schema}"."{name}"'}).scalar()
+
+
+def advise(apply=False, use_stats=True):
+    db = PostgresConnector()
+    print("--- Index advisor ---")
+    workload = load_workload(db, use_stats)
+    print(f"{len(workload)} queries no workload.")
+
+    # Custo atual e candidatos por query
+    base_cost, plans, proposals = {}, {}, {}
+    with db.engine.connect() as conn:
+        for name, sql, params, weight in workload:
+            try:
+                plan = explain(conn, sql, params)
+            except Exception as e:
+                print(f"  [SKIP] {name}: {str(e).splitlines()[0]}")
+                conn.rollback()
+                continue
+            base_cost[name] = plan['Total Cost']
+            plans[name] = (sql, params, weight)
+            for cand in candidates_from_plan(plan):
+                proposals.setdefault(cand, []).append(name)
+
+        has_hypopg = conn.execute(text("SELECT EXISTS (SELECT FROM pg_extension WHERE extname = 'hypopg')")).scalar()
+
+    report = []
+    for (schema, table, keys, include, where), queries in proposals.items():
+        with db.engine.connect() as conn:
+            covered = any(cols[:len(keys)] == list(keys) for cols in existing_leading_columns(conn, schema, table))
+        if covered:
+            continue
+        name, ddl = index_ddl(schema, table, keys, include, where)
+        if not apply and not has_hypopg:
+            report.append((name, ddl, None, None, queries))
+            continue
+
+        with db.engine.begin() as conn:
+            if apply:
+                start = time.time()
+                conn.execute(text(ddl))
+                conn.execute(text(f'ANALYZE "{schema}"."{table}";'))
+                print(f"  [CREATE] {name} em {time.time()-start:.2f}s")
+            else:
+                conn.execute(text("SELECT * FROM hypopg_create_index(:ddl)"), {"ddl": ddl.rstrip(';')})
+            new_cost = {q: explain(conn, plans[q][0], plans[q][1])['Total Cost'] for q in queries}
+            size = (index_size(conn, schema, name) if apply else
+                    conn.execute(text("SELECT SUM(hypopg_relation_size(indexrelid)) FROM hypopg_list_indexes")).scalar())
+            if not apply:
+                conn.execute(text("SELECT hypopg_reset()"))
+
+        before = sum(base_cost[q] * plans[q][2] for q in queries)
+        after = sum(new_cost[q] * plans[q][2] for q in queries)
+        gain = 1 - after / before if before else 0.0
+        if apply and gain < MIN_GAIN:
+            with db.engine.begin() as conn:
+                conn.execute(text(f'DROP INDEX IF EXISTS "{schema}"."{name}";'))
+            print(f"  [DROP] {name}: ganho de {gain:.0%} abaixo de {MIN_GAIN:.0%}")
+        report.append((name, ddl, gain, size, queries, {q: (base_cost[q], new_cost[q]) for q in queries}))
+
+    print_advice(report, apply, has_hypopg)
+
+
+def print_advice(report, apply, has_hypopg):
+    print("\n" + "=" * 60)
+    modo = "criados e verificados" if apply else ("hipotéticos (hypopg)" if has_hypopg else "propostos (sem verificação)")
+    print(f"ÍNDICES {modo.upper()}: {len(report)}")
+    print("=" * 60)
+    for item in sorted(report, key=lambda r: -(r[2] or 0)):
+        name, ddl, gain, size, queries = item[:5]
+        print(f"\n{ddl}")
+        if gain is None:
+            print(f"  queries: {', '.join(queries)}")
+            continue
+        mb = (size or 0) / 1024 ** 2
+        kept = "" if not apply else (" [mantido]" if gain >= MIN_GAIN else " [removido]")
+        por_mb = f", {gain * 100 / mb:.1f} pp/MB" if mb > 0 else ""
+        print(f"  ganho de custo {gain:.0%}, tamanho {mb:.1f} MB{por_mb}{kept}")
+        for q, (antes, depois) in item[5].items():
+            print(f"    {q:<28} {antes:>14.1f} -> {depois:>14.1f}")
+
+
 if __name__ == "__main__":
-    create_indexes()
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--advise', action='store_true',
+                        help="Propõe índices a partir do workload (hipotéticos se o hypopg estiver instalado)")
+    parser.add_argument('--apply', action='store_true',
+                        help="Cria os índices propostos, refaz os EXPLAIN e remove os que não ajudam")
+    parser.add_argument('--no-stats', action='store_true', help="Ignora o pg_stat_statements")
+    args = parser.parse_args()
+    if args.advise or args.apply:
+        advise(apply=args.apply, use_stats=not args.no_stats)
+    else:
+        create_indexes()
@@ -0,0 +1,267 @@
+import sys
+import os
+import re
+import argparse
+from datetime import date
+from sqlalchemy import text
+
+# Add project root to path
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.abspath(os.path.join(current_dir, '..'))
+if project_root not in sys.path:
+    sys.path.append(project_root)
+
+from common.postgresql import PostgresConnector
+
+# cvm.ativos_carteira como tabela particionada por mês de dt_comptc (antes: materialized view
+# com UNION sobre todo o histórico dos 8 blocos, reordenado e deduplicado a cada rebuild).
+# Incremental: só os meses de competência novos (ou recarregados pelo ingestor) são montados,
+# numa tabela avulsa que entra no lugar da partição do mês via ATTACH.
+TABELA_ATIVOS = "cvm.ativos_carteira"
+TABELA_MESES = "cvm.ativos_carteira_meses"
+MANIFEST_TABLE = "cvm.ingest_manifest"  # dev/ingest_tables.py
+STAGING_SUFFIX = "__stg"
+
+DDL_MESES = f"""
+CREATE TABLE IF NOT EXISTS {TABELA_MESES} (
+    mes CHAR(6) PRIMARY KEY,
+    linhas BIGINT,
+    built_at TIMESTAMP
+);
+"""
+
+COLUNAS = ['bloco', 'tp_fundo', 'cnpj_fundo', 'dt_comptc', 'tp_aplic', 'tp_ativo', 'qt_pos_final',
+           'vl_merc_pos_final', 'cd_ativo', 'tp_cd_ativo', 'nm_ativo']
+
+DDL_COLUNAS = """
+    bloco TEXT, tp_fundo TEXT, cnpj_fundo TEXT, dt_comptc DATE, tp_aplic TEXT, tp_ativo TEXT,
+    qt_pos_final DOUBLE PRECISION, vl_merc_pos_final DOUBLE PRECISION,
+    cd_ativo TEXT, tp_cd_ativo TEXT, nm_ativo TEXT
+"""
+
+# Chave de deduplicação: a linha inteira (a mesma que o UNION aplicava). Blocos distintos nunca
+# colidem (coluna bloco), então o DISTINCT é feito por bloco e por mês e os blocos entram com UNION ALL.
+CHAVE_DEDUP = COLUNAS
+
+# (bloco, view de origem, expressões de cd_ativo / tp_cd_ativo / nm_ativo)
+BLOCOS = [
+    ('blc_1', 'cvm.cda_fi_blc_1', "cd_isin", "'ISIN'", "tp_titpub"),
+    ('blc_2', 'cvm.cda_fi_blc_2', "cnpj_fundo_cota", "'CNPJ'", "nm_fundo_cota"),
+    ('blc_3', 'cvm.cda_fi_blc_3', "cd_swap", "'SWAP'", "ds_swap"),
+    ('blc_4', 'cvm.cda_fi_blc_4', "cd_ativo", "'TICKER'", "ds_ativo"),
+    ('blc_5', 'cvm.cda_fi_blc_5', "cnpj_emissor", "'CNPJ'", "CONCAT(tp_ativo, ' - ', emissor, ' - ')"),
+    ('blc_6', 'cvm.cda_fi_blc_6', "cpf_cnpj_emissor", "'CNPJ'",
+     "CONCAT(tp_ativo, ' - ', emissor, ' - ', cd_indexador_posfx, ' - ', ds_indexador_posfx)"),
+    ('blc_7', 'cvm.cda_fi_blc_7', "CONCAT(cd_pais, ' - ', cd_bv_merc, ' - ', cd_ativo_bv_merc)",
+     "'PAIS - BOLSA - CODIGO'", "emissor"),
+    ('blc_8', 'cvm.cda_fi_blc_8', "cpf_cnpj_emissor",
+     "CASE WHEN cpf_cnpj_emissor IS NULL THEN NULL ELSE 'CNPJ' END",
+     "CASE WHEN cpf_cnpj_emissor IS NOT NULL THEN CONCAT(ds_ativo, ' - ', emissor) ELSE ds_ativo END"),
+]
+
+# Tabelas brutas por trás das views cda_fi_blc_X (partições e manifesto do ingestor)
+TABELAS_FONTE = [f"cvm.fi_doc_cda_fi_blc_{i}" for i in range(1, 9)]
+
+
+def month_bounds(yyyymm):
+    year, month = int(yyyymm[:4]), int(yyyymm[4:])
+    return date(year, month, 1), date(year + month // 12, month % 12 + 1, 1)
+
+
+def month_select():
+    """
+    SELECT de um mês (:lo <= dt_comptc < :hi) dos 8 blocos, deduplicado por CHAVE_DEDUP.
+    O ::DATE cobre origens heap legadas com dt_comptc TEXT; sobre DATE não gera nó
+    nenhum, e o filtro continua podando as partições.
+    """
+    parts = []
+    for bloco, fonte, cd_ativo, tp_cd_ativo, nm_ativo in BLOCOS:
+        parts.append(f"""
+        SELECT DISTINCT ON ({', '.join(CHAVE_DEDUP)}) *
+        FROM (
+            SELECT '{bloco}' bloco, tp_fundo, cnpj_fundo, dt_comptc::DATE dt_comptc, tp_aplic, tp_ativo, qt_pos_final, vl_merc_pos_final,
+                   {cd_ativo} cd_ativo, {tp_cd_ativo} tp_cd_ativo, {nm_ativo} nm_ativo
+            FROM {fonte}
+            WHERE dt_comptc::DATE >= :lo AND dt_comptc::DATE < :hi
+        ) b""")
+    return "\nUNION ALL".join(parts)
+
+
+# ==========================================
+# MESES A (RE)MONTAR
+# ==========================================
+
+def relkind(conn, rel):
+    return conn.execute(text("SELECT relkind FROM pg_class WHERE oid = to_regclass(:rel)"), {"rel": rel}).scalar()
+
+
+def partition_months(conn, table_name):
+    """Meses (AAAAMM) com partição `<tabela>_pAAAAMM` no catálogo."""
+    t_raw = table_name.split('.')[1]
+    names = conn.execute(text("""
+        SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = CAST(:rel AS regclass)
+    """), {"rel": table_name}).scalars().all()
+    prefix = f"{t_raw}_p"
+    return {n[len(prefix):] for n in names if n.startswith(prefix) and n[len(prefix):].isdigit()}
+
+
+def source_months(conn):
+    """
+    Meses existentes na origem. Tabelas particionadas pelo ingestor respondem pelo catálogo
+    (+ a partição default, pequena); tabela heap ainda não convertida exige uma varredura.
+    Na heap legada dt_comptc pode ainda ser TEXT, daí o ::DATE (no-op sobre DATE).
+    """
+    months = set()
+    for fonte in TABELAS_FONTE:
+        kind = relkind(conn, fonte)
+        if kind is None:
+            continue
+        if kind == 'p':
+            months |= partition_months(conn, fonte)
+            scan = f'{fonte.split(".")[0]}."{fonte.split(".")[1]}_pdefault"'
+            if relkind(conn, scan) is None:
+                continue
+        else:
+            scan = fonte
+        months |= set(conn.execute(text(f"SELECT DISTINCT to_char(dt_comptc::DATE, 'YYYYMM') FROM {scan} WHERE dt_comptc IS NOT NULL")).scalars().all())
+    return months
+
+
+def file_months(file_path):
+    """Meses cobertos por um arquivo do manifesto pelo nome (cda_fi_BLC_1_202401.csv; _2018 = ano inteiro)."""
+    match = re.search(r'_(\d{4})(\d{2})?\.csv$', file_path, re.IGNORECASE)
+    if not match:
+        return set()
+    if match.group(2):
+        return {match.group(1) + match.group(2)}
+    return {f"{match.group(1)}{m:02d}" for m in range(1, 13)}
+
+
+def reloaded_months(conn, built):
+    """Meses já montados cujos arquivos o ingestor recarregou depois da montagem (manifesto)."""
+    if relkind(conn, MANIFEST_TABLE) is None:
+        return set()
+    rows = conn.execute(text(f"SELECT file_path, loaded_at FROM {MANIFEST_TABLE} WHERE table_name = ANY(:tables)"),
+                        {"tables": TABELAS_FONTE}).fetchall()
+    months = set()
+    for file_path, loaded_at in rows:
+        for mes in file_months(file_path):
+            if mes in built and loaded_at is not None and loaded_at > built[mes]:
+                months.add(mes)
+    return months
+
+
+# ==========================================
+# MONTAGEM
+# ==========================================
+
+def build_month(conn, part_name, yyyymm):
+    """INSERT do mês em `part_name` (tabela já criada). Retorna linhas."""
+    lo, hi = month_bounds(yyyymm)
+    result = conn.execute(text(f"INSERT INTO {part_name} ({', '.join(COLUNAS)}) {month_select()}"), {"lo": lo, "hi": hi})
+    return result.rowcount
+
+
+def record_months(conn, counts, built_at):
+    for mes, linhas in counts.items():
+        conn.execute(text(f"""
+            INSERT INTO {TABELA_MESES} (mes, linhas, built_at) VALUES (:mes, :linhas, :built_at)
+            ON CONFLICT (mes) DO UPDATE SET linhas = EXCLUDED.linhas, built_at = EXCLUDED.built_at
+        """), {"mes": mes, "linhas": linhas, "built_at": built_at})
+
+
+def full_build(db, months, built_at):
+    """Monta tudo em ativos_carteira__stg (particionada) e troca com a atual (view materializada ou tabela)."""
+    s_raw, t_raw = TABELA_ATIVOS.split('.')
+    stg = f'{s_raw}."{t_raw}{STAGING_SUFFIX}"'
+    counts = {}
+    with db.engine.begin() as conn:
+        conn.execute(text(f"DROP TABLE IF EXISTS {stg} CASCADE;"))
+        conn.execute(text(f"CREATE TABLE {stg} ({DDL_COLUNAS}) PARTITION BY RANGE (dt_comptc);"))
+    for mes in sorted(months):
+        lo, hi = month_bounds(mes)
+        with db.engine.begin() as conn:
+            part = f'{s_raw}."{t_raw}_p{mes}{STAGING_SUFFIX}"'
+            conn.execute(text(f"CREATE TABLE {part} PARTITION OF {stg} FOR VALUES FROM ('{lo}') TO ('{hi}');"))
+            counts[mes] = build_month(conn, part, mes)
+        print(f"  [{mes}] {counts[mes]} linhas")
+    with db.engine.begin() as conn:
+        # Índice no pai particionado = um por partição (inclusive as anexadas depois)
+        conn.execute(text(f'CREATE INDEX "idx_{t_raw}_cnpj_dt{STAGING_SUFFIX}" ON {stg} (cnpj_fundo, dt_comptc);'))
+        conn.execute(text(f"ANALYZE {stg};"))
+    db.swap_table(f"{TABELA_ATIVOS}{STAGING_SUFFIX}", TABELA_ATIVOS, STAGING_SUFFIX)
+    with db.engine.begin() as conn:
+        conn.execute(text(f"TRUNCATE {TABELA_MESES};"))
+        record_months(conn, counts, built_at)
+    return counts
+
+
+def replace_month(db, yyyymm, built_at):
+    """
+    Monta o mês numa tabela avulsa (leitores seguem vendo a partição antiga) e troca numa transação
+    curta: drop da partição antiga + ATTACH da nova. O CHECK com os limites evita a varredura do ATTACH.
+    """
+    s_raw, t_raw = TABELA_ATIVOS.split('.')
+    lo, hi = month_bounds(yyyymm)
+    final = f"{t_raw}_p{yyyymm}"
+    new = f'{s_raw}."{final}{STAGING_SUFFIX}"'
+    with db.engine.begin() as conn:
+        conn.execute(text(f"DROP TABLE IF EXISTS {new};"))
+        conn.execute(text(f"CREATE TABLE {new} (LIKE {TABELA_ATIVOS});"))
+        linhas = build_month(conn, new, yyyymm)
+        conn.execute(text(f"CREATE INDEX ON {new} (cnpj_fundo, dt_comptc);"))
+        conn.execute(text(f"ALTER TABLE {new} ADD CONSTRAINT \"{final}_bounds\" CHECK (dt_comptc >= '{lo}' AND dt_comptc < '{hi}');"))
+    with db.engine.begin() as conn:
+        conn.execute(text(f'DROP TABLE IF EXISTS {s_raw}."{final}";'))
+        conn.execute(text(f"ALTER TABLE {TABELA_ATIVOS} ATTACH PARTITION {new} FOR VALUES FROM ('{lo}') TO ('{hi}');"))
+        conn.execute(text(f'ALTER TABLE {new} RENAME TO "{final}";'))
+        conn.execute(text(f'ALTER TABLE {s_raw}."{final}" DROP CONSTRAINT "{final}_bounds";'))
+        conn.execute(text(f'ANALYZE {s_raw}."{final}";'))
+        record_months(conn, {yyyymm: linhas}, built_at)
+    return linhas
+
+
+def run(rebuild=False, months=None):
+    db = PostgresConnector()
+    print(f"--- Updating {TABELA_ATIVOS} (incremental por mês) ---")
+    db.execute_sql(DDL_MESES)
+
+    with db.engine.connect() as conn:
+        # Marca d'água tirada antes de ler a origem: carga concorrente do ingestor cai na próxima execução
+        built_at = conn.execute(text("SELECT LOCALTIMESTAMP")).scalar()
+        kind = relkind(conn, TABELA_ATIVOS)
+        fonte = source_months(conn)
+        built = dict(conn.execute(text(f"SELECT mes, built_at FROM {TABELA_MESES}")).fetchall())
+        if kind == 'p':
+            built = {m: t for m, t in built.items() if m in partition_months(conn, TABELA_ATIVOS)}
+        reloaded = reloaded_months(conn, built)
+
+    if rebuild or kind != 'p':
+        motivo = "rebuild" if rebuild else ("inexistente" if kind is None else "view materializada -> tabela particionada")
+        print(f"Build completo ({motivo}): {len(fonte)} meses.")
+        counts = full_build(db, fonte, built_at)
+        print(f"Concluído: {sum(counts.values())} linhas em {len(counts)} meses.")
+        return
+
+    todo = (fonte - set(built)) | reloaded | set(months or ())
+    if not todo:
+        print("Nenhum mês novo ou recarregado.")
+        return
+    print(f"Meses a montar: {len(todo)} ({len(fonte - set(built))} novos, {len(reloaded)} recarregados)")
+    total = 0
+    for mes in sorted(todo):
+        linhas = replace_month(db, mes, built_at)
+        total += linhas
+        print(f"  [{mes}] {linhas} linhas")
+    print(f"Concluído: {total} linhas em {len(todo)} meses.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rebuild', action='store_true',
+                        help="Remonta todos os meses (nova tabela + troca atômica)")
+    parser.add_argument('--months', type=str, default=None,
+                        help="Meses a remontar além dos detectados, ex: 202401,202402")
+    args = parser.parse_args()
+    run(rebuild=args.rebuild, months=args.months.split(',') if args.months else None)
@@ -1,244 +1,260 @@
 import sys; sys.path.append('..')
+import os
+import argparse
 import pandas as pd
 import numpy as np
 from datetime import datetime
 from sqlalchemy import text
+
+# Adicionar path para importar common (também quando rodado a partir da raiz)
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 from common.postgresql import PostgresConnector
+from common.metrics import JANELAS, clean_quotas, log_returns, window_metrics
 import warnings
 
 # Suprimir avisos de divisão por zero/log que trataremos no código
 warnings.filterwarnings('ignore', category=RuntimeWarning)
 
-def get_recovery_time(prices_series):
-    """Calcula o tempo de recuperação médio de drawdown em dias úteis."""
-    if prices_series.empty: return np.nan
-    rolling_max = prices_series.cummax()
-    drawdown = (prices_series < rolling_max)
-    
-    # Se não houver drawdown, retorna 0
-    if not drawdown.any(): return 0.0
-    
-    # Identifica grupos de drawdown
-    is_new_high = ~drawdown
-    groups = is_new_high.cumsum()
-    
-    # Filtra apenas períodos em drawdown
-    recovery_periods = drawdown.groupby(groups).sum()
-    # Retorna média apenas dos periodos onde houve queda > 0 dias
-    valid_periods = recovery_periods[recovery_periods > 0]
-    return valid_periods.mean() if not valid_periods.empty else 0.0
+DATA_INICIO_COTAS = '2014-06-01'
+DATA_INICIO_METRICAS = '2015-01-01'
+# Até esta data só calculamos fechamentos mensais; depois dela, todas as datas
+DATA_CORTE_MENSAL = '2025-12-31'
 
-def calculate_metrics_175_final():
-    db = PostgresConnector()
-    
-    print("Carregando cotas (CVM 175 ready)...")
-    query_cotas = """
-        SELECT 
-            cnpj_fundo, 
-            COALESCE(TEXT(id_subclasse), 'MASTER') as id_subclasse_clean,
-            dt_comptc, 
-            vl_quota 
-        FROM cvm.cotas 
-        WHERE dt_comptc >= '2014-06-01'
-    """
-    df_cotas = db.read_sql(query_cotas)
-    
+TABELA_DESTINO = "metrics"
+SCHEMA_DESTINO = "cvm"
+# Controle de blocos concluídos (modo --blocos), permite retomar após falha
+TABELA_BLOCOS = "metrics_blocos"
+
+COLS_DB = ['cnpj_fundo', 'id_subclasse', 'dt_comptc', 'janela', 'ret', 'vol',
+           'mdd', 'recovery_time', 'sharpe', 'calmar', 'hit_ratio', 'info_ratio']
+
+QUERY_COTAS = f"""
+    SELECT
+        cnpj_fundo,
+        COALESCE(TEXT(id_subclasse), 'MASTER') as id_subclasse_clean,
+        dt_comptc,
+        vl_quota
+    FROM cvm.cotas
+    WHERE dt_comptc >= '{DATA_INICIO_COTAS}'
+"""
+
+# Partição estável por CNPJ: todas as subclasses de um fundo caem no mesmo bloco.
+# O cast para bigint evita overflow do abs() em hashtext = -2^31.
+FILTRO_BLOCO = "mod(abs(hashtext(cnpj_fundo)::bigint), :n_blocos) = :bloco"
+
+
+def load_benchmarks(db):
+    """Retornos logarítmicos diários dos benchmarks (CDINI, IBOV, ...) em formato wide."""
+    df_bench = db.read_sql("SELECT data as dt_comptc, codigo, valor FROM middle.indices_cotas")
+    df_bench['dt_comptc'] = pd.to_datetime(df_bench['dt_comptc'])
+    # Pivot e clean benchmarks
+    bench_pivot = df_bench.pivot(index='dt_comptc', columns='codigo', values='valor')
+    bench_pivot = bench_pivot[~bench_pivot.index.duplicated(keep='last')].sort_index().ffill()
+    return np.log(bench_pivot / bench_pivot.shift(1))
+
+
+def load_classes(db):
+    """Classe CVM por fundo (usada para escolher IBOV ou CDI no Info Ratio)."""
+    df_classes = db.read_sql("SELECT cnpj_fundo, classe FROM cvm.fi_cad_fi_hist_classe")
+    if "__id" in df_classes.columns: df_classes = df_classes.drop(columns=["__id"])
+    # Remove duplicatas de classe pegando a mais recente se houver (simplificação) ou apenas distinct
+    return df_classes.drop_duplicates('cnpj_fundo').set_index('cnpj_fundo')
+
+
+def prepare_cotas(df_cotas):
+    """Remove duplicatas (mantendo o registro mais recente) e cria a chave entity_id."""
     # [FIX] Remoção de colunas técnicas
     if "__id" in df_cotas.columns:
         df_cotas = df_cotas.drop(columns=["__id"])
 
-    print("Limpando duplicatas e preparando matriz...")
     # Garante ordenação para o drop_duplicates manter o mais recente corretamente
     df_cotas = df_cotas.sort_values('dt_comptc')
     df_cotas = df_cotas.drop_duplicates(subset=['dt_comptc', 'cnpj_fundo', 'id_subclasse_clean'], keep='last')
-    
+
     df_cotas['dt_comptc'] = pd.to_datetime(df_cotas['dt_comptc'])
     df_cotas['entity_id'] = df_cotas['cnpj_fundo'] + " | " + df_cotas['id_subclasse_clean']
-    
-    # Carregar Benchmarks
-    print("Carregando Benchmarks...")
-    df_bench = db.read_sql("SELECT data as dt_comptc, codigo, valor FROM middle.indices_cotas")
-    df_bench['dt_comptc'] = pd.to_datetime(df_bench['dt_comptc'])
-    # Pivot e clean benchmarks
-    bench_pivot = df_bench.pivot(index='dt_comptc', columns='codigo', values='valor')
-    bench_pivot = bench_pivot[~bench_pivot.index.duplicated(keep='last')].sort_index().ffill()
-    bench_ret = np.log(bench_pivot / bench_pivot.shift(1))
+    return df_cotas
+
+
+def build_matrix(df_cotas, calendario=None):
+    """
+    Monta a matriz datas x entidades de cotas e seus retornos logarítmicos.
+
+    `calendario` permite alinhar a matriz a um conjunto global de datas: um bloco
+    de fundos precisa ter exatamente as mesmas linhas da matriz completa para que
+    as janelas (em número de pregões) fiquem idênticas às do modo sem blocos.
+    """
+    matrix = df_cotas.pivot(index='dt_comptc', columns='entity_id', values='vl_quota').sort_index()
+    if calendario is not None:
+        matrix = matrix.reindex(calendario)
+    matrix = matrix.ffill()
 
-    print("Gerando matriz de cotas (Pivot)...")
-    matrix = df_cotas.pivot(index='dt_comptc', columns='entity_id', values='vl_quota').sort_index().ffill()
-    
     # [FIX] Tratamento rigoroso de zeros/negativos antes do log
     # Substitui <= 0 por NaN, faz fill forward, e se ainda sobrar NaN no começo, fica NaN mesmo
-    matrix = matrix.mask(matrix <= 0, np.nan).ffill()
-    returns = np.log(matrix / matrix.shift(1))
-    
-    # --- LÓGICA DE DATAS (CORRIGIDA) ---
-    print("Definindo datas alvo...")
-    datas_disponiveis = pd.Index(matrix.index) # Garante que é Index
-    
-    fechamentos_mensais = df_cotas[df_cotas['dt_comptc'] <= '2025-12-31']['dt_comptc'].groupby(
-        [df_cotas['dt_comptc'].dt.year, df_cotas['dt_comptc'].dt.month]).max()
-    
-    datas_pos_2025 = datas_disponiveis[datas_disponiveis > '2025-12-31']
-    
+    matrix = clean_quotas(matrix)
+    return matrix, log_returns(matrix)
+
+
+def target_dates(datas_disponiveis):
+    """Fechamentos mensais até DATA_CORTE_MENSAL e todas as datas posteriores."""
+    datas_disponiveis = pd.DatetimeIndex(datas_disponiveis).sort_values()
+    ate_corte = pd.Series(datas_disponiveis[datas_disponiveis <= DATA_CORTE_MENSAL])
+    fechamentos_mensais = ate_corte.groupby([ate_corte.dt.year, ate_corte.dt.month]).max()
+
+    datas_pos_2025 = datas_disponiveis[datas_disponiveis > DATA_CORTE_MENSAL]
+
     # Concatena e converte explicitamente para DatetimeIndex para ter acesso ao sort_values
     concat_dates = pd.concat([pd.Series(fechamentos_mensais), pd.Series(datas_pos_2025)])
     todas_datas_alvo = pd.DatetimeIndex(concat_dates.unique()).sort_values()
-    
+
     # Filtro final de data
-    todas_datas_alvo = todas_datas_alvo[todas_datas_alvo >= '2015-01-01']
-    
+    return todas_datas_alvo[todas_datas_alvo >= DATA_INICIO_METRICAS]
+
+
+def compute_date_metrics(dt_ref, matrix, returns, primeira_cota, bench_ret):
+    """Calcula todas as janelas de uma data de referência. Retorna None se não houver dados."""
+    # Encontra índice numérico da data
+    if dt_ref not in matrix.index:
+        # Se a data alvo não está na matriz (ex: feriado que foi fim de mês), pega o anterior válido
+        idx_fim = matrix.index.get_indexer([dt_ref], method='pad')[0]
+    else:
+        idx_fim = matrix.index.get_loc(dt_ref)
+
+    batch_results = []
+
+    for label, dias in JANELAS.items():
+        idx_ini = idx_fim - dias
+        if idx_ini < 0: continue # Janela maior que histórico
+
+        # Slicing por Posição Inteira (muito mais rápido e seguro)
+        window_ret = returns.iloc[idx_ini+1 : idx_fim+1]
+        window_prices = matrix.iloc[idx_ini : idx_fim+1]
+
+        if window_ret.empty: continue
+
+        # Identifica entidades válidas (que já existiam no início da janela)
+        dt_ini_window = matrix.index[idx_ini]
+        valid_entities_mask = primeira_cota <= dt_ini_window
+        valid_entities = valid_entities_mask[valid_entities_mask].index
+
+        # Filtra apenas colunas válidas para os cálculos numpy (Performance)
+        current_ret = window_ret[valid_entities]
+        if current_ret.empty: continue
+
+        # --- BENCHMARK DA JANELA ESPECÍFICA (FIX DO INFO RATIO) ---
+        # Pega o retorno do benchmark EXATAMENTE nas mesmas datas do fundo
+        bench_slice = bench_ret.loc[window_ret.index]
+
+        # CDI Acumulado da Janela
+        rf_window_ret = np.exp(bench_slice['CDINI'].sum(min_count=1)) - 1
+
+        # IBOV Acumulado da Janela (para Info Ratio)
+        ibov_window_ret = np.exp(bench_slice['IBOV'].sum(min_count=1)) - 1
+
+        # --- CÁLCULOS VETORIZADOS (common.metrics) ---
+        df_janela = window_metrics(current_ret, window_prices[valid_entities], rf_window_ret)
+
+        # Montagem do DataFrame temporário
+        df_batch_janela = df_janela.rename_axis('entity_id').reset_index()
+        df_batch_janela.insert(1, 'dt_comptc', dt_ref.date())
+        df_batch_janela.insert(2, 'janela', label)
+        # Métricas auxiliares para Info Ratio depois
+        df_batch_janela['rf_window'] = rf_window_ret
+        df_batch_janela['ibov_window'] = ibov_window_ret
+
+        batch_results.append(df_batch_janela)
+
+    if not batch_results:
+        return None
+
+    df_to_save = pd.concat(batch_results, ignore_index=True)
+
+    # Split IDs
+    split = df_to_save['entity_id'].str.split(" | ", expand=True, n=1, regex=False)
+    df_to_save['cnpj_fundo'] = split[0]
+    df_to_save['id_subclasse'] = split[1].replace('MASTER', np.nan)
+    return df_to_save
+
+
+def finalize_metrics(df_to_save, df_classes):
+    """Junta a classe do fundo, calcula o Info Ratio e devolve só as colunas do banco."""
+    # Join com Classes para Info Ratio
+    df_to_save = df_to_save.join(df_classes, on='cnpj_fundo', how='left')
+
+    # Cálculo Info Ratio Correto (Janela a Janela)
+    # Se for Ações -> (Ret - Ibov_da_Janela) / Vol
+    # Se for Outros -> (Ret - CDI_da_Janela) / Vol
+    is_acoes = df_to_save['classe'].str.contains('Ações', na=False)
+
+    ir_ibov = (df_to_save['ret'] - df_to_save['ibov_window']) / df_to_save['vol'].replace(0, np.nan)
+    ir_cdi = (df_to_save['ret'] - df_to_save['rf_window']) / df_to_save['vol'].replace(0, np.nan)
+
+    df_to_save['info_ratio'] = np.where(is_acoes, ir_ibov, ir_cdi)
+
+    # Limpeza final antes de salvar
+    return df_to_save[COLS_DB]
+
+
+def calculate_metrics_175_final():
+    db = PostgresConnector()
+
+    print("Carregando cotas (CVM 175 ready)...")
+    df_cotas = db.read_sql(QUERY_COTAS)
+
+    print("Limpando duplicatas e preparando matriz...")
+    df_cotas = prepare_cotas(df_cotas)
+
+    # Carregar Benchmarks
+    print("Carregando Benchmarks...")
+    bench_ret = load_benchmarks(db)
+
+    print("Gerando matriz de cotas (Pivot)...")
+    matrix, returns = build_matrix(df_cotas)
+
+    # --- LÓGICA DE DATAS (CORRIGIDA) ---
+    print("Definindo datas alvo...")
+    todas_datas_alvo = target_dates(matrix.index)
+
     # Check de existência
-    tabela_destino = "metrics"
-    schema_destino = "cvm"
     try:
-        df_existente = db.read_sql(f"SELECT DISTINCT dt_comptc, cnpj_fundo FROM {schema_destino}.{tabela_destino}")
+        df_existente = db.read_sql(f"SELECT DISTINCT dt_comptc, cnpj_fundo FROM {SCHEMA_DESTINO}.{TABELA_DESTINO}")
         df_existente['dt_comptc'] = pd.to_datetime(df_existente['dt_comptc'])
         print(f"Histórico existente carregado: {len(df_existente)} registros.")
     except:
         df_existente = pd.DataFrame(columns=['dt_comptc', 'cnpj_fundo'])
         print("Iniciando carga do zero.")
 
-    janelas = {'6M': 126, '12M': 252, '24M': 504, '36M': 756, '48M': 1008, '60M': 1260}
     primeira_cota = matrix.apply(lambda x: x.first_valid_index())
 
     # Cache de Classes
-    df_classes = db.read_sql("SELECT cnpj_fundo, classe FROM cvm.fi_cad_fi_hist_classe")
-    if "__id" in df_classes.columns: df_classes = df_classes.drop(columns=["__id"])
-    # Remove duplicatas de classe pegando a mais recente se houver (simplificação) ou apenas distinct
-    df_classes = df_classes.drop_duplicates('cnpj_fundo').set_index('cnpj_fundo')
+    df_classes = load_classes(db)
 
     total_datas = len(todas_datas_alvo)
     print(f"Iniciando processamento de {total_datas} datas...")
 
     for i, dt_ref in enumerate(todas_datas_alvo):
         dt_str = dt_ref.strftime('%Y-%m-%d')
-        
+
         # [BLINDAGEM] Try/Except por data para não perder tudo se der erro em uma
         try:
-            # Verifica se já processou todos os fundos desta data? 
-            # (Otimização simples: se já processou a data, precisamos ver se tem fundos novos, 
+            # Verifica se já processou todos os fundos desta data?
+            # (Otimização simples: se já processou a data, precisamos ver se tem fundos novos,
             # mas aqui vamos filtrar por fundo dentro do loop)
             fundos_ja_na_data = df_existente[df_existente['dt_comptc'] == dt_ref]['cnpj_fundo'].unique()
-            
-            # Encontra índice numérico da data
-            if dt_ref not in matrix.index:
-                # Se a data alvo não está na matriz (ex: feriado que foi fim de mês), pega o anterior válido
-                idx_fim = matrix.index.get_indexer([dt_ref], method='pad')[0]
-            else:
-                idx_fim = matrix.index.get_loc(dt_ref)
-
-            batch_results = []
-            
-            for label, dias in janelas.items():
-                idx_ini = idx_fim - dias
-                if idx_ini < 0: continue # Janela maior que histórico
-                
-                # Slicing por Posição Inteira (muito mais rápido e seguro)
-                window_ret = returns.iloc[idx_ini+1 : idx_fim+1]
-                window_prices = matrix.iloc[idx_ini : idx_fim+1]
-                
-                if window_ret.empty: continue
-
-                # Identifica entidades válidas (que já existiam no início da janela)
-                dt_ini_window = matrix.index[idx_ini]
-                valid_entities_mask = primeira_cota <= dt_ini_window
-                valid_entities = valid_entities_mask[valid_entities_mask].index
-                
-                # Filtra apenas colunas válidas para os cálculos numpy (Performance)
-                current_ret = window_ret[valid_entities]
-                if current_ret.empty: continue
-
-                # --- CÁLCULOS VETORIZADOS ---
-                # Retorno Acumulado
-                cum_ret = np.exp(current_ret.sum()) - 1
-                
-                # Volatilidade Anualizada
-                vol = current_ret.std() * np.sqrt(252)
-                
-                # Drawdown e MDD
-                cum_prices_rel = np.exp(current_ret.cumsum())
-                running_max = cum_prices_rel.cummax()
-                mdd = ((cum_prices_rel / running_max) - 1).min()
-                
-                # Recovery Time (Apply é lento, mas necessário aqui)
-                # Otimização: passar apenas colunas que tiveram MDD < 0
-                cols_with_dd = mdd[mdd < 0].index
-                rec_time = pd.Series(0.0, index=valid_entities)
-                if not cols_with_dd.empty:
-                    rec_time.loc[cols_with_dd] = window_prices[cols_with_dd].apply(get_recovery_time)
-
-                # --- BENCHMARK DA JANELA ESPECÍFICA (FIX DO INFO RATIO) ---
-                # Pega o retorno do benchmark EXATAMENTE nas mesmas datas do fundo
-                bench_slice = bench_ret.loc[window_ret.index] 
-                
-                # CDI Acumulado da Janela
-                rf_window_ret = np.exp(bench_slice['CDINI'].sum(min_count=1)) - 1
-                
-                # IBOV Acumulado da Janela (para Info Ratio)
-                ibov_window_ret = np.exp(bench_slice['IBOV'].sum(min_count=1)) - 1
-                
-                # Sharpe (Retorno do fundo - Retorno Livre de Risco da Janela) / Vol
-                sharpe = (cum_ret - rf_window_ret) / vol.replace(0, np.nan)
-                
-                # Calmar
-                calmar = cum_ret / abs(mdd).replace(0, np.nan)
-                
-                # Hit Ratio
-                hit_ratio = (current_ret > 0).sum() / len(current_ret)
-
-                # Montagem do DataFrame temporário
-                df_batch_janela = pd.DataFrame({
-                    'entity_id': valid_entities,
-                    'dt_comptc': dt_ref.date(),
-                    'janela': label,
-                    'ret': cum_ret,
-                    'vol': vol,
-                    'mdd': mdd,
-                    'recovery_time': rec_time,
-                    'sharpe': sharpe,
-                    'calmar': calmar,
-                    'hit_ratio': hit_ratio,
-                    # Métricas auxiliares para Info Ratio depois
-                    'rf_window': rf_window_ret, 
-                    'ibov_window': ibov_window_ret
-                })
-                
-                batch_results.append(df_batch_janela)
-
-            if batch_results:
-                df_to_save = pd.concat(batch_results, ignore_index=True)
-                
-                # Split IDs
-                split = df_to_save['entity_id'].str.split(" | ", expand=True, n=1)
-                df_to_save['cnpj_fundo'] = split[0]
-                df_to_save['id_subclasse'] = split[1].replace('MASTER', np.nan)
-                
+
+            df_to_save = compute_date_metrics(dt_ref, matrix, returns, primeira_cota, bench_ret)
+
+            if df_to_save is not None:
                 # Filtra o que já existe no banco
                 df_to_save = df_to_save[~df_to_save['cnpj_fundo'].isin(fundos_ja_na_data)]
-                
+
                 if not df_to_save.empty:
-                    # Join com Classes para Info Ratio
-                    df_to_save = df_to_save.join(df_classes, on='cnpj_fundo', how='left')
-                    
-                    # Cálculo Info Ratio Correto (Janela a Janela)
-                    # Se for Ações -> (Ret - Ibov_da_Janela) / Vol
-                    # Se for Outros -> (Ret - CDI_da_Janela) / Vol
-                    is_acoes = df_to_save['classe'].str.contains('Ações', na=False)
-                    
-                    ir_ibov = (df_to_save['ret'] - df_to_save['ibov_window']) / df_to_save['vol'].replace(0, np.nan)
-                    ir_cdi = (df_to_save['ret'] - df_to_save['rf_window']) / df_to_save['vol'].replace(0, np.nan)
-                    
-                    df_to_save['info_ratio'] = np.where(is_acoes, ir_ibov, ir_cdi)
-                    
-                    # Limpeza final antes de salvar
-                    cols_db = ['cnpj_fundo', 'id_subclasse', 'dt_comptc', 'janela', 'ret', 'vol', 
-                               'mdd', 'recovery_time', 'sharpe', 'calmar', 'hit_ratio', 'info_ratio']
-                    
+                    df_to_save = finalize_metrics(df_to_save, df_classes)
+
                     # Salva no DB
                     with db.engine.begin() as conn:
-                        df_to_save[cols_db].to_sql(
-                            tabela_destino, conn, schema=schema_destino, if_exists='append', index=False
+                        df_to_save.to_sql(
+                            TABELA_DESTINO, conn, schema=SCHEMA_DESTINO, if_exists='append', index=False
                         )
                     print(f"[{i+1}/{total_datas}] {dt_str}: Salvo {len(df_to_save)} registros.")
                 else:
@@ -256,5 +272,207 @@ def calculate_metrics_175_final():
 
     print("Processo concluído!")
 
+
+# ============================================================================
+# MODO EM BLOCOS (OUT-OF-CORE)
+# ============================================================================
+# A matriz completa (datas x entidades) cresce com cada nova subclasse CVM 175.
+# No modo em blocos as entidades são particionadas por hash do CNPJ; cada bloco
+# é lido do banco em streaming, processado para todas as datas/janelas e gravado
+# antes do próximo ser carregado. Só um bloco fica em memória por vez.
+
+def ensure_block_table(db):
+    """
+    Cria a tabela de controle de blocos concluídos.
+
+    Cada marca vale para uma marca d'água das cotas (max dt_comptc): quando chegam
+    cotas novas, a execução diária reprocessa todos os blocos em vez de pulá-los.
+    Uma tabela antiga, sem dt_max_cotas, é recriada (só contém marcas de controle).
+    """
+    with db.engine.begin() as conn:
+        antiga = conn.execute(text("""
+            SELECT 1 FROM information_schema.tables t
+            WHERE t.table_schema = :schema AND t.table_name = :tabela
+              AND NOT EXISTS (
+                  SELECT 1 FROM information_schema.columns c
+                  WHERE c.table_schema = t.table_schema AND c.table_name = t.table_name
+                    AND c.column_name = 'dt_max_cotas')
+        """), {"schema": SCHEMA_DESTINO, "tabela": TABELA_BLOCOS}).scalar()
+        if antiga:
+            conn.execute(text(f"DROP TABLE {SCHEMA_DESTINO}.{TABELA_BLOCOS}"))
+        conn.execute(text(f"""
+            CREATE TABLE IF NOT EXISTS {SCHEMA_DESTINO}.{TABELA_BLOCOS} (
+                n_blocos INT,
+                bloco INT,
+                dt_max_cotas DATE,
+                registros BIGINT,
+                finished_at TIMESTAMP,
+                PRIMARY KEY (n_blocos, bloco, dt_max_cotas)
+            );
+        """))
+
+
+def get_finished_blocks(db, n_blocos, dt_max_cotas):
+    """Blocos já gravados com sucesso para esta quantidade de blocos e esta marca d'água."""
+    df = db.read_sql(
+        f"SELECT bloco FROM {SCHEMA_DESTINO}.{TABELA_BLOCOS} "
+        f"WHERE n_blocos = {int(n_blocos)} AND dt_max_cotas = '{dt_max_cotas.date()}'"
+    )
+    return set(df['bloco'].astype(int)) if not df.empty else set()
+
+
+def load_calendar(db):
+    """Todas as datas com cota a partir de DATA_INICIO_COTAS (índice da matriz completa)."""
+    df = db.read_sql(f"SELECT DISTINCT dt_comptc FROM cvm.cotas WHERE dt_comptc >= '{DATA_INICIO_COTAS}'")
+    return pd.DatetimeIndex(pd.to_datetime(df['dt_comptc'])).sort_values()
+
+
+def stream_block_cotas(db, n_blocos, bloco, chunksize=500_000):
+    """
+    Lê as cotas de um bloco com cursor server-side, em chunks de `chunksize` linhas.
+
+    Cada chunk é reduzido a (dt_comptc, entity_id, vl_quota) antes de acumular,
+    de forma que o pico de memória fica limitado ao tamanho do bloco.
+    """
+    sql = text(QUERY_COTAS + f" AND {FILTRO_BLOCO}")
+    params = {"n_blocos": int(n_blocos), "bloco": int(bloco)}
+    partes = []
+    with db.engine.connect().execution_options(stream_results=True) as conn:
+        for chunk in pd.read_sql(sql, conn, params=params, chunksize=chunksize):
+            chunk['entity_id'] = chunk['cnpj_fundo'] + " | " + chunk['id_subclasse_clean']
+            partes.append(chunk[['cnpj_fundo', 'id_subclasse_clean', 'entity_id', 'dt_comptc', 'vl_quota']])
+    if not partes:
+        return pd.DataFrame(columns=['cnpj_fundo', 'id_subclasse_clean', 'entity_id', 'dt_comptc', 'vl_quota'])
+    return pd.concat(partes, ignore_index=True)
+
+
+def compute_block(df_cotas, calendario, bench_ret, df_classes, df_existente):
+    """Calcula todas as datas alvo e janelas para as entidades de um bloco."""
+    df_cotas = prepare_cotas(df_cotas)
+    matrix, returns = build_matrix(df_cotas, calendario=calendario)
+    primeira_cota = matrix.apply(lambda x: x.first_valid_index())
+
+    resultados = []
+    for dt_ref in target_dates(calendario):
+        try:
+            df_data = compute_date_metrics(dt_ref, matrix, returns, primeira_cota, bench_ret)
+        except Exception as e:
+            print(f"  ERRO na data {dt_ref.date()}: {e}")
+            continue
+        if df_data is not None:
+            resultados.append(df_data)
+
+    if not resultados:
+        return pd.DataFrame(columns=COLS_DB)
+
+    df_bloco = pd.concat(resultados, ignore_index=True)
+
+    # Filtra pares (data, fundo) já gravados por execuções anteriores
+    if not df_existente.empty:
+        chave = pd.MultiIndex.from_arrays([pd.to_datetime(df_bloco['dt_comptc']), df_bloco['cnpj_fundo']])
+        existentes = pd.MultiIndex.from_arrays([df_existente['dt_comptc'], df_existente['cnpj_fundo']])
+        df_bloco = df_bloco[~chave.isin(existentes)]
+
+    return finalize_metrics(df_bloco, df_classes)
+
+
+def flush_block(db, df_bloco, n_blocos, bloco, dt_max_cotas):
+    """Grava as métricas do bloco e marca o bloco como concluído na mesma transação."""
+    with db.engine.begin() as conn:
+        if not df_bloco.empty:
+            df_bloco.to_sql(
+                TABELA_DESTINO, conn, schema=SCHEMA_DESTINO, if_exists='append', index=False,
+                method='multi', chunksize=10000
+            )
+        conn.execute(text(f"""
+            INSERT INTO {SCHEMA_DESTINO}.{TABELA_BLOCOS} (n_blocos, bloco, dt_max_cotas, registros, finished_at)
+            VALUES (:n_blocos, :bloco, :dt_max_cotas, :registros, NOW())
+            ON CONFLICT (n_blocos, bloco, dt_max_cotas) DO UPDATE
+            SET registros = EXCLUDED.registros, finished_at = EXCLUDED.finished_at
+        """), {"n_blocos": int(n_blocos), "bloco": int(bloco), "dt_max_cotas": dt_max_cotas.date(),
+               "registros": int(len(df_bloco))})
+
+
+def calculate_metrics_175_blocks(n_blocos=16, reset=False):
+    """
+    Modo out-of-core: processa as entidades em `n_blocos` partições por hash do CNPJ.
+
+    Se o job cair no meio, basta rodar novamente com o mesmo `n_blocos`: os blocos
+    já marcados em cvm.metrics_blocos para a mesma última data de cotas são pulados.
+    Com cotas novas a marca d'água muda e todos os blocos voltam a rodar.
+    `reset=True` esquece o controle e reprocessa todos os blocos (pares data/fundo
+    já gravados continuam filtrados).
+    """
+    db = PostgresConnector()
+    ensure_block_table(db)
+
+    print("Carregando calendário de cotas...")
+    calendario = load_calendar(db)
+    if calendario.empty:
+        print("Erro: cvm.cotas sem datas a partir de", DATA_INICIO_COTAS)
+        return
+    dt_max_cotas = calendario.max()
+
+    # Marcas de outras marcas d'água não servem mais para retomar nada
+    filtro_marcas = f"n_blocos = {int(n_blocos)}"
+    if not reset:
+        filtro_marcas += f" AND dt_max_cotas <> '{dt_max_cotas.date()}'"
+    db.execute_sql(f"DELETE FROM {SCHEMA_DESTINO}.{TABELA_BLOCOS} WHERE {filtro_marcas}")
+
+    print("Carregando Benchmarks e Classes...")
+    bench_ret = load_benchmarks(db)
+    df_classes = load_classes(db)
+
+    concluidos = get_finished_blocks(db, n_blocos, dt_max_cotas)
+    pendentes = [b for b in range(n_blocos) if b not in concluidos]
+    print(f"Cotas até {dt_max_cotas.date()}: {len(concluidos)}/{n_blocos} blocos já concluídos. "
+          f"Processando {len(pendentes)} blocos...")
+
+    for bloco in pendentes:
+        inicio = datetime.now()
+        try:
+            df_cotas = stream_block_cotas(db, n_blocos, bloco)
+            if df_cotas.empty:
+                flush_block(db, pd.DataFrame(columns=COLS_DB), n_blocos, bloco, dt_max_cotas)
+                print(f"[Bloco {bloco+1}/{n_blocos}] Sem cotas.")
+                continue
+
+            df_existente = db.read_sql(
+                f"SELECT DISTINCT dt_comptc, cnpj_fundo FROM {SCHEMA_DESTINO}.{TABELA_DESTINO} "
+                f"WHERE mod(abs(hashtext(cnpj_fundo)::bigint), {int(n_blocos)}) = {int(bloco)}"
+            )
+            if not df_existente.empty:
+                df_existente['dt_comptc'] = pd.to_datetime(df_existente['dt_comptc'])
+
+            n_entidades = df_cotas['entity_id'].nunique()
+            df_bloco = compute_block(df_cotas, calendario, bench_ret, df_classes, df_existente)
+            del df_cotas
+
+            flush_block(db, df_bloco, n_blocos, bloco, dt_max_cotas)
+            elapsed = (datetime.now() - inicio).total_seconds()
+            print(f"[Bloco {bloco+1}/{n_blocos}] {n_entidades} entidades, "
+                  f"{len(df_bloco)} registros salvos em {elapsed:.1f}s.")
+
+        except KeyboardInterrupt:
+            print("Interrupção pelo usuário. Blocos concluídos ficam salvos; rode novamente para retomar.")
+            break
+        except Exception as e:
+            # Bloco não é marcado como concluído; será reprocessado na próxima execução
+            print(f"ERRO CRÍTICO no bloco {bloco}: {e}")
+            continue
+
+    print("Processo concluído!")
+
+
 if __name__ == "__main__":
-    calculate_metrics_175_final()
\ No newline at end of file
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--blocos', type=int, default=0,
+                        help="Particiona as entidades em N blocos por hash do CNPJ (0 = matriz completa)")
+    parser.add_argument('--reset-blocos', action='store_true',
+                        help="Ignora o controle de blocos concluídos e reprocessa todos")
+    args = parser.parse_args()
+
+    if args.blocos > 0:
+        calculate_metrics_175_blocks(args.blocos, reset=args.reset_blocos)
+    else:
+        calculate_metrics_175_final()
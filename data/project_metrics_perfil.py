@@ -0,0 +1,140 @@
+import sys
+import os
+import json
+import argparse
+import pandas as pd
+from sqlalchemy import text
+
+# Add project root to path
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.abspath(os.path.join(current_dir, '..'))
+if project_root not in sys.path:
+    sys.path.append(project_root)
+
+from common.postgresql import PostgresConnector
+from common.metrics import SUBCLASSE_MASTER, main_series, profile_metrics, profile_to_dict
+import warnings
+
+# Suprimir avisos de divisão por zero/log que trataremos no código
+warnings.filterwarnings('ignore', category=RuntimeWarning)
+
+# Uma linha por fundo com o payload pronto de /funds/{cnpj}/metrics:
+# a API passa a fazer um único SELECT pela PK em vez de recalcular a série inteira.
+TABELA_PERFIL = "cvm.metrics_perfil"
+
+DDL_PERFIL = f"""
+CREATE TABLE IF NOT EXISTS {TABELA_PERFIL} (
+    cnpj_fundo VARCHAR PRIMARY KEY,
+    dt_ref DATE,
+    volatilidade_12m DOUBLE PRECISION,
+    sharpe_12m DOUBLE PRECISION,
+    pos_months INT,
+    neg_months INT,
+    best_month DOUBLE PRECISION,
+    worst_month DOUBLE PRECISION,
+    payload JSONB,
+    updated_at TIMESTAMP DEFAULT NOW()
+);
+"""
+
+FILTRO_BLOCO = "mod(abs(hashtext(cnpj_fundo)::bigint), :n_blocos) = :bloco"
+
+
+def load_cdi(db):
+    """Série do CDINI (índice acumulado) para o sharpe 12M."""
+    df = db.read_sql("SELECT data, valor FROM middle.indices_cotas WHERE codigo = 'CDINI' ORDER BY data")
+    if df.empty:
+        return None
+    return df.set_index('data')['valor']
+
+
+def load_block(db, n_blocos, bloco):
+    """Cotas de um bloco de fundos (partição por hash do CNPJ)."""
+    sql = f"""
+        SELECT cnpj_fundo, COALESCE(TEXT(id_subclasse), '{SUBCLASSE_MASTER}') AS id_subclasse, dt_comptc, vl_quota
+        FROM cvm.cotas
+        WHERE {FILTRO_BLOCO}
+    """
+    with db.engine.connect() as conn:
+        return pd.read_sql(text(sql), conn, params={"n_blocos": int(n_blocos), "bloco": int(bloco)})
+
+
+def build_rows(df_cotas, cdi):
+    """Calcula o perfil de todos os fundos do bloco e monta as linhas da tabela."""
+    df_cotas = df_cotas.dropna(subset=['vl_quota'])
+    df_cotas['dt_comptc'] = pd.to_datetime(df_cotas['dt_comptc'])
+    # Uma série por fundo (subclasses não se misturam): a mesma que a API lê
+    df_cotas = main_series(df_cotas)
+    df_cotas = df_cotas.drop_duplicates(subset=['cnpj_fundo', 'dt_comptc'], keep='last')
+
+    matrix = df_cotas.pivot(index='dt_comptc', columns='cnpj_fundo', values='vl_quota')
+    profile = profile_metrics(matrix, cdi)
+    resumo = profile['resumo']
+    dt_ref = matrix.apply(pd.Series.last_valid_index)
+
+    rows = []
+    for cnpj in matrix.columns:
+        payload = profile_to_dict(profile, cnpj)
+        rows.append({
+            'cnpj_fundo': cnpj,
+            'dt_ref': dt_ref[cnpj].date() if pd.notnull(dt_ref[cnpj]) else None,
+            'volatilidade_12m': payload['volatilidade_12m'],
+            'sharpe_12m': payload['sharpe_12m'],
+            'pos_months': int(resumo.at[cnpj, 'pos_months']),
+            'neg_months': int(resumo.at[cnpj, 'neg_months']),
+            'best_month': payload['consistency']['best_month'],
+            'worst_month': payload['consistency']['worst_month'],
+            'payload': json.dumps(payload),
+        })
+    return pd.DataFrame(rows)
+
+
+def upsert_rows(db, df_rows):
+    """
+    Upsert pela PK via tabela temporária da sessão (some no COMMIT; execuções concorrentes não
+    disputam a mesma tabela). Carga por COPY; o payload chega como texto e vira JSONB.
+    """
+    if df_rows.empty:
+        return
+    cols = [c for c in df_rows.columns if c != 'payload']
+    col_list = ", ".join(cols)
+    updates = ", ".join([f"{c} = EXCLUDED.{c}" for c in cols if c != 'cnpj_fundo'])
+    with db.engine.begin() as conn:
+        conn.execute(text(f"CREATE TEMP TABLE tmp_metrics_perfil (LIKE {TABELA_PERFIL}) ON COMMIT DROP"))
+        db.copy_dataframe(df_rows, 'pg_temp.tmp_metrics_perfil', conn=conn)
+        conn.execute(text(f"""
+            INSERT INTO {TABELA_PERFIL} ({col_list}, payload, updated_at)
+            SELECT {col_list}, payload, NOW() FROM pg_temp.tmp_metrics_perfil
+            ON CONFLICT (cnpj_fundo) DO UPDATE
+            SET {updates}, payload = EXCLUDED.payload, updated_at = EXCLUDED.updated_at
+        """))
+
+
+def run(n_blocos=16):
+    db = PostgresConnector()
+    print(f"--- Materializing {TABELA_PERFIL} ---")
+    db.execute_sql(DDL_PERFIL)
+
+    cdi = load_cdi(db)
+    if cdi is None:
+        print("Aviso: CDINI indisponível, sharpe usará a taxa padrão.")
+
+    total = 0
+    for bloco in range(n_blocos):
+        df_cotas = load_block(db, n_blocos, bloco)
+        if df_cotas.empty:
+            continue
+        df_rows = build_rows(df_cotas, cdi)
+        upsert_rows(db, df_rows)
+        total += len(df_rows)
+        print(f"[Bloco {bloco+1}/{n_blocos}] {len(df_rows)} fundos.")
+
+    print(f"Concluído: {total} fundos em {TABELA_PERFIL}.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--blocos', type=int, default=16,
+                        help="Quantidade de blocos de fundos (partição por hash do CNPJ)")
+    args = parser.parse_args()
+    run(args.blocos)
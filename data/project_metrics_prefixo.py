@@ -0,0 +1,151 @@
+import sys
+import os
+import argparse
+import pandas as pd
+from sqlalchemy import text
+
+# Add project root to path
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.abspath(os.path.join(current_dir, '..'))
+if project_root not in sys.path:
+    sys.path.append(project_root)
+
+from common.postgresql import PostgresConnector
+from common.metrics import COLS_PREFIXO, SUBCLASSE_MASTER, prefix_sums
+import warnings
+
+# Suprimir avisos de divisão por zero/log que trataremos no código
+warnings.filterwarnings('ignore', category=RuntimeWarning)
+
+# Índice de somas acumuladas por (fundo, subclasse, data): base de /funds/{cnpj}/metrics/range.
+# Incremental: cada execução só acrescenta as datas posteriores à última linha da série.
+TABELA_PREFIXO = "cvm.metrics_prefixo"
+
+DDL_PREFIXO = f"""
+CREATE TABLE IF NOT EXISTS {TABELA_PREFIXO} (
+    cnpj_fundo VARCHAR,
+    id_subclasse VARCHAR,
+    dt_comptc DATE,
+    vl_quota DOUBLE PRECISION,
+    n_ret INT,
+    s_ret DOUBLE PRECISION,
+    s_ret2 DOUBLE PRECISION,
+    s_cdi DOUBLE PRECISION,
+    s_ibov DOUBLE PRECISION,
+    PRIMARY KEY (cnpj_fundo, id_subclasse, dt_comptc)
+);
+"""
+
+FILTRO_BLOCO = "mod(abs(hashtext({col})::bigint), :n_blocos) = :bloco"
+
+
+def load_index(db, codigo):
+    """Série de nível de um índice de middle.indices_cotas (None se indisponível)."""
+    df = db.read_sql(f"SELECT data, valor FROM middle.indices_cotas WHERE codigo = '{codigo}' ORDER BY data")
+    if df.empty:
+        return None
+    return df.set_index('data')['valor']
+
+
+def read_block(db, sql, n_blocos, bloco):
+    """Consulta de um bloco com os parâmetros do filtro de hash ligados."""
+    with db.engine.connect() as conn:
+        return pd.read_sql(text(sql), conn, params={"n_blocos": int(n_blocos), "bloco": int(bloco)})
+
+
+def load_seeds(db, n_blocos, bloco):
+    """Última linha já indexada de cada série do bloco (ponto de partida das somas)."""
+    sql = f"""
+        SELECT DISTINCT ON (cnpj_fundo, id_subclasse) {', '.join(COLS_PREFIXO)}
+        FROM {TABELA_PREFIXO}
+        WHERE {FILTRO_BLOCO.format(col='cnpj_fundo')}
+        ORDER BY cnpj_fundo, id_subclasse, dt_comptc DESC
+    """
+    return read_block(db, sql, n_blocos, bloco)
+
+
+def load_new_cotas(db, n_blocos, bloco):
+    """
+    Cotas do bloco posteriores à última data indexada de cada série.
+
+    O MAX(dt_comptc) só agrega as linhas do próprio bloco, não o índice inteiro.
+    """
+    sql = f"""
+        SELECT c.cnpj_fundo, COALESCE(TEXT(c.id_subclasse), '{SUBCLASSE_MASTER}') AS id_subclasse,
+               c.dt_comptc, c.vl_quota
+        FROM cvm.cotas c
+        LEFT JOIN (
+            SELECT cnpj_fundo, id_subclasse, MAX(dt_comptc) AS dt_max
+            FROM {TABELA_PREFIXO}
+            WHERE {FILTRO_BLOCO.format(col='cnpj_fundo')}
+            GROUP BY cnpj_fundo, id_subclasse
+        ) p ON p.cnpj_fundo = c.cnpj_fundo
+           AND p.id_subclasse = COALESCE(TEXT(c.id_subclasse), '{SUBCLASSE_MASTER}')
+        WHERE {FILTRO_BLOCO.format(col='c.cnpj_fundo')}
+          AND c.vl_quota IS NOT NULL
+          AND (p.dt_max IS NULL OR c.dt_comptc > p.dt_max)
+    """
+    return read_block(db, sql, n_blocos, bloco)
+
+
+def ensure_table(db):
+    """Cria o índice; uma versão antiga, sem id_subclasse, é recriada do zero."""
+    schema, table = TABELA_PREFIXO.split('.')
+    df = db.read_sql(f"""
+        SELECT column_name FROM information_schema.columns
+        WHERE table_schema = '{schema}' AND table_name = '{table}'
+    """)
+    if not df.empty and 'id_subclasse' not in set(df['column_name']):
+        print(f"{TABELA_PREFIXO} sem id_subclasse: recriando o índice.")
+        db.execute_sql(f"DROP TABLE {TABELA_PREFIXO}")
+    db.execute_sql(DDL_PREFIXO)
+
+
+def append_rows(db, df_rows):
+    """Datas novas nunca colidem com a PK, então basta um append."""
+    if df_rows.empty:
+        return
+    df_rows = df_rows.copy()
+    df_rows['dt_comptc'] = pd.to_datetime(df_rows['dt_comptc']).dt.date
+    schema, table = TABELA_PREFIXO.split('.')
+    with db.engine.begin() as conn:
+        df_rows.to_sql(table, conn, schema=schema, if_exists='append', index=False,
+                       method='multi', chunksize=10000)
+
+
+def run(n_blocos=16, rebuild=False):
+    db = PostgresConnector()
+    print(f"--- Updating {TABELA_PREFIXO} ---")
+    ensure_table(db)
+    if rebuild:
+        print("Rebuild: limpando o índice.")
+        db.execute_sql(f"TRUNCATE {TABELA_PREFIXO}")
+
+    cdi = load_index(db, 'CDINI')
+    ibov = load_index(db, 'IBOV')
+    if cdi is None or ibov is None:
+        print("Aviso: CDINI/IBOV indisponível, somas do benchmark ficam zeradas.")
+
+    total = 0
+    for bloco in range(n_blocos):
+        df_cotas = load_new_cotas(db, n_blocos, bloco)
+        if df_cotas.empty:
+            continue
+        seeds = load_seeds(db, n_blocos, bloco)
+        df_rows = prefix_sums(df_cotas, seeds, cdi, ibov)
+        append_rows(db, df_rows)
+        total += len(df_rows)
+        print(f"[Bloco {bloco+1}/{n_blocos}] {df_rows['cnpj_fundo'].nunique() if not df_rows.empty else 0} fundos, "
+              f"{len(df_rows)} linhas novas.")
+
+    print(f"Concluído: {total} linhas novas em {TABELA_PREFIXO}.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--blocos', type=int, default=16,
+                        help="Quantidade de blocos de fundos (partição por hash do CNPJ)")
+    parser.add_argument('--rebuild', action='store_true',
+                        help="Apaga o índice e recalcula desde a primeira cota (ex: cotas retificadas)")
+    args = parser.parse_args()
+    run(args.blocos, rebuild=args.rebuild)
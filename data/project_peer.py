@@ -0,0 +1,116 @@
+import sys
+import os
+import argparse
+import pandas as pd
+from sqlalchemy import text
+
+# Add project root to path
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.abspath(os.path.join(current_dir, '..'))
+if project_root not in sys.path:
+    sys.path.append(project_root)
+
+from common.postgresql import PostgresConnector
+from common.peer_classifier import classify, split_peer, REGRAS_HASH
+
+# cvm.peer como tabela (antes: materialized view com o CASE de regex avaliado pelo Postgres
+# em todo o cadastro a cada rebuild). Incremental: só fundos novos ou com nome/classe/exclusivo
+# alterados em cvm.cadastro são reclassificados; regras novas (REGRAS_HASH) reclassificam tudo.
+TABELA_PEER = "cvm.peer"
+STAGING_SUFFIX = "__stg"
+
+COLS_CADASTRO = ['cnpj_fundo', 'denom_social', 'classe', 'fundo_exclusivo']
+COLS_COMPARADAS = ['denom_social', 'classe_cvm', 'fundo_exclusivo']
+
+DDL_PEER = """
+CREATE TABLE {table} (
+    cnpj_fundo VARCHAR PRIMARY KEY,
+    denom_social TEXT,
+    classe_cvm TEXT,
+    fundo_exclusivo TEXT,
+    peer_classificacao_full TEXT,
+    peer_grupo TEXT,
+    peer_detalhado TEXT,
+    regras_hash CHAR(32),
+    classified_at TIMESTAMP DEFAULT NOW()
+);
+"""
+
+
+def load_cadastro(db):
+    """Fundos ativos (um por CNPJ)."""
+    df = db.read_sql(f"SELECT {', '.join(COLS_CADASTRO)} FROM cvm.cadastro WHERE dt_fim IS NULL")
+    return df.drop_duplicates('cnpj_fundo', keep='last').reset_index(drop=True)
+
+
+def build_rows(df_cad):
+    """Linhas de cvm.peer para os fundos de `df_cad` (classificação vetorizada)."""
+    peer = classify(df_cad)
+    rows = df_cad.rename(columns={'classe': 'classe_cvm'})
+    rows['peer_classificacao_full'] = peer
+    rows = pd.concat([rows, split_peer(peer)], axis=1)
+    rows['regras_hash'] = REGRAS_HASH
+    return rows
+
+
+def changed_funds(df_cad, df_peer):
+    """(cadastro a reclassificar, CNPJs que saíram do cadastro ativo)."""
+    atual = df_cad.rename(columns={'classe': 'classe_cvm'})
+    merged = atual.merge(df_peer, on='cnpj_fundo', how='outer', suffixes=('', '_peer'), indicator=True)
+    novo = merged['_merge'] == 'left_only'
+    removido = merged['_merge'] == 'right_only'
+    mudou = merged['regras_hash'] != REGRAS_HASH
+    for col in COLS_COMPARADAS:
+        a, b = merged[col], merged[f'{col}_peer']
+        mudou |= ~((a == b) | (a.isna() & b.isna()))
+    alvo = merged.loc[(novo | mudou) & ~removido, 'cnpj_fundo']
+    return df_cad[df_cad['cnpj_fundo'].isin(alvo)], merged.loc[removido, 'cnpj_fundo'].tolist()
+
+
+def full_build(db, df_cad):
+    """Monta cvm.peer__stg e troca com a atual (view materializada ou tabela)."""
+    rows = build_rows(df_cad)
+    stg_name = f"{TABELA_PEER}{STAGING_SUFFIX}"
+    with db.engine.begin() as conn:
+        conn.execute(text(f"DROP TABLE IF EXISTS {stg_name} CASCADE;"))
+        conn.execute(text(DDL_PEER.format(table=stg_name)))
+        db.copy_dataframe(rows, stg_name, conn=conn)
+    db.swap_table(stg_name, TABELA_PEER, STAGING_SUFFIX)
+    return len(rows)
+
+
+def run(rebuild=False):
+    db = PostgresConnector()
+    print(f"--- Updating {TABELA_PEER} ---")
+    df_cad = load_cadastro(db)
+    print(f"{len(df_cad)} fundos ativos no cadastro.")
+
+    with db.engine.connect() as conn:
+        kind = conn.execute(text("SELECT relkind FROM pg_class WHERE oid = to_regclass(:rel)"), {"rel": TABELA_PEER}).scalar()
+    if rebuild or kind != 'r':
+        motivo = "rebuild" if rebuild else ("inexistente" if kind is None else "view materializada -> tabela")
+        print(f"Classificação completa ({motivo})...")
+        total = full_build(db, df_cad)
+        print(f"Concluído: {total} fundos classificados.")
+        return
+
+    df_peer = db.read_sql(f"SELECT cnpj_fundo, {', '.join(COLS_COMPARADAS)}, regras_hash FROM {TABELA_PEER}")
+    df_alvo, removidos = changed_funds(df_cad, df_peer)
+    if df_alvo.empty and not removidos:
+        print("Nenhum fundo novo ou alterado.")
+        return
+
+    if not df_alvo.empty:
+        db.upsert_dataframe(build_rows(df_alvo), TABELA_PEER, ['cnpj_fundo'])
+    if removidos:
+        with db.engine.begin() as conn:
+            conn.execute(text(f"DELETE FROM {TABELA_PEER} WHERE cnpj_fundo = ANY(:cnpjs)"), {"cnpjs": removidos})
+    print(f"Concluído: {len(df_alvo)} fundos (re)classificados, {len(removidos)} removidos.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rebuild', action='store_true',
+                        help="Reclassifica todos os fundos (nova tabela + troca atômica)")
+    args = parser.parse_args()
+    run(rebuild=args.rebuild)
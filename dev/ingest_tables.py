@@ -1,22 +1,250 @@
 import sys; sys.path.append('..')
 import os
 import pandas as pd
+import io
 import re
 import csv
+import time
+import hashlib
+import zipfile
 import argparse
-from datetime import datetime
-from sqlalchemy import text, exc
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime, date
+from queue import Empty
+from sqlalchemy import create_engine, event, text, exc
 from common.postgresql import PostgresConnector as db
+from common.cvm_schema import CATALOG_TYPES, SQL_TYPES, apply_schema, declared_schema, to_sql_dtypes
 
 # Configurações de Path
 ROOT_DIR = r"E:/Download/cvm"
 START_DIR = r"E:/Download/cvm/FI"
 
+# Intervalo (s) entre linhas do relatório de progresso no modo paralelo
+PROGRESS_INTERVAL = 5
+
+# Caminho streaming (CSV -> COPY FROM STDIN): bytes lidos por COPY, tamanho a partir
+# do qual o arquivo vai direto por streaming e linhas de amostra para criar tabela nova
+STREAM_CHUNK_BYTES = 64 * 1024 * 1024
+STREAM_MIN_BYTES = 200 * 1024 * 1024
+STREAM_SAMPLE_ROWS = 20000
+
+# Manifesto de ingestão: uma linha por arquivo carregado (chave = caminho relativo a ROOT_DIR).
+# Tamanho + mtime iguais => pula sem ler; se mudaram, o hash do conteúdo decide.
+MANIFEST_TABLE = "cvm.ingest_manifest"
+DDL_MANIFEST = f"""
+CREATE TABLE IF NOT EXISTS {MANIFEST_TABLE} (
+    file_path TEXT PRIMARY KEY,
+    table_name TEXT,
+    size_bytes BIGINT,
+    mtime DOUBLE PRECISION,
+    content_hash TEXT,
+    row_count BIGINT,
+    loaded_at TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS idx_ingest_manifest_table ON {MANIFEST_TABLE} (table_name);
+"""
+
+# Modo staging: carga numa cópia UNLOGGED "<tabela>__stg", índices construídos lá e troca atômica.
+# Tabela já particionada: só as partições dos meses recarregados são montadas ao lado e trocadas.
+STAGING_SUFFIX = "__stg"
+
+# Tabelas grandes particionadas por mês de dt_comptc (RANGE), criadas e alimentadas pelo ingestor.
+# Partições "<tabela>_pAAAAMM" nascem sob demanda conforme os meses que chegam nos arquivos;
+# "<tabela>_pdefault" recebe datas fora do padrão. dt_comptc vira DATE nessas tabelas e os índices
+# criados no pai (mesmos nomes de data/create_indexes.py) valem para todas as partições.
+PARTITION_KEY = 'dt_comptc'
+PARTITIONED_TABLES = {'cvm.fi_doc_inf_diario_inf_diario_fi'} | {f'cvm.fi_doc_cda_fi_blc_{i}' for i in range(1, 9)}
+
+# Arquivos da CVM não usam aspas (QUOTE_NONE): \x01 como QUOTE desliga o tratamento de aspas do COPY
+COPY_OPTIONS = "FORMAT csv, DELIMITER ';', QUOTE E'\\x01', NULL '', ENCODING 'LATIN1'"
+
+
+# ==========================================
+# FONTES: CSV no disco ou membro de um zip da CVM
+# ==========================================
+# Membro de zip é endereçado como "<caminho do zip>!<membro>", ex:
+#   E:/Download/cvm/FI/DOC/INF_DIARIO/DADOS/inf_diario_fi_202401.zip!inf_diario_fi_202401.csv
+# O resto do ingestor trata esse caminho virtual como um CSV comum (mesmo clean_table_name,
+# mesmo __file), lendo o conteúdo direto do zip, sem extrair para o disco.
+ZIP_SEP = '!'
+
+
+def split_source(path):
+    """(zip, membro) para membros de zip; (None, path) para CSV no disco."""
+    if ZIP_SEP in path:
+        zip_path, member = path.split(ZIP_SEP, 1)
+        return zip_path, member
+    return None, path
+
+
+def source_name(path):
+    """Nome do CSV (vira o __file): basename do arquivo ou do membro do zip."""
+    return os.path.basename(split_source(path)[1].replace('\\', '/'))
+
+
+def source_dir(path):
+    """Diretório da fonte no disco (do próprio zip, para membros)."""
+    zip_path, member = split_source(path)
+    return os.path.dirname(zip_path or member)
+
+
+def source_exists(path):
+    zip_path, member = split_source(path)
+    if zip_path is None: return os.path.exists(path)
+    if not os.path.exists(zip_path): return False
+    with zipfile.ZipFile(zip_path) as zf:
+        return member in zf.namelist()
+
+
+def open_source(path):
+    """Arquivo binário para leitura; membros de zip são descompactados em streaming."""
+    zip_path, member = split_source(path)
+    if zip_path is None: return open(path, 'rb')
+    # O membro continua legível depois do close do ZipFile (o handle é compartilhado)
+    with zipfile.ZipFile(zip_path) as zf:
+        return zf.open(member)
+
+
+class _HashingRaw(io.RawIOBase):
+    """Leitura binária que calcula o sha1 do que passa; ao chegar no fim chama on_eof(hexdigest)."""
+    def __init__(self, f, on_eof):
+        self.f, self.on_eof, self.sha1 = f, on_eof, hashlib.sha1()
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        data = self.f.read(len(b))
+        if not data:
+            if self.on_eof: self.on_eof(self.sha1.hexdigest())
+            self.on_eof = None
+            return 0
+        b[:len(data)] = data
+        self.sha1.update(data)
+        return len(data)
+
+    def close(self):
+        if not self.closed: self.f.close()
+        super().close()
+
+
+def open_hashed(path, on_eof):
+    """open_source com sha1 calculado na própria leitura (mesmo hash de file_hash, sem reler o arquivo)."""
+    return io.BufferedReader(_HashingRaw(open_source(path), on_eof), buffer_size=1024 * 1024)
+
+
+def source_stat(path):
+    """
+    (tamanho, mtime, hash ou None). Para membros de zip o tamanho é o descompactado e o
+    CRC32 do diretório central serve de hash de conteúdo sem descompactar nada.
+    """
+    zip_path, member = split_source(path)
+    if zip_path is None:
+        st = os.stat(path)
+        return st.st_size, st.st_mtime, None
+    with zipfile.ZipFile(zip_path) as zf:
+        info = zf.getinfo(member)
+    return info.file_size, datetime(*info.date_time).timestamp(), f"crc32:{info.CRC:08x}"
+
+
+def list_zip_csvs(zip_path):
+    with zipfile.ZipFile(zip_path) as zf:
+        return [f"{zip_path}{ZIP_SEP}{m}" for m in zf.namelist() if m.lower().endswith('.csv')]
+
+
+def _copy_chunks(f, n_fields, suffix):
+    """
+    Lê o CSV (já posicionado após o cabeçalho) em blocos de ~STREAM_CHUNK_BYTES e devolve
+    (bytes prontos para o COPY, linhas, linhas descartadas), anexando `suffix` (;__file) a
+    cada linha. Linhas com quantidade errada de campos são puladas (= on_bad_lines='skip').
+    """
+    seps = n_fields - 1
+    while True:
+        lines = f.readlines(STREAM_CHUNK_BYTES)
+        if not lines: return
+        body = b''.join(lines).replace(b'\r\n', b'\n')
+        if not body.endswith(b'\n'): body += b'\n'
+        n_lines = body.count(b'\n')
+        if body.count(b';') == n_lines * seps and b'\n\n' not in body:
+            # Caminho rápido: bloco todo bem formado
+            yield body.replace(b'\n', suffix), n_lines, 0
+            continue
+        out, rows, skipped = [], 0, 0
+        for line in body.split(b'\n')[:-1]:
+            if line.count(b';') != seps:
+                if line: skipped += 1
+                continue
+            out.append(line)
+            rows += 1
+        yield b''.join(l + suffix for l in out), rows, skipped
+
+
+def _chunk_months(body, col_index):
+    """Meses (AAAAMM) da coluna `col_index` num bloco CSV já normalizado (linhas terminadas em \\n)."""
+    pattern = re.compile(rb'(?m)^(?:[^;\n]*;){%d}(\d{4})-(\d{2})' % col_index)
+    return {(y + m).decode() for y, m in set(pattern.findall(body)) if b'01' <= m <= b'12'}
+
+
+def _month_bounds(yyyymm):
+    year, month = int(yyyymm[:4]), int(yyyymm[4:])
+    return date(year, month, 1), date(year + month // 12, month % 12 + 1, 1)
+
+
+def _file_months(file_name):
+    """Meses (AAAAMM) cobertos pelo arquivo, pelo nome (inf_diario_fi_202401.csv; _2018 = ano inteiro)."""
+    match = re.search(r'_(\d{4})(\d{2})?\.csv$', file_name, re.IGNORECASE)
+    if not match:
+        return set()
+    if match.group(2):
+        return {match.group(1) + match.group(2)}
+    return {f"{match.group(1)}{m:02d}" for m in range(1, 13)}
+
+
+def _ingest_table_worker(table_name, files, options, progress):
+    """
+    Worker do modo paralelo: ingere em ordem todos os arquivos de UMA tabela.
+
+    Cada processo abre uma única conexão (pool_size=1), então o total de conexões
+    fica limitado ao número de workers. Progresso vai para a fila compartilhada.
+    """
+    ingestor = CVMIngestor(pool_size=1, **options)
+    total = ingestor.ingest_table(table_name, files,
+                                  on_file=lambda f, rows: progress.put((table_name, source_name(f), rows)))
+    return table_name, total
+
+
 class CVMIngestor:
-    def __init__(self, full_clean=False):
+    def __init__(self, full_clean=False, workers=1, pool_size=None, stream=False, force=False, staging=False):
         self.connector = db()
+        if pool_size is not None:
+            # Pool limitado (workers do modo paralelo): uma conexão por processo
+            self.connector.engine = create_engine(self.connector.engine.url, pool_size=pool_size, max_overflow=0)
         self.tables_cleaned = set()
+        # {tabela: {coluna: data_type}} -> catálogo consultado uma vez por tabela na execução
+        self.schema_cache = {}
+        # {tabela: {coluna: dtype}} colunas não declaradas, inferidas da amostra do primeiro arquivo
+        # da tabela e repassadas como dtype= aos seguintes (sem inferência completa por arquivo)
+        self.dtype_cache = {}
+        # {arquivo: sha1} das leituras completas feitas pela carga -> record_manifest não relê o arquivo
+        self.content_hashes = {}
+        # {tabela particionada: {AAAAMM, ...}} partições mensais já existentes
+        self.partition_cache = {}
+        # {(tabela, coluna)} conversões para o tipo declarado que já falharam nesta execução
+        # (ex: view dependente bloqueia o ALTER TYPE) -> não são tentadas de novo a cada arquivo
+        self.retype_failed = set()
         self.full_clean = full_clean
+        self.workers = max(1, int(workers))
+        # stream=True: todo arquivo vai por COPY streaming (senão só os >= STREAM_MIN_BYTES)
+        self.stream = stream
+        # force=True: ignora o manifesto e recarrega tudo (full_clean também ignora)
+        self.force = force
+        # staging=True: cada tabela é recarregada numa cópia e trocada atomicamente (sem DELETE WHERE __file)
+        self.staging = staging
+        # Tabelas recém-criadas pelo staging: não têm os arquivos da carga, o DELETE é desnecessário
+        self.fresh_tables = set()
+        # Repassado aos workers do modo paralelo
+        self.options = dict(full_clean=full_clean, stream=stream, force=force, staging=staging)
 
     def clean_table_name(self, relative_dir, file_name):
         path_parts = relative_dir.replace('\\', '/').split('/')
@@ -62,112 +290,860 @@ class CVMIngestor:
             conn.execute(text(sql))
         print(f"  [SUCCESS] Coluna {col_name} migrada.")
 
-    def ensure_schema_compatibility(self, df, s_raw, t_raw, s_quoted, t_quoted):
-        """Garante que as colunas do banco aceitem os dados do DF (converte para TEXT se necessário)."""
-        with self.connector.engine.connect() as conn:
-            query = text("""
-                SELECT column_name, data_type 
-                FROM information_schema.columns 
-                WHERE table_schema = :schema AND table_name = :table
-            """)
-            db_info = {row[0]: row[1] for row in conn.execute(query, {"schema": s_raw, "table": t_raw})}
-        
+    # ==========================================
+    # SCHEMA (cache por execução)
+    # ==========================================
+
+    def table_schema(self, table_name):
+        """{coluna: data_type} da tabela. Vai ao catálogo uma vez por execução ({} = tabela não existe)."""
+        if table_name not in self.schema_cache:
+            _, _, s_raw, t_raw = self.connector._split_table(table_name)
+            with self.connector.engine.connect() as conn:
+                query = text("""
+                    SELECT column_name, data_type 
+                    FROM information_schema.columns 
+                    WHERE table_schema = :schema AND table_name = :table
+                    ORDER BY ordinal_position
+                """)
+                self.schema_cache[table_name] = {row[0]: row[1].lower() for row in conn.execute(query, {"schema": s_raw, "table": t_raw})}
+        return self.schema_cache[table_name]
+
+    def alter_columns(self, table_name, add=(), widen=(), retype=None):
+        """
+        Num único ALTER TABLE: colunas novas (`add`: lista -> TEXT ou {coluna: tipo SQL}),
+        conversões para TEXT (`widen`) e para o tipo declarado (`retype`: {coluna: tipo SQL}).
+        Atualiza o cache de schema.
+        """
+        add = dict(add) if isinstance(add, dict) else {c: 'TEXT' for c in add}
+        retype = {c: t for c, t in (retype or {}).items() if (table_name, c) not in self.retype_failed}
+        if not add and not widen and not retype: return
+        s_quoted, t_quoted, _, _ = self.connector._split_table(table_name)
+        add_clauses = [f'ADD COLUMN "{c}" {t}' for c, t in add.items()]
+        retype_clauses = {c: f"""ALTER COLUMN "{c}" TYPE {t} USING NULLIF(TRIM("{c}"::TEXT), '')::{t}""" for c, t in retype.items()}
+        clauses = add_clauses + [f'ALTER COLUMN "{c}" TYPE TEXT USING "{c}"::TEXT' for c in widen] + list(retype_clauses.values())
+        schema = self.table_schema(table_name)
+        try:
+            with self.connector.engine.begin() as conn:
+                conn.execute(text(f"ALTER TABLE {s_quoted}.{t_quoted} {', '.join(clauses)};"))
+        except exc.SQLAlchemyError:
+            # Ex: view dependente bloqueia o ALTER TYPE ou valor legado não converte ->
+            # colunas novas em lote, migração pesada por coluna e conversões uma a uma
+            if add_clauses:
+                with self.connector.engine.begin() as conn:
+                    conn.execute(text(f"ALTER TABLE {s_quoted}.{t_quoted} {', '.join(add_clauses)};"))
+            for col in widen:
+                self.force_column_migration(s_quoted, t_quoted, col)
+            for col, clause in list(retype_clauses.items()):
+                try:
+                    with self.connector.engine.begin() as conn:
+                        conn.execute(text(f"ALTER TABLE {s_quoted}.{t_quoted} {clause};"))
+                except exc.SQLAlchemyError as e:
+                    print(f"  [SCHEMA] {table_name}.{col} mantida como {schema[col]} ({str(e).splitlines()[0]})")
+                    retype.pop(col)
+                    self.retype_failed.add((table_name, col))
+        for col, sql_type in {**add, **retype}.items():
+            schema[col] = sql_type.lower()
+        for col in widen:
+            schema[col] = 'text'
+
+    def ensure_schema_compatibility(self, df, table_name):
+        """
+        Garante que as colunas do banco aceitem os dados do DF. Colunas declaradas em common/cvm_schema.py
+        são levadas ao tipo declarado; as demais são convertidas para TEXT se necessário.
+        """
+        db_info = self.table_schema(table_name)
         if not db_info: return []
 
-        cols_to_force_string = []
-        df_cols = set(df.columns)
-        existing_cols = set(db_info.keys())
+        def is_text(col): return 'char' in db_info[col] or 'text' in db_info[col]
+        declared = self.declared(table_name, df.columns)
 
         # 1. Novas colunas detectadas no CSV
-        missing_cols = df_cols - existing_cols
-        if 0 < len(missing_cols) <= 10:
-            with self.connector.engine.begin() as conn:
-                for col in missing_cols:
-                    conn.execute(text(f"ALTER TABLE {s_quoted}.{t_quoted} ADD COLUMN \"{col}\" TEXT;"))
+        missing_cols = [c for c in df.columns if c not in db_info]
+        if len(missing_cols) > 10: missing_cols = []
 
         # 2. Validação de tipos (Mismatch banco numérico vs CSV texto)
-        for col in df.columns:
-            if col in db_info:
-                db_type = db_info[col].lower()
-                is_df_numeric = pd.api.types.is_numeric_dtype(df[col])
-
-                if 'char' in db_type or 'text' in db_type:
-                    cols_to_force_string.append(col)
-                elif not is_df_numeric:
-                    try:
-                        with self.connector.engine.begin() as conn:
-                            conn.execute(text(f"ALTER TABLE {s_quoted}.{t_quoted} ALTER COLUMN \"{col}\" TYPE TEXT;"))
-                        cols_to_force_string.append(col)
-                    except exc.SQLAlchemyError:
-                        self.force_column_migration(s_quoted, t_quoted, col)
-                        cols_to_force_string.append(col)
-        
-        return cols_to_force_string
+        # (a chave de partição é DATE por construção e nunca é alargada)
+        widen_cols = [c for c in df.columns if c in db_info and c not in declared and not is_text(c)
+                      and not pd.api.types.is_numeric_dtype(df[c])
+                      and not (c == PARTITION_KEY and self.is_partitioned(table_name))]
+
+        # 3. Colunas declaradas com tipo diferente no banco (ex: TEXT legado)
+        retype = {c: SQL_TYPES[k] for c, k in declared.items() if c in db_info and db_info[c] not in CATALOG_TYPES[k]}
+
+        self.alter_columns(table_name, {c: SQL_TYPES[declared[c]] if c in declared else 'TEXT' for c in missing_cols},
+                           widen_cols, retype)
+        return [c for c in df.columns if c in db_info and is_text(c)]
+
+    def create_table(self, df, table_name):
+        """(Re)cria a tabela com os tipos inferidos do DataFrame + __id SERIAL PK."""
+        if self.is_partitioned(table_name) and PARTITION_KEY in df.columns:
+            return self.create_partitioned_table(df, table_name)
+        s_quoted, t_quoted, s_raw, t_raw = self.connector._split_table(table_name)
+        with self.connector.engine.begin() as conn:
+            print(f"  [DB_SYNC] Criando/Resetando tabela {table_name}")
+            conn.execute(text(f"DROP TABLE IF EXISTS {s_quoted}.{t_quoted} CASCADE;"))
+            df.head(0).to_sql(t_raw, conn, schema=s_raw, if_exists='replace', index=False,
+                              dtype=to_sql_dtypes(self.declared(table_name, df.columns)))
+            conn.execute(text(f"ALTER TABLE {s_quoted}.{t_quoted} ADD COLUMN __id SERIAL PRIMARY KEY;"))
+            if table_name in self.fresh_tables:
+                conn.execute(text(f"ALTER TABLE {s_quoted}.{t_quoted} SET UNLOGGED;"))
+        self.schema_cache.pop(table_name, None)
+
+    def declared(self, table_name, columns):
+        """Schema declarado (common/cvm_schema.py) das colunas presentes; vale também para a staging."""
+        return declared_schema(self.base_table(table_name), columns)
+
+    def open_load(self, file_path):
+        """Fonte para a carga: o sha1 sai da própria leitura e fica em content_hashes ao chegar no fim."""
+        return open_hashed(file_path, lambda h: self.content_hashes.__setitem__(file_path, h))
+
+    def _read_cvm_csv(self, file_path, dtype, **kwargs):
+        with self.open_load(file_path) as f:
+            return pd.read_csv(f, sep=';', encoding='iso-8859-1', low_memory=False, on_bad_lines='skip',
+                               quoting=csv.QUOTE_NONE, dtype=dtype, **kwargs)
+
+    def sample_dtypes(self, df):
+        """dtype por coluna (minúscula) de um DataFrame lido com inferência; inteiros viram Int64 (aceita NULL)."""
+        def fixed(t):
+            if pd.api.types.is_integer_dtype(t): return 'Int64'
+            if pd.api.types.is_bool_dtype(t): return 'boolean'
+            return t
+        return {c.lower(): fixed(t) for c, t in df.dtypes.items()}
+
+    def read_csv(self, file_path, table_name=None, **kwargs):
+        """
+        CSV da CVM -> DataFrame. Com table_name, as colunas declaradas são lidas como texto
+        e convertidas de forma vetorizada para o tipo declarado (sem inferência do pandas);
+        as demais usam os tipos inferidos uma vez por tabela (dtype_cache), a partir de uma
+        amostra do primeiro arquivo.
+        """
+        declared, dtype = {}, None
+        if table_name:
+            header = self.read_header(file_path, lower=False)
+            declared = self.declared(table_name, [c.lower() for c in header])
+            dtype = {c: str for c in header if c.lower() in declared}
+            cached = self.dtype_cache.get(self.base_table(table_name))
+            if cached is None:
+                sample = self._read_cvm_csv(file_path, dtype, nrows=STREAM_SAMPLE_ROWS)
+                cached = self.dtype_cache[self.base_table(table_name)] = {
+                    c: t for c, t in self.sample_dtypes(sample).items() if c not in declared}
+            inferred = {c: cached[c.lower()] for c in header if c.lower() in cached}
+            try:
+                df = self._read_cvm_csv(file_path, {**dtype, **inferred}, **kwargs)
+                novas = {c: t for c, t in self.sample_dtypes(df).items() if c not in declared and c not in cached}
+            except (ValueError, TypeError, OverflowError):
+                # Valor fora do tipo da amostra (ex: texto numa coluna numérica): inferência
+                # completa neste arquivo; colunas que viraram texto passam a ser lidas como texto
+                df = self._read_cvm_csv(file_path, dtype, **kwargs)
+                novas = {c: t for c, t in self.sample_dtypes(df).items()
+                         if c not in declared and (c not in cached or t == object)}
+            cached.update(novas)
+        else:
+            df = self._read_cvm_csv(file_path, dtype, **kwargs)
+        df.columns = [c.lower() for c in df.columns]
+        # Regra salva: 'id' pode existir, mas '__id' é o PK universal interno
+        if '__id' in df.columns: df = df.drop(columns=['__id'])
+        apply_schema(df, declared)
+        df['__file'] = source_name(file_path)
+        return df
+
+    def read_header(self, file_path, lower=True):
+        with open_source(file_path) as f:
+            header = f.readline()
+        columns = header.decode('iso-8859-1').rstrip('\r\n').split(';')
+        return [c.lower() for c in columns] if lower else columns
+
+    def reconcile_header(self, columns, table_name, is_first_for_table, file_path):
+        """
+        Ajusta o schema só pelo cabeçalho: colunas novas entram como TEXT.
+        Tabela nova é criada a partir de uma amostra (mesma inferência de tipos do caminho DataFrame).
+        Retorna se a tabela já existia (=> precisa do DELETE WHERE __file).
+        """
+        table_exists = bool(self.table_schema(table_name))
+
+        if (is_first_for_table and self.full_clean) or not table_exists:
+            self.create_table(self.read_csv(file_path, table_name, nrows=STREAM_SAMPLE_ROWS), table_name)
+            return False
+
+        # Colunas novas com o tipo declarado (TEXT se não declarada); declaradas divergentes são convertidas.
+        # Valores que o Postgres não parseia (ex: decimal com vírgula) derrubam o COPY -> caminho DataFrame.
+        existing_cols = self.table_schema(table_name)
+        declared = self.declared(table_name, columns)
+        self.alter_columns(table_name,
+                           add={c: SQL_TYPES[declared[c]] if c in declared else 'TEXT' for c in columns + ['__file'] if c not in existing_cols},
+                           retype={c: SQL_TYPES[k] for c, k in declared.items() if c in existing_cols and existing_cols[c] not in CATALOG_TYPES[k]})
+        return True
+
+    def stream_ingest(self, file_path, table_name, is_first_for_table):
+        """
+        CSV -> COPY FROM STDIN em blocos, sem montar DataFrame (memória ~ STREAM_CHUNK_BYTES).
+        O Postgres faz a transcodificação LATIN1 e o __file é anexado a cada linha no caminho.
+        DELETE do arquivo anterior + todos os blocos numa transação só.
+        """
+        file = source_name(file_path)
+        columns = self.read_header(file_path)
+        if '__id' in columns or len(set(columns)) != len(columns):
+            raise ValueError("cabeçalho com __id/colunas duplicadas")
+        table_existed = self.reconcile_header(columns, table_name, is_first_for_table, file_path)
+
+        s_quoted, t_quoted, _, _ = self.connector._split_table(table_name)
+        cols = ", ".join(f'"{c}"' for c in columns + ['__file'])
+        copy_sql = f"COPY {s_quoted}.{t_quoted} ({cols}) FROM STDIN WITH ({COPY_OPTIONS})"
+        suffix = (';' + file + '\n').encode('iso-8859-1')
+
+        rows, skipped = 0, 0
+        with self.connector.engine.begin() as conn:
+            if table_existed and table_name not in self.fresh_tables:
+                conn.execute(text(f"DELETE FROM {s_quoted}.{t_quoted} WHERE __file = :filename"), {"filename": file})
+            cursor = conn.connection.cursor()
+            key_index = columns.index(PARTITION_KEY) if self.is_partitioned(table_name) and PARTITION_KEY in columns else None
+            with self.open_load(file_path) as f:
+                f.readline()
+                for chunk, n, bad in _copy_chunks(f, len(columns), suffix):
+                    if n and key_index is not None:
+                        self.ensure_partitions(table_name, _chunk_months(chunk, key_index), conn)
+                    if n: cursor.copy_expert(copy_sql, io.BytesIO(chunk))
+                    rows += n
+                    skipped += bad
+            cursor.close()
+        if skipped:
+            print(f"  [STREAM] {skipped} linhas malformadas ignoradas em {file}")
+        return rows
 
     def fast_bulk_ingest(self, df, table_name, is_first_for_table, current_file):
         s_quoted, t_quoted, s_raw, t_raw = self.connector._split_table(table_name)
-        
-        with self.connector.engine.connect() as conn:
-            table_exists = conn.execute(text(f"SELECT EXISTS (SELECT FROM information_schema.tables WHERE table_schema = '{s_raw}' AND table_name = '{t_raw}')")).scalar()
+        table_exists = bool(self.table_schema(table_name))
 
         # Fluxo de Criação (se for a primeira vez ou não existir)
         if (is_first_for_table and self.full_clean) or not table_exists:
-            with self.connector.engine.begin() as conn:
-                print(f"  [DB_SYNC] Criando/Resetando tabela {table_name}")
-                conn.execute(text(f"DROP TABLE IF EXISTS {s_quoted}.{t_quoted} CASCADE;"))
-                df.head(0).to_sql(t_raw, conn, schema=s_raw, if_exists='replace', index=False)
-                conn.execute(text(f"ALTER TABLE {s_quoted}.{t_quoted} ADD COLUMN __id SERIAL PRIMARY KEY;"))
+            self.create_table(df, table_name)
             str_columns = []
         else:
             # Compatibilidade de Schema antes de inserir
-            str_columns = self.ensure_schema_compatibility(df, s_raw, t_raw, s_quoted, t_quoted)
+            str_columns = self.ensure_schema_compatibility(df, table_name)
 
-        # Forçar STRING no DataFrame para as colunas mapeadas
+        # Forçar STRING no DataFrame para as colunas mapeadas (object já vai como texto, nulos viram NULL no to_sql)
         for col in str_columns:
-            df[col] = df[col].astype(str).replace(['nan', 'None', '<NA>', 'nan'], None)
+            if df[col].dtype == object: continue
+            df[col] = df[col].astype(str).replace(['nan', 'None', '<NA>', 'NaT'], None)
 
         # Inserção de dados
         with self.connector.engine.begin() as conn:
-            if table_exists:
+            if table_exists and table_name not in self.fresh_tables:
                 conn.execute(text(f"DELETE FROM {s_quoted}.{t_quoted} WHERE __file = :filename"), {"filename": current_file})
+            if self.is_partitioned(table_name) and PARTITION_KEY in df.columns:
+                months = list(pd.to_datetime(df[PARTITION_KEY], errors='coerce').dt.strftime('%Y%m').dropna().unique())
+                self.ensure_partitions(table_name, months, conn)
             df.to_sql(t_raw, conn, schema=s_raw, if_exists='append', index=False, method='multi', chunksize=15000)
 
     def get_all_csvs(self, start_path, skip_hist=False):
+        """CSVs do disco + membros CSV dos zips (sem extrair). Membro já extraído ao lado do zip é ignorado."""
         csv_files = []
         for root, dirs, files in os.walk(start_path):
             if 'META' in root.upper(): continue
             if skip_hist and 'HIST' in root.upper(): continue
+            on_disk = {f.lower() for f in files}
             for f in files:
                 if f.lower().endswith('.csv'): csv_files.append(os.path.join(root, f))
+            for f in files:
+                if not f.lower().endswith('.zip'): continue
+                try:
+                    members = list_zip_csvs(os.path.join(root, f))
+                except zipfile.BadZipFile:
+                    print(f"  [ZIP] Arquivo corrompido, ignorado: {f}")
+                    continue
+                csv_files.extend(m for m in members if source_name(m).lower() not in on_disk)
         return csv_files
 
-    def ingest_list(self, file_list, from_date=None):
+    def table_for(self, file_path):
+        return self.clean_table_name(os.path.relpath(source_dir(file_path), ROOT_DIR), source_name(file_path))
+
+    def plan_files(self, file_list, from_date=None):
+        """Resolve (arquivo, tabela) na ordem recebida, aplicando os mesmos filtros do ingest."""
+        plan = []
         for file_path in file_list:
-            if not os.path.exists(file_path): continue
-            root, file = os.path.split(file_path)
-            if not self._should_ingest_file(file, from_date): continue
+            if not source_exists(file_path): continue
+            if not self._should_ingest_file(source_name(file_path), from_date): continue
 
-            relative_dir = os.path.relpath(root, ROOT_DIR)
-            table_name = self.clean_table_name(relative_dir, file)
+            table_name = self.table_for(file_path)
             if not table_name: continue
-            
-            try:
-                df = pd.read_csv(file_path, sep=';', encoding='iso-8859-1', low_memory=False, on_bad_lines='skip', quoting=csv.QUOTE_NONE)
-                df.columns = [c.lower() for c in df.columns]
-                
-                # Regra salva: 'id' pode existir, mas '__id' é o PK universal interno
-                if '__id' in df.columns: df = df.drop(columns=['__id'])
-                df['__file'] = file 
+            plan.append((file_path, table_name))
+        return plan
+
+    # ==========================================
+    # MANIFESTO (pula arquivos inalterados)
+    # ==========================================
 
-                is_first = False
-                if table_name not in self.tables_cleaned and self.full_clean:
-                    is_first = True
-                    self.tables_cleaned.add(table_name)
+    def ensure_manifest(self):
+        self.connector.execute_sql(DDL_MANIFEST)
 
-                print(f"Ingerindo: {file} -> {table_name}")
-                self.fast_bulk_ingest(df, table_name, is_first, file)
+    def manifest_key(self, file_path):
+        zip_path, member = split_source(file_path)
+        key = os.path.relpath(zip_path or member, ROOT_DIR).replace('\\', '/')
+        return f"{key}{ZIP_SEP}{member}" if zip_path else key
+
+    def file_hash(self, file_path):
+        h = hashlib.sha1()
+        with open_source(file_path) as f:
+            for block in iter(lambda: f.read(8 * 1024 * 1024), b''):
+                h.update(block)
+        return h.hexdigest()
+
+    def fingerprint(self, file_path):
+        size, mtime, content_hash = source_stat(file_path)
+        return {'file_path': self.manifest_key(file_path), 'size_bytes': size, 'mtime': mtime, 'content_hash': content_hash}
+
+    def check_unchanged(self, file_path):
+        """
+        Retorna (inalterado, fingerprint). Hash só é calculado quando tamanho/mtime mudaram;
+        conteúdo igual com mtime novo só atualiza o manifesto (próxima checagem fica barata).
+        """
+        fp = self.fingerprint(file_path)
+        if self.force or self.full_clean: return False, fp
+
+        with self.connector.engine.connect() as conn:
+            row = conn.execute(text(f"SELECT size_bytes, mtime, content_hash FROM {MANIFEST_TABLE} WHERE file_path = :k"),
+                               {"k": fp['file_path']}).fetchone()
+        if row is None: return False, fp
+        if row[0] == fp['size_bytes'] and row[1] == fp['mtime']: return True, fp
+
+        if fp['content_hash'] is None: fp['content_hash'] = self.file_hash(file_path)
+        if row[2] != fp['content_hash']: return False, fp
+        with self.connector.engine.begin() as conn:
+            conn.execute(text(f"UPDATE {MANIFEST_TABLE} SET size_bytes = :size_bytes, mtime = :mtime WHERE file_path = :file_path"), fp)
+        return True, fp
+
+    def record_manifest(self, fp, table_name, row_count, file_path=None):
+        """Upsert da linha do arquivo. Sem file_path o hash fica NULL (adoção de arquivo já carregado)."""
+        if fp['content_hash'] is None and file_path is not None:
+            fp['content_hash'] = self.file_hash(file_path)
+        params = dict(fp, table_name=table_name, row_count=row_count)
+        with self.connector.engine.begin() as conn:
+            conn.execute(text(f"""
+                INSERT INTO {MANIFEST_TABLE} (file_path, table_name, size_bytes, mtime, content_hash, row_count, loaded_at)
+                VALUES (:file_path, :table_name, :size_bytes, :mtime, :content_hash, :row_count, NOW())
+                ON CONFLICT (file_path) DO UPDATE SET
+                    table_name = EXCLUDED.table_name, size_bytes = EXCLUDED.size_bytes, mtime = EXCLUDED.mtime,
+                    content_hash = EXCLUDED.content_hash, row_count = EXCLUDED.row_count, loaded_at = EXCLUDED.loaded_at
+            """), params)
+
+    def load_file(self, file_path, table_name, fp):
+        """Carga de um arquivo (COPY streaming para arquivos grandes, DataFrame nos demais). Retorna linhas."""
+        file = source_name(file_path)
+        is_first = False
+        if table_name not in self.tables_cleaned and self.full_clean:
+            is_first = True
+            self.tables_cleaned.add(table_name)
+
+        print(f"Ingerindo: {file} -> {table_name}")
+        self.content_hashes.pop(file_path, None)
+        rows = None
+        if self.stream or fp['size_bytes'] >= STREAM_MIN_BYTES:
+            try:
+                rows = self.stream_ingest(file_path, table_name, is_first)
             except Exception as e:
-                print(f"Erro fatal em {file}: {e}")
+                # Ex: tipo numérico no banco x texto no CSV -> caminho DataFrame converte a coluna
+                print(f"  [STREAM] Falhou ({str(e).splitlines()[0]}), usando caminho DataFrame...")
+
+        if rows is None:
+            df = self.read_csv(file_path, table_name)
+            self.fast_bulk_ingest(df, table_name, is_first, file)
+            rows = len(df)
+        # Hash calculado durante a leitura da carga (None se ela não chegou ao fim -> record_manifest lê)
+        if fp['content_hash'] is None: fp['content_hash'] = self.content_hashes.pop(file_path, None)
+        return rows
+
+    def ingest_file(self, file_path, table_name):
+        """Lê um CSV da CVM e grava na tabela. Retorna o número de linhas (0 em caso de erro ou arquivo inalterado)."""
+        file = source_name(file_path)
+        try:
+            unchanged, fp = self.check_unchanged(file_path)
+            if unchanged:
+                print(f"  [SKIP] {file} inalterado")
+                return 0
+            rows = self.load_file(file_path, table_name, fp)
+            self.record_manifest(fp, table_name, rows, file_path)
+            return rows
+        except Exception as e:
+            print(f"Erro fatal em {file}: {e}")
+            return 0
+
+    def ingest_table(self, table_name, files, on_file=None):
+        """Todos os arquivos de uma tabela, em ordem. on_file(arquivo, linhas) é chamado a cada arquivo."""
+        if self.staging:
+            return self.staging_load(table_name, files, on_file)
+        total = 0
+        for file_path in files:
+            rows = self.ingest_file(file_path, table_name)
+            total += rows
+            if on_file: on_file(file_path, rows)
+        return total
+
+    def ingest_list(self, file_list, from_date=None):
+        plan = self.plan_files(file_list, from_date)
+        self.ensure_manifest()
+        if self.workers > 1:
+            return self.ingest_parallel(plan)
+        if self.staging:
+            files_by_table = {}
+            for file_path, table_name in plan:
+                files_by_table.setdefault(table_name, []).append(file_path)
+            for table_name, files in files_by_table.items():
+                self.ingest_table(table_name, files)
+            return
+        for file_path, table_name in plan:
+            self.ingest_file(file_path, table_name)
+
+    # ==========================================
+    # PARTICIONAMENTO MENSAL (dt_comptc)
+    # ==========================================
+
+    def base_table(self, table_name):
+        """Nome da tabela final (sem o sufixo de staging)."""
+        return table_name[:-len(STAGING_SUFFIX)] if table_name.endswith(STAGING_SUFFIX) else table_name
+
+    def is_partitioned(self, table_name):
+        """Tabela (ou sua staging) configurada em PARTITIONED_TABLES."""
+        return self.base_table(table_name) in PARTITIONED_TABLES
+
+    def relkind(self, table_name):
+        """relkind da tabela no catálogo ('r' heap, 'p' particionada, None = inexistente)."""
+        s_quoted, t_quoted, _, _ = self.connector._split_table(table_name)
+        with self.connector.engine.connect() as conn:
+            return conn.execute(text("SELECT relkind FROM pg_class WHERE oid = to_regclass(:rel)"),
+                                {"rel": f"{s_quoted}.{t_quoted}"}).scalar()
+
+    def partition_index_ddl(self, table_name, columns):
+        """Índices do pai particionado (propagados a cada partição); nomes iguais aos de create_indexes.py."""
+        s_quoted, t_quoted, _, t_raw = self.connector._split_table(table_name)
+        cnpj_col = 'cnpj_fundo' if 'cnpj_fundo' in columns else ('cnpj_fundo_classe' if 'cnpj_fundo_classe' in columns else None)
+        ddl = []
+        if cnpj_col:
+            ddl.append(f'CREATE INDEX IF NOT EXISTS "idx_{t_raw}_cnpj_dt" ON {s_quoted}.{t_quoted} ({cnpj_col}, {PARTITION_KEY});')
+        if 'cnpj_fundo_cota' in columns:
+            ddl.append(f'CREATE INDEX IF NOT EXISTS "idx_{t_raw}_inv" ON {s_quoted}.{t_quoted} (cnpj_fundo_cota, {PARTITION_KEY});')
+        return ddl
+
+    def create_partitioned_table(self, df, table_name):
+        """
+        (Re)cria a tabela particionada: colunas inferidas do DataFrame (como em create_table),
+        dt_comptc DATE, PK (__id, dt_comptc) e partição default. Meses são criados na carga.
+        """
+        s_quoted, t_quoted, s_raw, t_raw = self.connector._split_table(table_name)
+        tmpl = f"{t_raw}__tmpl"
+        unlogged = "UNLOGGED " if table_name in self.fresh_tables else ""
+        with self.connector.engine.begin() as conn:
+            print(f"  [DB_SYNC] Criando/Resetando tabela particionada {table_name}")
+            conn.execute(text(f"DROP TABLE IF EXISTS {s_quoted}.{t_quoted} CASCADE;"))
+            df.head(0).to_sql(tmpl, conn, schema=s_raw, if_exists='replace', index=False,
+                              dtype=to_sql_dtypes(self.declared(table_name, df.columns)))
+            conn.execute(text(f'ALTER TABLE {s_quoted}."{tmpl}" ALTER COLUMN {PARTITION_KEY} TYPE DATE USING {PARTITION_KEY}::DATE;'))
+            conn.execute(text(f'CREATE TABLE {s_quoted}.{t_quoted} (LIKE {s_quoted}."{tmpl}") PARTITION BY RANGE ({PARTITION_KEY});'))
+            conn.execute(text(f'DROP TABLE {s_quoted}."{tmpl}";'))
+            conn.execute(text(f"ALTER TABLE {s_quoted}.{t_quoted} ADD COLUMN __id SERIAL;"))
+            conn.execute(text(f'ALTER TABLE {s_quoted}.{t_quoted} ADD CONSTRAINT "{t_raw}_pkey" PRIMARY KEY (__id, {PARTITION_KEY});'))
+            conn.execute(text(f'CREATE {unlogged}TABLE {s_quoted}."{t_raw}_pdefault" PARTITION OF {s_quoted}.{t_quoted} DEFAULT;'))
+            # Staging: índices só no fim (finish_staging), depois da carga
+            if table_name not in self.fresh_tables:
+                for ddl in self.partition_index_ddl(table_name, df.columns):
+                    conn.execute(text(ddl))
+        self.schema_cache.pop(table_name, None)
+        self.partition_cache[table_name] = set()
+
+    def partitions(self, table_name, conn):
+        """Meses (AAAAMM) que já têm partição; catálogo consultado uma vez por tabela."""
+        if table_name not in self.partition_cache:
+            s_quoted, t_quoted, _, t_raw = self.connector._split_table(table_name)
+            names = conn.execute(text("""
+                SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+                WHERE i.inhparent = CAST(:rel AS regclass)
+            """), {"rel": f"{s_quoted}.{t_quoted}"}).scalars().all()
+            prefix = f"{t_raw}_p"
+            self.partition_cache[table_name] = {n[len(prefix):] for n in names if n.startswith(prefix) and n[len(prefix):].isdigit()}
+        return self.partition_cache[table_name]
+
+    def ensure_partitions(self, table_name, months, conn):
+        """Cria (na transação `conn`) as partições mensais que faltam para `months` (AAAAMM)."""
+        if not self.is_partitioned(table_name) or not months: return
+        known = self.partitions(table_name, conn)
+        missing = sorted(set(months) - known)
+        if not missing: return
+
+        # O cache já vê as partições novas (chunks seguintes da mesma transação não as recriam);
+        # se a transação for desfeita elas somem, e o cache da tabela é descartado junto
+        event.listen(conn, 'rollback', lambda _conn: self.partition_cache.pop(table_name, None))
+
+        s_quoted, t_quoted, _, t_raw = self.connector._split_table(table_name)
+        default = f'{s_quoted}."{t_raw}_pdefault"'
+        unlogged = "UNLOGGED " if table_name in self.fresh_tables else ""
+        for yyyymm in missing:
+            lo, hi = _month_bounds(yyyymm)
+            part = f'{s_quoted}."{t_raw}_p{yyyymm}"'
+            rng = {"lo": lo, "hi": hi}
+            stuck = conn.execute(text(f"SELECT EXISTS (SELECT FROM {default} WHERE {PARTITION_KEY} >= :lo AND {PARTITION_KEY} < :hi)"), rng).scalar()
+            if stuck:
+                # Linhas do mês caíram na default antes da partição existir: move para a partição nova
+                conn.execute(text(f"ALTER TABLE {s_quoted}.{t_quoted} DETACH PARTITION {default};"))
+                conn.execute(text(f"CREATE {unlogged}TABLE {part} PARTITION OF {s_quoted}.{t_quoted} FOR VALUES FROM ('{lo}') TO ('{hi}');"))
+                conn.execute(text(f"INSERT INTO {part} SELECT * FROM {default} WHERE {PARTITION_KEY} >= :lo AND {PARTITION_KEY} < :hi"), rng)
+                conn.execute(text(f"DELETE FROM {default} WHERE {PARTITION_KEY} >= :lo AND {PARTITION_KEY} < :hi"), rng)
+                conn.execute(text(f"ALTER TABLE {s_quoted}.{t_quoted} ATTACH PARTITION {default} DEFAULT;"))
+            else:
+                conn.execute(text(f"CREATE {unlogged}TABLE {part} PARTITION OF {s_quoted}.{t_quoted} FOR VALUES FROM ('{lo}') TO ('{hi}');"))
+            known.add(yyyymm)
+        print(f"  [PARTICAO] {table_name}: {len(missing)} partições mensais criadas ({missing[0]}..{missing[-1]})")
+
+    def run_partition(self):
+        """Converte as tabelas de PARTITIONED_TABLES que ainda são heap únicas (via staging + swap)."""
+        print("--- MODO PARTITION (HEAP -> PARTIÇÕES MENSAIS) ---")
+        for table_name in sorted(PARTITIONED_TABLES):
+            relkind = self.relkind(table_name)
+            if relkind != 'r':
+                print(f"  [PARTICAO] {table_name}: {'já particionada' if relkind == 'p' else 'inexistente'}, pulando.")
+                continue
+            print(f"  [PARTICAO] Convertendo {table_name}...")
+            stg_name = self.begin_staging(table_name, [])
+            self.finish_staging(stg_name, table_name)
+
+    # ==========================================
+    # STAGING + TROCA ATÔMICA
+    # ==========================================
+
+    def staged_name(self, name, t_raw):
+        """Nome do objeto na staging; swap_table desfaz a troca depois do rename."""
+        staged = name.replace(t_raw, f"{t_raw}{STAGING_SUFFIX}") if t_raw in name else f"{name}{STAGING_SUFFIX}"
+        return staged[:63]
+
+    def begin_staging(self, table_name, reload_files):
+        """
+        Cria "<tabela>__stg" UNLOGGED com as linhas atuais que NÃO vêm dos arquivos recarregados.
+        Em full_clean (ou tabela inexistente) a staging nasce vazia, criada pelo primeiro arquivo.
+        Tabela já particionada usa begin_partition_staging (sem copiar a tabela inteira).
+        """
+        s_quoted, t_quoted, s_raw, t_raw = self.connector._split_table(table_name)
+        stg_raw = f"{t_raw}{STAGING_SUFFIX}"
+        stg_name = f"{s_raw}.{stg_raw}"
+        self.schema_cache.pop(stg_name, None)
+        self.fresh_tables.add(stg_name)
+        schema = self.table_schema(table_name)
+
+        with self.connector.engine.begin() as conn:
+            conn.execute(text(f'DROP TABLE IF EXISTS {s_quoted}."{stg_raw}" CASCADE;'))
+            if self.full_clean or not schema:
+                return stg_name
+
+            # LIKE sem INCLUDING DEFAULTS: o __id ganha sequence própria (a da tabela antiga morre com ela)
+            partitioned = self.is_partitioned(table_name) and PARTITION_KEY in schema
+            if partitioned:
+                # Pai particionado (dt_comptc DATE, mesmo se a atual ainda for heap com TEXT) + partições UNLOGGED
+                tmpl = f'{s_quoted}."{t_raw}__tmpl"'
+                conn.execute(text(f'DROP TABLE IF EXISTS {tmpl};'))
+                conn.execute(text(f'CREATE TABLE {tmpl} (LIKE {s_quoted}.{t_quoted});'))
+                if schema[PARTITION_KEY] != 'date':
+                    conn.execute(text(f'ALTER TABLE {tmpl} ALTER COLUMN {PARTITION_KEY} TYPE DATE USING {PARTITION_KEY}::DATE;'))
+                conn.execute(text(f'CREATE TABLE {s_quoted}."{stg_raw}" (LIKE {tmpl}) PARTITION BY RANGE ({PARTITION_KEY});'))
+                conn.execute(text(f'DROP TABLE {tmpl};'))
+                conn.execute(text(f'CREATE UNLOGGED TABLE {s_quoted}."{stg_raw}_pdefault" PARTITION OF {s_quoted}."{stg_raw}" DEFAULT;'))
+                self.partition_cache[stg_name] = set()
+                lo, hi = conn.execute(text(f"""
+                    SELECT to_char(MIN({PARTITION_KEY}::DATE), 'YYYYMM'), to_char(MAX({PARTITION_KEY}::DATE), 'YYYYMM')
+                    FROM {s_quoted}.{t_quoted}
+                """)).fetchone()
+                if lo:
+                    months, (y, m) = [], (int(lo[:4]), int(lo[4:]))
+                    while f"{y}{m:02d}" <= hi:
+                        months.append(f"{y}{m:02d}")
+                        y, m = (y + 1, 1) if m == 12 else (y, m + 1)
+                    self.ensure_partitions(stg_name, months, conn)
+            else:
+                conn.execute(text(f'CREATE UNLOGGED TABLE {s_quoted}."{stg_raw}" (LIKE {s_quoted}.{t_quoted});'))
+            if '__id' in schema:
+                seq = f'{s_quoted}."{stg_raw}___id_seq"'
+                conn.execute(text(f'CREATE SEQUENCE {seq} OWNED BY {s_quoted}."{stg_raw}".__id;'))
+                conn.execute(text(f"""ALTER TABLE {s_quoted}."{stg_raw}" ALTER COLUMN __id SET DEFAULT nextval('{seq}');"""))
+
+            print(f"  [STAGING] Copiando linhas mantidas de {table_name}...")
+            cols = ", ".join(f'"{c}"' for c in schema)
+            select = ", ".join(f'"{c}"::DATE' if partitioned and c == PARTITION_KEY else f'"{c}"' for c in schema)
+            conn.execute(text(f"""
+                INSERT INTO {s_quoted}."{stg_raw}" ({cols})
+                SELECT {select} FROM {s_quoted}.{t_quoted}
+                WHERE __file IS NULL OR __file <> ALL(:files)
+            """), {"files": list(reload_files)})
+            if '__id' in schema:
+                conn.execute(text(f"""SELECT setval('{seq}', COALESCE(MAX(__id), 0) + 1, false) FROM {s_quoted}."{stg_raw}";"""))
+        return stg_name
+
+    def finish_staging(self, stg_name, table_name):
+        """PK + índices da tabela final construídos na staging, SET LOGGED, ANALYZE e troca atômica."""
+        s_quoted, t_quoted, s_raw, t_raw = self.connector._split_table(table_name)
+        _, stg_quoted, _, stg_raw = self.connector._split_table(stg_name)
+
+        # Schema lido antes da transação: table_schema abre outra conexão, e com
+        # pool_size=1 (workers paralelos) ela esperaria a do begin() até o timeout do pool
+        stg_schema = self.table_schema(stg_name)
+        partitioned = self.is_partitioned(stg_name) and PARTITION_KEY in stg_schema
+
+        with self.connector.engine.begin() as conn:
+            has_pk = conn.execute(text("""
+                SELECT EXISTS (SELECT FROM pg_constraint WHERE conrelid = CAST(:rel AS regclass) AND contype = 'p')
+            """), {"rel": f"{s_quoted}.{stg_quoted}"}).scalar()
+            if not has_pk and '__id' in stg_schema:
+                pk_cols = f"__id, {PARTITION_KEY}" if partitioned else "__id"
+                conn.execute(text(f'ALTER TABLE {s_quoted}.{stg_quoted} ADD CONSTRAINT "{stg_raw}_pkey" PRIMARY KEY ({pk_cols});'))
+            if partitioned:
+                for ddl in self.partition_index_ddl(stg_name, stg_schema):
+                    conn.execute(text(ddl))
+
+            indexes = conn.execute(text("""
+                SELECT i.indexname, i.indexdef
+                FROM pg_indexes i
+                WHERE i.schemaname = :s AND i.tablename = :t
+                  AND NOT EXISTS (SELECT FROM pg_constraint c WHERE c.conname = i.indexname AND c.contype = 'p')
+            """), {"s": s_raw, "t": t_raw}).fetchall()
+            for name, indexdef in indexes:
+                m = re.match(r'^(CREATE (?:UNIQUE )?INDEX) \S+ ON (?:ONLY )?\S+ (USING .*)$', indexdef)
+                if not m: continue
+                print(f"  [STAGING] Índice {name}")
+                conn.execute(text(f'{m.group(1)} IF NOT EXISTS "{self.staged_name(name, t_raw)}" ON {s_quoted}.{stg_quoted} {m.group(2)}'))
+
+            # Particionada: o pai não tem storage, quem vira LOGGED são as partições
+            parts = conn.execute(text("""
+                SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+                WHERE i.inhparent = CAST(:rel AS regclass) AND c.relpersistence = 'u'
+            """), {"rel": f"{s_quoted}.{stg_quoted}"}).scalars().all()
+            for part in parts:
+                conn.execute(text(f'ALTER TABLE {s_quoted}."{part}" SET LOGGED;'))
+            if not partitioned:
+                conn.execute(text(f"ALTER TABLE {s_quoted}.{stg_quoted} SET LOGGED;"))
+            conn.execute(text(f"ANALYZE {s_quoted}.{stg_quoted};"))
+
+        self.connector.swap_table(stg_name, table_name, STAGING_SUFFIX)
+        self.fresh_tables.discard(stg_name)
+        self.schema_cache[table_name] = self.schema_cache.pop(stg_name, {})
+        self.partition_cache.pop(table_name, None)
+        self.partition_cache.pop(stg_name, None)
+        print(f"  [SWAP] {table_name} substituída")
+
+    def begin_partition_staging(self, table_name):
+        """
+        Cria "<tabela>__stg" particionada e vazia, com as colunas da final: recebe só as linhas
+        dos arquivos recarregados. O __id sai da sequence da final, então as linhas novas não
+        colidem com as mantidas quando os meses forem montados (finish_partition_staging).
+        """
+        s_quoted, t_quoted, s_raw, t_raw = self.connector._split_table(table_name)
+        stg_raw = f"{t_raw}{STAGING_SUFFIX}"
+        stg_name = f"{s_raw}.{stg_raw}"
+        stg = f'{s_quoted}."{stg_raw}"'
+        self.schema_cache.pop(stg_name, None)
+        self.fresh_tables.add(stg_name)
+
+        with self.connector.engine.begin() as conn:
+            seq = conn.execute(text("SELECT pg_get_serial_sequence(:rel, '__id')"),
+                               {"rel": f"{s_quoted}.{t_quoted}"}).scalar()
+            conn.execute(text(f'DROP TABLE IF EXISTS {stg} CASCADE;'))
+            conn.execute(text(f'CREATE TABLE {stg} (LIKE {s_quoted}.{t_quoted}) PARTITION BY RANGE ({PARTITION_KEY});'))
+            conn.execute(text(f'CREATE UNLOGGED TABLE {s_quoted}."{stg_raw}_pdefault" PARTITION OF {stg} DEFAULT;'))
+            if seq:
+                conn.execute(text(f"ALTER TABLE {stg} ALTER COLUMN __id SET DEFAULT nextval('{seq}');"))
+        self.partition_cache[stg_name] = set()
+        return stg_name
+
+    def finish_partition_staging(self, stg_name, table_name, reload_files):
+        """
+        Troca só os meses tocados pelos arquivos recarregados (meses com linhas novas + meses que
+        o nome dos arquivos cobre). Cada mês é montado numa tabela avulsa "<tabela>_pAAAAMM__stg"
+        (linhas mantidas da partição atual + linhas novas do mês), com PK, índices do pai e CHECK
+        dos limites, e trocado numa transação curta: drop da partição antiga + ATTACH da nova
+        (como replace_month em data/project_ativos_carteira.py). O pai não é recriado, então as
+        views dependentes ficam intactas. Se falhar no meio, os meses já trocados estão corretos e
+        o manifesto não é gravado: a próxima execução recarrega os mesmos arquivos.
+        """
+        s_quoted, t_quoted, s_raw, t_raw = self.connector._split_table(table_name)
+        _, _, _, stg_raw = self.connector._split_table(stg_name)
+        files = {"files": list(reload_files)}
+
+        # Colunas novas e conversões feitas na staging durante a carga valem também para a final
+        stg_schema = dict(self.table_schema(stg_name))
+        schema = self.table_schema(table_name)
+        changed = {c: t for c, t in stg_schema.items() if c in schema and schema[c] != t}
+        self.alter_columns(table_name,
+                           add={c: t for c, t in stg_schema.items() if c not in schema},
+                           widen=[c for c, t in changed.items() if t == 'text'],
+                           retype={c: t for c, t in changed.items() if t != 'text'})
+        diverge = [c for c, t in stg_schema.items() if self.table_schema(table_name).get(c) != t]
+        if diverge:
+            raise ValueError(f"tipos divergentes entre {stg_name} e {table_name}: {diverge}")
+        cols = ", ".join(f'"{c}"' for c in stg_schema)
+
+        with self.connector.engine.connect() as conn:
+            new_months = set(self.partitions(stg_name, conn))
+            old_months = set(self.partitions(table_name, conn))
+            pk = conn.execute(text("""
+                SELECT pg_get_constraintdef(oid) FROM pg_constraint
+                WHERE conrelid = CAST(:rel AS regclass) AND contype = 'p'
+            """), {"rel": f"{s_quoted}.{t_quoted}"}).scalar()
+            indexes = conn.execute(text("""
+                SELECT i.indexname, i.indexdef
+                FROM pg_indexes i
+                WHERE i.schemaname = :s AND i.tablename = :t
+                  AND NOT EXISTS (SELECT FROM pg_constraint c WHERE c.conname = i.indexname AND c.contype = 'p')
+            """), {"s": s_raw, "t": t_raw}).fetchall()
+        months = sorted(new_months | {m for f in reload_files for m in _file_months(f) if m in old_months})
+
+        # Mês novo ganha a partição (vazia, ou com as linhas que estavam na default) antes da troca
+        with self.connector.engine.begin() as conn:
+            self.ensure_partitions(table_name, sorted(new_months), conn)
+
+        for yyyymm in months:
+            lo, hi = _month_bounds(yyyymm)
+            final = f"{t_raw}_p{yyyymm}"
+            new_raw = f"{final}{STAGING_SUFFIX}"
+            new = f'{s_quoted}."{new_raw}"'
+            renames = []
+            with self.connector.engine.begin() as conn:
+                conn.execute(text(f"DROP TABLE IF EXISTS {new};"))
+                conn.execute(text(f"CREATE TABLE {new} (LIKE {s_quoted}.{t_quoted});"))
+                conn.execute(text(f"""
+                    INSERT INTO {new} ({cols}) SELECT {cols} FROM {s_quoted}."{final}"
+                    WHERE __file IS NULL OR __file <> ALL(:files)
+                """), files)
+                if yyyymm in new_months:
+                    conn.execute(text(f'INSERT INTO {new} ({cols}) SELECT {cols} FROM {s_quoted}."{stg_raw}_p{yyyymm}"'))
+                if pk:
+                    conn.execute(text(f'ALTER TABLE {new} ADD CONSTRAINT "{new_raw}_pkey" {pk};'))
+                    renames.append((f"{new_raw}_pkey", f"{final}_pkey"))
+                for name, indexdef in indexes:
+                    m = re.match(r'^(CREATE (?:UNIQUE )?INDEX) \S+ ON (?:ONLY )?\S+ (USING .*)$', indexdef)
+                    if not m: continue
+                    idx = f"{name}_p{yyyymm}"[:63 - len(STAGING_SUFFIX)]
+                    renames.append((f"{idx}{STAGING_SUFFIX}", idx))
+                    conn.execute(text(f'{m.group(1)} "{idx}{STAGING_SUFFIX}" ON {new} {m.group(2)}'))
+                conn.execute(text(f"""ALTER TABLE {new} ADD CONSTRAINT "{new_raw}_bounds" CHECK ({PARTITION_KEY} >= '{lo}' AND {PARTITION_KEY} < '{hi}');"""))
+
+            with self.connector.engine.begin() as conn:
+                conn.execute(text(f'DROP TABLE IF EXISTS {s_quoted}."{final}";'))
+                conn.execute(text(f"ALTER TABLE {s_quoted}.{t_quoted} ATTACH PARTITION {new} FOR VALUES FROM ('{lo}') TO ('{hi}');"))
+                conn.execute(text(f'ALTER TABLE {new} DROP CONSTRAINT "{new_raw}_bounds";'))
+                conn.execute(text(f'ALTER TABLE {new} RENAME TO "{final}";'))
+                for staged, name in renames:
+                    conn.execute(text(f'ALTER INDEX {s_quoted}."{staged}" RENAME TO "{name}";'))
+                conn.execute(text(f'ANALYZE {s_quoted}."{final}";'))
+
+        # Linhas sem data (partição default): troca direta, a default é pequena
+        with self.connector.engine.begin() as conn:
+            if conn.execute(text("SELECT to_regclass(:rel)"), {"rel": f'{s_quoted}."{t_raw}_pdefault"'}).scalar():
+                conn.execute(text(f'DELETE FROM {s_quoted}."{t_raw}_pdefault" WHERE __file = ANY(:files)'), files)
+            conn.execute(text(f'INSERT INTO {s_quoted}.{t_quoted} ({cols}) SELECT {cols} FROM {s_quoted}."{stg_raw}_pdefault"'))
+            conn.execute(text(f'DROP TABLE {s_quoted}."{stg_raw}" CASCADE;'))
+
+        self.fresh_tables.discard(stg_name)
+        self.schema_cache.pop(stg_name, None)
+        self.partition_cache.pop(stg_name, None)
+        print(f"  [SWAP] {table_name}: {len(months)} partições mensais substituídas")
+
+    def staging_load(self, table_name, files, on_file=None):
+        """
+        Recarga de uma tabela via staging: arquivos alterados entram na cópia e a tabela final
+        só muda no swap. Qualquer erro descarta a staging e mantém a tabela original intacta.
+        Tabela já particionada (fora do full_clean) troca só os meses recarregados.
+        """
+        changed = []
+        for file_path in files:
+            unchanged, fp = self.check_unchanged(file_path)
+            if unchanged:
+                print(f"  [SKIP] {source_name(file_path)} inalterado")
+                if on_file: on_file(file_path, 0)
+            else:
+                changed.append((file_path, fp))
+        if not changed: return 0
+
+        stg_name = None
+        loaded = []
+        reload_files = [source_name(f) for f, _ in changed]
+        by_partition = not self.full_clean and self.relkind(table_name) == 'p'
+        try:
+            if by_partition:
+                stg_name = self.begin_partition_staging(table_name)
+            else:
+                stg_name = self.begin_staging(table_name, reload_files)
+            for file_path, fp in changed:
+                rows = self.load_file(file_path, stg_name, fp)
+                loaded.append((file_path, fp, rows))
+                if on_file: on_file(file_path, rows)
+            if by_partition:
+                self.finish_partition_staging(stg_name, table_name, reload_files)
+            else:
+                self.finish_staging(stg_name, table_name)
+        except Exception as e:
+            print(f"  [STAGING] {table_name}: falhou ({str(e).splitlines()[0]}), tabela original mantida.")
+            if stg_name:
+                _, stg_quoted, s_raw, _ = self.connector._split_table(stg_name)
+                self.connector.execute_sql(f'DROP TABLE IF EXISTS "{s_raw}".{stg_quoted} CASCADE;')
+                self.fresh_tables.discard(stg_name)
+                self.schema_cache.pop(stg_name, None)
+                self.partition_cache.pop(stg_name, None)
+            return 0
+
+        for file_path, fp, rows in loaded:
+            self.record_manifest(fp, table_name, rows, file_path)
+        return sum(rows for _, _, rows in loaded)
+
+    def ingest_parallel(self, plan):
+        """
+        Modo paralelo: tabelas diferentes em processos diferentes, arquivos da mesma
+        tabela sempre em sequência (DELETE/ALTER/CREATE de uma tabela nunca concorrem).
+
+        As tabelas maiores (em bytes) são despachadas primeiro para encurtar o tempo total.
+        """
+        files_by_table = {}
+        for file_path, table_name in plan:
+            files_by_table.setdefault(table_name, []).append(file_path)
+        if not files_by_table: return
+
+        size = {t: sum(source_stat(f)[0] for f in fs) for t, fs in files_by_table.items()}
+        ordered = sorted(files_by_table, key=lambda t: -size[t])
+        total_files = len(plan)
+
+        print(f"--- MODO PARALELO: {len(ordered)} tabelas, {total_files} arquivos, {self.workers} workers/conexões ---")
+        manager = mp.Manager()
+        progress = manager.Queue()
+        start = time.time()
+        last_report = start
+        rows_done, files_done = 0, 0
+
+        def drain():
+            nonlocal rows_done, files_done
+            while True:
+                try:
+                    _, _, rows = progress.get_nowait()
+                except Empty:
+                    return
+                rows_done += rows
+                files_done += 1
+
+        with ProcessPoolExecutor(max_workers=self.workers) as pool:
+            pending = {
+                pool.submit(_ingest_table_worker, t, files_by_table[t], self.options, progress): t
+                for t in ordered
+            }
+            while pending:
+                done, _ = wait(pending, timeout=1, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    table_name = pending.pop(fut)
+                    try:
+                        _, table_rows = fut.result()
+                        print(f"  [OK] {table_name}: {table_rows:,} linhas")
+                    except Exception as e:
+                        print(f"  [ERROR] {table_name}: {e}")
+                drain()
+                now = time.time()
+                if now - last_report >= PROGRESS_INTERVAL or not pending:
+                    elapsed = now - start
+                    print(f"  [PROGRESSO] {files_done}/{total_files} arquivos | {rows_done:,} linhas | "
+                          f"{rows_done / elapsed:,.0f} linhas/s | {len(pending)} tabelas pendentes | {elapsed:.0f}s")
+                    last_report = now
+        manager.shutdown()
 
     def run_update_hot(self):
         print("--- MODO UPDATE HOT ---")
@@ -182,7 +1158,7 @@ class CVMIngestor:
 
     def run_specify(self, target_table, from_date=None):
         all_files = self.get_all_csvs(ROOT_DIR)
-        queue = [f for f in all_files if self.clean_table_name(os.path.relpath(os.path.dirname(f), ROOT_DIR), os.path.basename(f)) == target_table]
+        queue = [f for f in all_files if self.table_for(f) == target_table]
         self.ingest_list(queue, from_date=from_date)
 
     def run_complete_missing(self):
@@ -192,11 +1168,21 @@ class CVMIngestor:
         # Agrupar arquivos locais pelo nome da tabela que eles vão gerar
         files_by_table = {}
         for f_path in all_local_files:
-            t_name = self.clean_table_name(os.path.relpath(os.path.dirname(f_path), ROOT_DIR), os.path.basename(f_path))
+            t_name = self.table_for(f_path)
             if t_name:
                 files_by_table.setdefault(t_name, []).append(f_path)
 
+        # Tabelas que já têm manifesto: o próprio ingest_file pula os arquivos inalterados
+        self.ensure_manifest()
+        with self.connector.engine.connect() as conn:
+            managed = {r[0] for r in conn.execute(text(f"SELECT DISTINCT table_name FROM {MANIFEST_TABLE}"))}
+
+        # Acumula o que falta de todas as tabelas e ingere de uma vez (permite o modo paralelo)
+        missing = []
         for table_name, files in files_by_table.items():
+            if table_name in managed:
+                missing.extend(files)
+                continue
             s_quoted, t_quoted, s_raw, t_raw = self.connector._split_table(table_name)
             
             # Checar se tabela existe (em conexão isolada)
@@ -206,20 +1192,25 @@ class CVMIngestor:
                 
                 if not table_exists:
                     print(f"\n[NOVA TABELA] Criando {table_name} com {len(files)} arquivos...")
-                    self.ingest_list(files)
+                    missing.extend(files)
                 else:
-                    # Se existe, pegamos só o que falta
+                    # Tabela anterior ao manifesto: scan de __file uma única vez e registra o que já está carregado
                     with self.connector.engine.connect() as conn:
-                        existing = pd.read_sql(text(f"SELECT DISTINCT __file FROM {table_name}"), conn)['__file'].tolist()
-                    to_ingest = [f for f in files if os.path.basename(f) not in existing]
+                        existing = set(pd.read_sql(text(f"SELECT DISTINCT __file FROM {table_name}"), conn)['__file'].tolist())
+                    to_ingest = [f for f in files if source_name(f) not in existing]
+                    for f in files:
+                        if source_name(f) in existing:
+                            self.record_manifest(self.fingerprint(f), table_name, None)
                     
                     if to_ingest:
                         print(f"\n[ATUALIZANDO] {table_name}: {len(to_ingest)} novos arquivos encontrados.")
-                        self.ingest_list(to_ingest)
+                        missing.extend(to_ingest)
             except Exception as e:
                 print(f"  [ERROR] Pulo na tabela {table_name}: {str(e).splitlines()[0]}")
                 continue
 
+        self.ingest_list(missing)
+
     def run_full(self):
         queue = self.get_all_csvs(START_DIR)
         processed = set(queue)
@@ -233,17 +1224,28 @@ def main():
     group.add_argument('--specify', type=str)
     group.add_argument('--complete-missing', action='store_true')
     group.add_argument('--full', action='store_true', default=False)
+    group.add_argument('--partition', action='store_true',
+                       help="Converte inf_diario/cda_fi_blc_* existentes em partições mensais de dt_comptc")
     parser.add_argument('--from', dest='from_date', type=str)
+    parser.add_argument('--stream', action='store_true',
+                        help=f"Todos os arquivos via COPY streaming (padrão: só arquivos >= {STREAM_MIN_BYTES // 2**20} MB)")
+    parser.add_argument('--force', action='store_true',
+                        help="Ignora o manifesto (cvm.ingest_manifest) e recarrega mesmo arquivos inalterados")
+    parser.add_argument('--staging', action='store_true',
+                        help="Recarga via tabela staging UNLOGGED + troca atômica (sem DELETE WHERE __file)")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="Processos/conexões em paralelo (tabelas diferentes em paralelo; mesma tabela em sequência)")
 
     args = parser.parse_args()
     
     # Se nenhum argumento for passado, o padrão é o --full
-    is_full = args.full or not (args.update_hot or args.specify or args.complete_missing)
-    ingestor = CVMIngestor(full_clean=is_full)
+    is_full = args.full or not (args.update_hot or args.specify or args.complete_missing or args.partition)
+    ingestor = CVMIngestor(full_clean=is_full, workers=args.workers, stream=args.stream, force=args.force, staging=args.staging)
 
     if args.update_hot: ingestor.run_update_hot()
     elif args.specify: ingestor.run_specify(args.specify, from_date=args.from_date)
     elif args.complete_missing: ingestor.run_complete_missing()
+    elif args.partition: ingestor.run_partition()
     else: ingestor.run_full()
 
 if __name__ == "__main__":
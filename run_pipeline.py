@@ -1,51 +1,496 @@
+import argparse
+import ast
+import hashlib
+import os
+import socket
 import subprocess
 import sys
+import threading
 import time
-import os
+import uuid
+import statistics
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from datetime import date
+
+from sqlalchemy import text
+
+from common.postgresql import PostgresConnector
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# ==========================================
+# DAG DO PIPELINE
+# ==========================================
+# Cada etapa declara o script, as tabelas que lê (inputs) e as que escreve (outputs).
+# As dependências saem do grafo: uma etapa espera as que produzem os seus inputs.
+# - Etapas independentes rodam em paralelo (--workers).
+# - Etapa cujo script e inputs não mudaram desde a última execução bem-sucedida é pulada
+#   (watermark = hash do script e dos módulos do projeto que ele importa + estado dos inputs
+#   no catálogo/estatísticas do Postgres).
+# - daily=True: etapa que depende de fonte externa (BCB, Yahoo...) roda no máximo uma vez por dia.
+# - optional=True: só roda com --with-ingest (carga dos arquivos da CVM e cadastro).
+
+CDA_BLOCKS = [f"cvm.fi_doc_cda_fi_blc_{i}" for i in range(1, 9)]
+INF_DIARIO = "cvm.fi_doc_inf_diario_inf_diario_fi"
+CAD_HIST = ["cvm.fi_cad_fi"] + [f"cvm.fi_cad_fi_hist_{t}" for t in (
+    'admin', 'auditor', 'classe', 'condom', 'controlador', 'custodiante', 'denom_social', 'denom_comerc',
+    'diretor_resp', 'exclusivo', 'fic', 'gestor', 'publico_alvo', 'rentab', 'sit')]
+
+STAGES = [
+    {'name': 'ingest', 'script': 'dev/ingest_tables.py', 'args': ['--update-hot'], 'optional': True,
+     'inputs': [], 'outputs': [INF_DIARIO, 'cvm.fi_doc_cda_fi_pl'] + CDA_BLOCKS + CAD_HIST,
+     'description': "Ingesting CVM files (hot months)"},
+    {'name': 'cadastro', 'script': 'data/cvm.cadastro_update.py', 'optional': True,
+     'inputs': CAD_HIST, 'outputs': ['cvm.cadastro'],
+     'description': "Rebuilding fund registry (cvm.cadastro)"},
+    {'name': 'indices_cotas', 'script': 'data/indices_cotas.py', 'daily': True,
+     'inputs': [], 'outputs': ['middle.indices_cotas'],
+     'description': "Downloading benchmark indices (middle.indices_cotas)"},
+    {'name': 'depara_gestores', 'script': 'data/populate_depara_gestores.py',
+     'inputs': ['cvm.cadastro'], 'outputs': ['cvm.depara_gestores'],
+     'description': "Populating Manager Mapping (cvm.depara_gestores)"},
+    {'name': 'cliente_segmentado', 'script': 'data/cliente_segmentado.py',
+     'inputs': [], 'outputs': ['alocadores.cliente_segmentado'],
+     'description': "Loading client segmentation (alocadores.cliente_segmentado)"},
+    {'name': 'cotas', 'script': 'data/update_complex_views.py', 'args': ['--views', 'cotas'],
+     'inputs': [INF_DIARIO], 'outputs': ['cvm.cotas'],
+     'description': "Refreshing daily quotas view (cvm.cotas)"},
+    {'name': 'carteira', 'script': 'data/update_complex_views.py', 'args': ['--views', 'carteira'],
+     'inputs': ['cvm.cadastro', 'cvm.depara_gestores', 'alocadores.cliente_segmentado', 'cvm.fi_doc_cda_fi_blc_2'],
+     'outputs': ['cvm.carteira'],
+     'description': "Refreshing allocator portfolios view (cvm.carteira)"},
+    {'name': 'ativos_carteira', 'script': 'data/project_ativos_carteira.py',
+     'inputs': CDA_BLOCKS, 'outputs': ['cvm.ativos_carteira'],
+     'description': "Updating Portfolio Assets by Month (cvm.ativos_carteira)"},
+    {'name': 'peer', 'script': 'data/project_peer.py',
+     'inputs': ['cvm.cadastro'], 'outputs': ['cvm.peer'],
+     'description': "Classifying Fund Peers (cvm.peer)"},
+    {'name': 'metrics_perfil', 'script': 'data/project_metrics_perfil.py',
+     'inputs': ['cvm.cotas', 'middle.indices_cotas'], 'outputs': ['cvm.metrics_perfil'],
+     'description': "Materializing Fund Return Profiles (cvm.metrics_perfil)"},
+    {'name': 'metrics_prefixo', 'script': 'data/project_metrics_prefixo.py',
+     'inputs': ['cvm.cotas', 'middle.indices_cotas'], 'outputs': ['cvm.metrics_prefixo'],
+     'description': "Updating Fund Prefix-Sum Index (cvm.metrics_prefixo)"},
+    {'name': 'metrics', 'script': 'data/project_metrics2.py',
+     'inputs': ['cvm.cotas', 'middle.indices_cotas', 'cvm.fi_cad_fi_hist_classe'], 'outputs': ['cvm.metrics'],
+     'description': "Calculating Windowed Fund Metrics (cvm.metrics)"},
+    {'name': 'fluxo', 'script': 'data/calcular_fluxo_veiculos_v2.py',
+     'inputs': ['cvm.carteira', 'cvm.fi_doc_cda_fi_blc_2'],
+     'outputs': ['alocadores.fluxo_veiculos_historico', 'alocadores.fluxo_veiculos'],
+     'description': "Updating vehicle flows (alocadores.fluxo_veiculos)"},
+    {'name': 'allocator_tables', 'script': 'data/create_allocator_tables.py',
+     'inputs': ['cvm.carteira', 'cvm.cadastro', 'cvm.cotas', 'cvm.metrics'],
+     'outputs': ['alocadores.r_amostral_2', 'alocadores.r_apelidos', 'kinea.fundos', 'alocadores.r_fundos_kinea_metas',
+                 'alocadores.r_metrics', 'alocadores.r_mov_carteira_gestor_peer', 'alocadores.r_fluxo_peer',
+                 'alocadores.r_var_gestor_cota', 'alocadores.r_var_nm_fundo_cota'],
+     'description': "Creating Allocator Intelligence Tables (Phase 2)"},
+    # Lê via api.service (perfil, métricas, carteira): roda por último
+    {'name': 'caches', 'script': 'data/generate_cache_jsons.py',
+     'inputs': ['cvm.peer', 'cvm.cadastro', 'cvm.cotas', 'cvm.metrics_perfil', 'cvm.carteira', 'cvm.ativos_carteira'],
+     'outputs': [], 'after': ['allocator_tables'],
+     'description': "Generating Static JSON Cache (Phase 3)"},
+]
+
+STATE_TABLE = "cvm.pipeline_state"
+DDL_STATE = f"""
+CREATE TABLE IF NOT EXISTS {STATE_TABLE} (
+    stage VARCHAR PRIMARY KEY,
+    run_id VARCHAR,
+    status VARCHAR,
+    watermark VARCHAR,
+    started_at TIMESTAMP,
+    finished_at TIMESTAMP,
+    elapsed_s DOUBLE PRECISION
+);
+"""
+
+# Livro de execuções: uma linha por etapa executada (ou pulada), base do --compare
+LEDGER_TABLE = "cvm.pipeline_runs"
+DDL_LEDGER = f"""
+CREATE TABLE IF NOT EXISTS {LEDGER_TABLE} (
+    id BIGSERIAL PRIMARY KEY,
+    run_id VARCHAR,
+    stage VARCHAR,
+    status VARCHAR,
+    started_at TIMESTAMP,
+    finished_at TIMESTAMP,
+    elapsed_s DOUBLE PRECISION,
+    rows_read BIGINT,
+    rows_written BIGINT,
+    output_bytes BIGINT,
+    bytes_delta BIGINT,
+    peak_rss_mb DOUBLE PRECISION,
+    host VARCHAR
+);
+CREATE INDEX IF NOT EXISTS idx_pipeline_runs_stage ON {LEDGER_TABLE} (stage, finished_at);
+"""
+
+# Regressão: etapa mais lenta que a mediana das últimas COMPARE_WINDOW execuções bem-sucedidas
+# (mesmo host) por mais de COMPARE_THRESHOLD (0.5 = +50%); etapas abaixo de COMPARE_MIN_SECONDS são ignoradas
+COMPARE_WINDOW = 7
+COMPARE_THRESHOLD = 0.5
+COMPARE_MIN_SECONDS = 5.0
+
+# Estatísticas de uma relação (somadas nas partições): o oid muda em rebuild/swap, os contadores
+# de escrita/leitura em cargas e consultas (pg_stat, atualizados pelo Postgres de forma assíncrona)
+SQL_REL_STATS = """
+WITH RECURSIVE rel AS (
+    SELECT to_regclass(:rel)::oid AS oid
+    UNION ALL
+    SELECT i.inhrelid FROM pg_inherits i JOIN rel ON i.inhparent = rel.oid
+)
+SELECT to_regclass(:rel)::oid::bigint,
+       COALESCE(SUM(s.n_tup_ins + s.n_tup_upd + s.n_tup_del), 0),
+       COALESCE(SUM(COALESCE(s.seq_tup_read, 0) + COALESCE(s.idx_tup_fetch, 0)), 0),
+       COALESCE(SUM(pg_total_relation_size(rel.oid)), 0)
+FROM rel LEFT JOIN pg_stat_all_tables s ON s.relid = rel.oid
+WHERE rel.oid IS NOT NULL
+"""
+
+
+def build_graph(stages):
+    """{etapa: etapas das quais depende}, a partir de inputs/outputs (+ 'after')."""
+    producers = {}
+    for st in stages:
+        for out in st['outputs']:
+            producers.setdefault(out, set()).add(st['name'])
+    deps = {}
+    for st in stages:
+        deps[st['name']] = {p for inp in st['inputs'] for p in producers.get(inp, ()) if p != st['name']}
+        deps[st['name']] |= set(st.get('after', ()))
+    return deps
+
+
+def select_stages(stages, only=None, with_ingest=False):
+    """Etapas do plano: as de --only ou todas as não opcionais (+ opcionais com --with-ingest)."""
+    if only:
+        unknown = set(only) - {st['name'] for st in stages}
+        if unknown:
+            raise SystemExit(f"Etapas desconhecidas: {', '.join(sorted(unknown))}")
+        return [st for st in stages if st['name'] in only]
+    return [st for st in stages if with_ingest or not st.get('optional')]
+
+
+# ==========================================
+# WATERMARKS E ESTADO
+# ==========================================
+
+def script_hash(path):
+    with open(path, 'rb') as f:
+        return hashlib.md5(f.read()).hexdigest()
+
+
+def project_modules(path, found=None):
+    """
+    Arquivos .py do projeto importados pelo script, transitivamente (ex: common/metrics.py,
+    common/peer_classifier.py). Procura ao lado do arquivo (sys.path dos scripts) e na raiz;
+    bibliotecas instaladas não estão no projeto e ficam de fora.
+    """
+    found = set() if found is None else found
+    with open(path, 'rb') as f:
+        tree = ast.parse(f.read(), filename=path)
+    here = os.path.dirname(path)
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            candidates = [(root, a.name) for a in node.names for root in (here, BASE_DIR)]
+        elif isinstance(node, ast.ImportFrom):
+            if node.level:
+                base = here
+                for _ in range(node.level - 1):
+                    base = os.path.dirname(base)
+                roots = [base]
+            else:
+                roots = [here, BASE_DIR]
+            mods = [node.module] if node.module else []
+            mods += [f"{node.module}.{a.name}" if node.module else a.name for a in node.names]
+            candidates = [(root, m) for m in mods for root in roots]
+        else:
+            continue
+        for root, mod in candidates:
+            stem = os.path.join(root, *mod.split('.'))
+            for cand in (f"{stem}.py", os.path.join(stem, '__init__.py')):
+                cand = os.path.normpath(cand)
+                if os.path.isfile(cand) and cand not in found:
+                    found.add(cand)
+                    project_modules(cand, found)
+    return found
+
+
+def relation_stats(db, rels):
+    """{relação: (oid, linhas escritas, linhas lidas, bytes)} (contadores acumulados do pg_stat)."""
+    with db.engine.connect() as conn:
+        return {rel: tuple(conn.execute(text(SQL_REL_STATS), {"rel": rel}).fetchone()) for rel in rels}
+
+
+def stage_watermark(db, stage, stats=None):
+    """Hash do script/args e dos módulos do projeto que ele importa + estado de cada input (+ data, para etapas diárias)."""
+    script = os.path.normpath(os.path.join(BASE_DIR, stage['script']))
+    parts = [script_hash(script), ' '.join(stage.get('args', []))]
+    for module in sorted(project_modules(script) - {script}):
+        parts.append(f"{os.path.relpath(module, BASE_DIR)}:{script_hash(module)}")
+    stats = stats or relation_stats(db, stage['inputs'])
+    for rel in stage['inputs']:
+        oid, writes = stats[rel][:2]
+        parts.append(f"{rel}:{oid}:{writes}")
+    if stage.get('daily'):
+        parts.append(date.today().isoformat())
+    return hashlib.md5('|'.join(parts).encode()).hexdigest()
+
+
+def load_state(db):
+    rows = db.read_sql(f"SELECT stage, run_id, status, watermark, finished_at FROM {STATE_TABLE}")
+    return {r['stage']: r for r in rows.to_dict('records')}
+
+
+def save_state(db, stage, run_id, status, watermark, started, elapsed):
+    """Grava o resultado da etapa. Falha não apaga o watermark do último sucesso."""
+    with db.engine.begin() as conn:
+        conn.execute(text(f"""
+            INSERT INTO {STATE_TABLE} (stage, run_id, status, watermark, started_at, finished_at, elapsed_s)
+            VALUES (:stage, :run_id, :status, :watermark, to_timestamp(:started), NOW(), :elapsed)
+            ON CONFLICT (stage) DO UPDATE SET
+                run_id = EXCLUDED.run_id, status = EXCLUDED.status,
+                watermark = COALESCE(EXCLUDED.watermark, {STATE_TABLE}.watermark),
+                started_at = EXCLUDED.started_at, finished_at = EXCLUDED.finished_at, elapsed_s = EXCLUDED.elapsed_s
+        """), {"stage": stage, "run_id": run_id, "status": status, "watermark": watermark,
+               "started": started, "elapsed": elapsed})
+
+
+def io_delta(stage, before, after):
+    """Linhas lidas dos inputs, escritas nos outputs, tamanho final e variação dos outputs.
+    Aproximado: etapas em paralelo que tocam as mesmas tabelas somam nos contadores umas das outras."""
+    rows_read = sum(after[r][2] - before[r][2] for r in stage['inputs'])
+    rows_written = sum(after[r][1] - before[r][1] if after[r][0] == before[r][0] else after[r][1]
+                       for r in stage['outputs'])
+    output_bytes = sum(after[r][3] for r in stage['outputs'])
+    bytes_delta = output_bytes - sum(before[r][3] for r in stage['outputs'])
+    return dict(rows_read=rows_read, rows_written=rows_written, output_bytes=output_bytes, bytes_delta=bytes_delta)
+
+
+def record_ledger(db, run_id, stage, status, started, elapsed, io=None, peak_rss_mb=None):
+    params = dict(rows_read=None, rows_written=None, output_bytes=None, bytes_delta=None, **(io or {}))
+    params.update(run_id=run_id, stage=stage, status=status, started=started, elapsed=elapsed,
+                  peak_rss_mb=peak_rss_mb, host=socket.gethostname())
+    with db.engine.begin() as conn:
+        conn.execute(text(f"""
+            INSERT INTO {LEDGER_TABLE} (run_id, stage, status, started_at, finished_at, elapsed_s, rows_read,
+                                        rows_written, output_bytes, bytes_delta, peak_rss_mb, host)
+            VALUES (:run_id, :stage, :status, to_timestamp(:started), NOW(), :elapsed, :rows_read,
+                    :rows_written, :output_bytes, :bytes_delta, :peak_rss_mb, :host)
+        """), params)
+
+
+def resume_run_id(state):
+    """run_id da execução mais recente que terminou com falha (None se não há)."""
+    failed = [s for s in state.values() if s['status'] == 'failed']
+    if not failed:
+        return None
+    return max(failed, key=lambda s: s['finished_at'])['run_id']
+
+
+# ==========================================
+# EXECUÇÃO
+# ==========================================
+
+_print_lock = threading.Lock()
+
+
+def run_step(stage):
+    """
+    Executa o script da etapa (mesmo interpretador), prefixando cada linha da saída com o nome.
+    Retorna (código de saída, pico de RSS do processo em MB; None onde não há os.wait4, ex: Windows).
+    """
+    cmd = [sys.executable, os.path.join(BASE_DIR, stage['script'])] + stage.get('args', [])
+    env = dict(os.environ, PYTHONUNBUFFERED='1',
+               PYTHONPATH=os.pathsep.join(filter(None, [BASE_DIR, os.environ.get('PYTHONPATH')])))
+    proc = subprocess.Popen(cmd, cwd=BASE_DIR, env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                            text=True, errors='replace')
+    for line in proc.stdout:
+        with _print_lock:
+            print(f"[{stage['name']}] {line.rstrip()}", flush=True)
+    if not hasattr(os, 'wait4'):
+        return proc.wait(), None
+    # wait4 devolve o rusage só deste filho (ru_maxrss em KB no Linux)
+    _, status, usage = os.wait4(proc.pid, 0)
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    return proc.returncode, usage.ru_maxrss / 1024
+
+
+def run_pipeline(stages, workers=4, force=False, resume=False):
+    db = PostgresConnector()
+    db.execute_sql(DDL_STATE)
+    db.execute_sql(DDL_LEDGER)
+    state = load_state(db)
+
+    names = {st['name'] for st in stages}
+    by_name = {st['name']: st for st in stages}
+    # Dependências fora do plano (ex: --only) são tratadas como satisfeitas
+    deps = {n: d & names for n, d in build_graph(STAGES).items() if n in names}
+
+    run_id = resume_run_id(state) if resume else None
+    if resume and run_id is None:
+        print("Nenhuma execução com falha para retomar; executando normalmente.")
+    run_id = run_id or time.strftime('%Y%m%d_%H%M%S_') + uuid.uuid4().hex[:6]
+    print(f"Pipeline run {run_id}: {len(stages)} etapas, até {workers} em paralelo")
+
+    report = {}      # etapa -> (status, segundos)
+    done, failed = set(), set()
+    pending = set(names)
+    running = {}
+    wall_start = time.time()
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        while pending or running:
+            progressed = False
+            for n in sorted(pending):
+                if any(d in failed or report.get(d, ('',))[0] == 'blocked' for d in deps[n]):
+                    report[n] = ('blocked', 0.0)
+                    pending.discard(n)
+                    progressed = True
+                    continue
+                if not deps[n] <= done or len(running) >= workers:
+                    continue
+                pending.discard(n)
+                progressed = True
+                prev = state.get(n, {})
+                if resume and prev.get('run_id') == run_id and prev.get('status') in ('success', 'skipped'):
+                    report[n] = ('resumed', 0.0)
+                    done.add(n)
+                    continue
+                stage = by_name[n]
+                before = relation_stats(db, set(stage['inputs']) | set(stage['outputs']))
+                wm = stage_watermark(db, stage, before)
+                if not force and prev.get('status') in ('success', 'skipped') and prev.get('watermark') == wm:
+                    print(f"[{n}] script e inputs inalterados, pulando.")
+                    save_state(db, n, run_id, 'skipped', wm, time.time(), 0.0)
+                    record_ledger(db, run_id, n, 'skipped', time.time(), 0.0)
+                    report[n] = ('skipped', 0.0)
+                    done.add(n)
+                    continue
+                with _print_lock:
+                    print(f"\n{'='*50}\nSTEP: {by_name[n]['description']}\nSCRIPT: {by_name[n]['script']}\n{'='*50}")
+                running[pool.submit(run_step, stage)] = (n, wm, time.time(), before)
+
+            if not running:
+                if pending and not progressed:
+                    raise SystemExit(f"Dependência circular entre: {', '.join(sorted(pending))}")
+                continue
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for fut in finished:
+                n, wm, started, before = running.pop(fut)
+                elapsed = time.time() - started
+                try:
+                    rc, peak_rss_mb = fut.result()
+                except Exception as e:
+                    print(f"[{n}] [CRITICAL] {e}")
+                    rc, peak_rss_mb = -1, None
+                status = 'success' if rc == 0 else 'failed'
+                io = io_delta(by_name[n], before, relation_stats(db, before.keys()))
+                if rc == 0:
+                    print(f"[{n}] [SUCCESS] concluída em {elapsed:.2f}s ({io['rows_written']} linhas escritas)")
+                    done.add(n)
+                else:
+                    print(f"[{n}] [ERROR] falhou com código {rc} após {elapsed:.2f}s")
+                    failed.add(n)
+                save_state(db, n, run_id, status, wm if rc == 0 else None, started, elapsed)
+                record_ledger(db, run_id, n, status, started, elapsed, io, peak_rss_mb)
+                report[n] = (status, elapsed)
+
+    print_report(stages, report, time.time() - wall_start, run_id)
+    compare_runs(db, run_id)
+    return not failed
+
+
+def print_report(stages, report, wall, run_id):
+    print("\n" + "=" * 50)
+    print(f"RELATÓRIO DO PIPELINE ({run_id})")
+    print("=" * 50)
+    for st in stages:
+        status, elapsed = report.get(st['name'], ('-', 0.0))
+        print(f"  {st['name']:<20} {status:<8} {elapsed:>9.2f}s")
+    total = sum(e for _, e in report.values())
+    print(f"  {'wall clock':<20} {'':<8} {wall:>9.2f}s (soma das etapas: {total:.2f}s)")
+
+
+def compare_runs(db, run_id=None, window=COMPARE_WINDOW, threshold=COMPARE_THRESHOLD):
+    """
+    Compara cada etapa da execução `run_id` (padrão: a última) com a mediana das `window`
+    execuções bem-sucedidas anteriores no mesmo host. Retorna as etapas acima do limite.
+    """
+    if run_id is None:
+        run_id = db.read_sql(f"SELECT run_id FROM {LEDGER_TABLE} WHERE status = 'success' "
+                             f"ORDER BY finished_at DESC LIMIT 1")['run_id'].tolist()
+        if not run_id:
+            print("Ledger vazio.")
+            return []
+        run_id = run_id[0]
+    df = db.read_sql(f"""
+        SELECT h.run_id, h.stage, h.elapsed_s, h.rows_written, h.peak_rss_mb, h.finished_at
+        FROM {LEDGER_TABLE} h
+        JOIN (SELECT stage, host, MAX(finished_at) AS ate FROM {LEDGER_TABLE}
+              WHERE run_id = '{run_id}' AND status = 'success' GROUP BY stage, host) r
+          ON r.stage = h.stage AND r.host = h.host AND h.finished_at <= r.ate
+        WHERE h.status = 'success'
+        ORDER BY h.stage, h.finished_at DESC
+    """)
+    if df.empty:
+        return []
+
+    print(f"\nCOMPARAÇÃO COM A MEDIANA DAS ÚLTIMAS {window} EXECUÇÕES ({run_id}, limite +{threshold:.0%})")
+    regressions = []
+    for stage, grp in df.groupby('stage', sort=False):
+        atual = grp[grp['run_id'] == run_id].iloc[0]
+        historico = grp[grp['run_id'] != run_id]['elapsed_s'].head(window).tolist()
+        if not historico:
+            print(f"  {stage:<20} {atual['elapsed_s']:>9.2f}s   (sem histórico)")
+            continue
+        mediana = statistics.median(historico)
+        ratio = atual['elapsed_s'] / mediana if mediana else float('inf')
+        slow = atual['elapsed_s'] >= COMPARE_MIN_SECONDS and ratio > 1 + threshold
+        flag = "  <-- REGRESSÃO" if slow else ""
+        print(f"  {stage:<20} {atual['elapsed_s']:>9.2f}s   mediana {mediana:>9.2f}s   {ratio:>5.2f}x{flag}")
+        if slow:
+            regressions.append((stage, atual['elapsed_s'], mediana))
+    return regressions
 
-def run_step(script_path, description):
-    print(f"\n{'='*50}")
-    print(f"STEP: {description}")
-    print(f"SCRIPT: {script_path}")
-    print(f"{'='*50}\n")
-    
-    start_time = time.time()
-    try:
-        # Use sys.executable to ensure we use the same python interpreter
-        result = subprocess.run([sys.executable, script_path], check=True, text=True)
-        elapsed = time.time() - start_time
-        print(f"\n[SUCCESS] {description} completed in {elapsed:.2f} seconds.")
-    except subprocess.CalledProcessError as e:
-        print(f"\n[ERROR] {description} failed with exit code {e.returncode}.")
-        sys.exit(1)
-    except Exception as e:
-        print(f"\n[CRITICAL] Error executing {description}: {e}")
-        sys.exit(1)
 
 def main():
+    parser = argparse.ArgumentParser(description="Executa o pipeline do Financial Data Lab (DAG de etapas)")
+    parser.add_argument('--workers', type=int, default=4, help="Etapas independentes em paralelo")
+    parser.add_argument('--only', type=str, default=None, help="Etapas a executar (separadas por vírgula)")
+    parser.add_argument('--with-ingest', action='store_true', help="Inclui a carga dos arquivos da CVM e o cadastro")
+    parser.add_argument('--force', action='store_true', help="Ignora os watermarks e executa todas as etapas")
+    parser.add_argument('--resume', action='store_true',
+                        help="Retoma a última execução com falha: etapas já concluídas nela não rodam de novo")
+    parser.add_argument('--list', action='store_true', help="Lista as etapas e suas dependências")
+    parser.add_argument('--compare', nargs='?', const='', default=None, metavar='RUN_ID',
+                        help="Compara uma execução (padrão: a última) com a mediana das anteriores e sai "
+                             "com código 2 se alguma etapa regrediu")
+    parser.add_argument('--window', type=int, default=COMPARE_WINDOW, help="Execuções anteriores na mediana")
+    parser.add_argument('--threshold', type=float, default=COMPARE_THRESHOLD,
+                        help="Folga sobre a mediana antes de acusar regressão (0.5 = +50%%)")
+    args = parser.parse_args()
+
+    if args.compare is not None:
+        db = PostgresConnector()
+        db.execute_sql(DDL_LEDGER)
+        regressions = compare_runs(db, args.compare or None, args.window, args.threshold)
+        sys.exit(2 if regressions else 0)
+
+    stages = select_stages(STAGES, args.only.split(',') if args.only else None, args.with_ingest)
+    if args.list:
+        deps = build_graph(STAGES)
+        for st in stages:
+            print(f"{st['name']:<20} <- {', '.join(sorted(deps[st['name']])) or '-'}")
+        return
+
     print("Starting Financial Data Lab Pipeline Execution...")
-    
-    base_dir = os.path.dirname(os.path.abspath(__file__))
-    
-    # 1. Populate Depara Gestores
-    run_step(os.path.join(base_dir, 'data', 'populate_depara_gestores.py'), "Populating Manager Mapping (cvm.depara_gestores)")
-    
-    # 2. Update Complex Views (Phase 1)
-    # This creates cvm.ativos_carteira, cvm.cotas, cvm.peer, cvm.carteira
-    run_step(os.path.join(base_dir, 'data', 'update_complex_views.py'), "Creating/Updating Database Views (Phase 1)")
-
-    # 3. Create Allocator Tables (Phase 2)
-    # This creates the analytical tables in 'alocadores' schema
-    run_step(os.path.join(base_dir, 'data', 'create_allocator_tables.py'), "Creating Allocator Intelligence Tables (Phase 2)")
-
-    # 4. Generate Cache JSONs (Phase 3)
-    # This pre-calculates JSONs for specific funds to be served precisely by the API
-    run_step(os.path.join(base_dir, 'data', 'generate_cache_jsons.py'), "Generating Static JSON Cache (Phase 3)")
-
-    print("\n" + "="*50)
-    print("PIPELINE EXECUTION COMPLETED SUCCESSFULLY")
-    print("="*50)
+    if not run_pipeline(stages, workers=args.workers, force=args.force, resume=args.resume):
+        print("\nPIPELINE FAILED (use --resume para continuar a partir da etapa com erro)")
+        sys.exit(1)
+    print("\nPIPELINE EXECUTION COMPLETED SUCCESSFULLY")
     print("You can now start the API and Frontend servers.")
 
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,40 @@
+import sys
+import os
+
+# Path setup
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'data')))
+
+from create_indexes import _conjuncts, candidates_from_plan
+
+# Filters copied from EXPLAIN (FORMAT JSON, VERBOSE) on cvm.carteira / cvm.metrics
+FILTRO_DOIS = "((carteira.cnpj_fundo = '11.111.111/0001-11'::text) AND (carteira.dt_comptc = '2024-01-31'::date))"
+FILTRO_BASE = ("((carteira.dt_comptc > (CURRENT_DATE - '5 years'::interval)) "
+               "AND (carteira.peer = ANY ('{Ações,Multimercado,\"Renda Fixa\"}'::text[])) "
+               "AND (carteira.cliente <> carteira.gestor_cota) AND (NOT (hashed SubPlan 1)) "
+               "AND ((carteira.cliente)::text = 'KINEA'::text) "
+               "AND ((carteira.cliente_segmentado)::text = 'Kinea Prev'::text))")
+FILTRO_ANINHADO = ("((metrics.cnpj_fundo = '11.111.111/0001-11'::text) "
+                   "AND ((metrics.janela = ANY ('{6M,12M}'::text[])) AND (metrics.id_subclasse IS NULL)))")
+
+
+def _seq_scan(filtro, output=()):
+    return {'Node Type': 'Seq Scan', 'Schema': 'cvm', 'Relation Name': 'carteira',
+            'Filter': filtro, 'Output': list(output)}
+
+
+def test_conjuncts_filtro_explain():
+    assert _conjuncts(FILTRO_DOIS) == ["carteira.cnpj_fundo = '11.111.111/0001-11'",
+                                       "carteira.dt_comptc = '2024-01-31'"]
+    assert _conjuncts(FILTRO_ANINHADO) == ["metrics.cnpj_fundo = '11.111.111/0001-11'",
+                                           "metrics.janela = ANY ('{6M,12M}')",
+                                           "metrics.id_subclasse IS NULL"]
+
+
+def test_candidato_composto():
+    assert candidates_from_plan(_seq_scan(FILTRO_DOIS)) == [
+        ('cvm', 'carteira', ('cnpj_fundo', 'dt_comptc'), (), '')]
+
+    (_, _, chaves, _, _), = candidates_from_plan(_seq_scan(FILTRO_BASE, ['carteira.vl_merc_pos_final']))
+    # Igualdades primeiro ("= ANY" por último), depois um único termo de intervalo
+    assert chaves == ('cliente', 'cliente_segmentado', 'peer', 'dt_comptc')
@@ -0,0 +1,74 @@
+import sys
+import os
+import numpy as np
+import pandas as pd
+
+# Path setup
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from common.metrics import COLS_PREFIXO, prefix_sums
+
+
+def _cotas():
+    """Dois fundos; o segundo com duas subclasses e a cota da classe nas mesmas datas."""
+    datas = pd.bdate_range('2024-01-01', periods=60)
+    rng = np.random.default_rng(7)
+    partes = []
+    for cnpj, sub, inicio in [('11.111.111/0001-11', None, 0),
+                              ('22.222.222/0001-22', None, 5),
+                              ('22.222.222/0001-22', '1', 10),
+                              ('22.222.222/0001-22', '2', 0)]:
+        d = datas[inicio:]
+        partes.append(pd.DataFrame({
+            'cnpj_fundo': cnpj,
+            'id_subclasse': sub,
+            'dt_comptc': d,
+            'vl_quota': 100 * np.exp(np.cumsum(rng.normal(0, 0.01, len(d)))),
+        }))
+    # Embaralha para garantir que a ordem de chegada não importa
+    return pd.concat(partes, ignore_index=True).sample(frac=1, random_state=1)
+
+
+def _indice(inicio, drift):
+    datas = pd.bdate_range(inicio, periods=80)
+    return pd.Series(100 * np.exp(drift * np.arange(len(datas))), index=datas)
+
+
+def test_incremental_igual_ao_recalculo_completo():
+    cotas = _cotas()
+    cdi = _indice('2023-12-20', 0.0004)
+    ibov = _indice('2023-12-20', 0.001)
+
+    completo = prefix_sums(cotas, None, cdi, ibov)
+
+    corte = pd.Timestamp('2024-02-05')
+    primeira = prefix_sums(cotas[cotas['dt_comptc'] <= corte], None, cdi, ibov)
+    seeds = primeira.sort_values('dt_comptc').groupby(['cnpj_fundo', 'id_subclasse']).tail(1)
+    # As cotas antigas reenviadas são ignoradas a partir da seed de cada série
+    segunda = prefix_sums(cotas, seeds, cdi, ibov)
+
+    incremental = pd.concat([primeira, segunda], ignore_index=True)
+    chave = ['cnpj_fundo', 'id_subclasse', 'dt_comptc']
+    esperado = completo.sort_values(chave).reset_index(drop=True)
+    obtido = incremental.sort_values(chave).reset_index(drop=True)
+
+    assert list(obtido.columns) == COLS_PREFIXO
+    assert len(obtido) == len(cotas)
+    pd.testing.assert_frame_equal(obtido, esperado, check_dtype=False)
+
+
+def test_subclasses_sao_series_separadas():
+    cotas = _cotas()
+    out = prefix_sums(cotas)
+
+    series = out.groupby(['cnpj_fundo', 'id_subclasse']).size()
+    assert set(series.index) == {('11.111.111/0001-11', 'MASTER'), ('22.222.222/0001-22', 'MASTER'),
+                                 ('22.222.222/0001-22', '1'), ('22.222.222/0001-22', '2')}
+
+    # Cada série acumula só os próprios retornos
+    sub = cotas[cotas['id_subclasse'] == '1'].sort_values('dt_comptc')
+    ret = np.log(sub['vl_quota']).diff().dropna()
+    ultima = out[out['id_subclasse'] == '1'].sort_values('dt_comptc').iloc[-1]
+    assert ultima['n_ret'] == len(ret)
+    assert np.isclose(ultima['s_ret'], ret.sum())
+    assert np.isclose(ultima['s_ret2'], (ret ** 2).sum())
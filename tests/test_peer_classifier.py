@@ -0,0 +1,54 @@
+import sys
+import os
+import re
+import pandas as pd
+
+# Path setup
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from common.peer_classifier import REGRAS, FALLBACK_CLASSE, PEER_OUTROS, classify
+
+
+def _case_antigo(nome, classe, exclusivo):
+    """Tradução literal do CASE que montava cvm.peer: `~*` e ILIKE, sem mexer em acentos."""
+    def casa(padrao):
+        return nome is not None and re.search(padrao, nome, re.IGNORECASE) is not None
+
+    for r in REGRAS:
+        ok = casa(r.nome)
+        if ok and r.tambem:
+            ok = casa(r.tambem)
+        if ok and r.exceto:
+            ok = not casa(r.exceto)
+        if ok and r.classe:
+            ok = classe is not None and r.classe.lower() in classe.lower()
+        if ok or (r.ou_exclusivo and exclusivo == 'S'):
+            return r.peer
+    return FALLBACK_CLASSE.get(classe, PEER_OUTROS)
+
+
+AMOSTRA = [
+    # (denom_social, classe, fundo_exclusivo, peer esperado)
+    ('ITAU EMPRESAS DI', 'Fundo de Renda Fixa', 'N', 'Renda Fixa - RF Soberano'),
+    ('BB RF SUPREMO TESOURO', 'Fundo de Renda Fixa', 'N', 'Renda Fixa - RF Soberano'),
+    ('SANTANDER PRÉ FI', 'Fundo de Renda Fixa', 'N', 'Renda Fixa - RF Ativo (Prefixado)'),
+    ('XP IRF-M FI', 'Fundo de Renda Fixa', 'N', 'Renda Fixa - RF Ativo (Prefixado)'),
+    ('KINEA PREVIDÊNCIA CRÉDITO PRIVADO', 'Fundo de Renda Fixa', 'N', 'Previdência - Prev Crédito'),
+    ('VERDE AM AÇÕES FIC FIA', 'Fundo de Ações', 'N', 'Ações - FIA ESG / Sustentável'),
+    ('ALASKA BLACK FIC FIA', 'Fundo de Ações', 'N', 'Ações - FIA Long Only (Valor/Fundamentalista)'),
+    ('SPX NIMITZ FIC FIM', 'Fundo Multimercado', 'N', 'Multimercado - FoF Multimercado (Multigestor)'),
+    # Sem acento no nome, 'Ações' não casa (como no ~*): cai no fallback da classe
+    ('BRADESCO ACOES FI', 'Fundo de Ações', 'N', 'Ações - Ações Livre'),
+    ('FUNDO XYZ', 'Fundo Multimercado', 'S', 'Exclusivo - Fundo Exclusivo / Restrito'),
+    ('FUNDO XYZ', 'Fundo Multimercado', 'N', 'Multimercado - MM Macro'),
+    (None, None, 'N', PEER_OUTROS),
+]
+
+
+def test_amostra_segue_o_case_antigo():
+    df = pd.DataFrame(AMOSTRA, columns=['denom_social', 'classe', 'fundo_exclusivo', 'esperado'])
+    obtido = classify(df)
+    antigo = [_case_antigo(n, c, e) for n, c, e in zip(df['denom_social'], df['classe'], df['fundo_exclusivo'])]
+
+    assert antigo == list(df['esperado'])
+    assert list(obtido) == antigo